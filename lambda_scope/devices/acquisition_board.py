@@ -21,13 +21,18 @@ Options:
                                         [default: 1D3B333]
     --serial_num_daq0=SERIAL        Serial number of the daq device connected to cameras.
                                         [default: 1D17835]
+    --simulate                      Use simulated DAQ devices instead of the boards,
+                                        also set by LAMBDA_SIMULATE_DAQ=1.
+    --triggers_out=HOST:PORT        Socket address to publish the camera triggers of
+                                        the simulated DAQ.
 """
 
 from __future__ import absolute_import, division, print_function
 
+import os
 import time
 import json
-from typing import Tuple
+from typing import Tuple, Optional
 
 import zmq
 import numpy as np
@@ -36,9 +41,20 @@ from docopt import docopt
 from lambda_scope.zmq.publisher import Publisher
 from lambda_scope.zmq.utils import parse_host_and_port
 from lambda_scope.zmq.subscriber import ObjectSubscriber
-from lambda_scope.devices.ul_helpers.daq import DAQDevice
+from lambda_scope.devices.ul_helpers.sim_daq import SimulatedDAQDevice
 from lambda_scope.devices.utils import array_props_from_string
 
+WAVEFORM_CACHE_SIZE = 16
+RAMP_TOLERANCE = 0.01
+
+def laser_volts(power: np.ndarray) -> np.ndarray:
+    """Converts laser power percentages to control voltages."""
+    return np.where(power == 0, 0.0, 0.4 + 3.6 * (power - 1) / 99.0)
+
+def simulate_requested() -> bool:
+    """Returns whether LAMBDA_SIMULATE_DAQ asks for simulated devices."""
+    return os.environ.get("LAMBDA_SIMULATE_DAQ", "0").lower() not in ("", "0", "false")
+
 class PiezoCameraLaserDAQ():
     """This is a DAQ device that subscribes from message forwarder"""
 
@@ -49,7 +65,9 @@ class PiezoCameraLaserDAQ():
             fmt: str,
             serial_num_daq1: str,
             serial_num_daq0: str,
-            name="daq"):
+            name="daq",
+            simulate=False,
+            triggers: Optional[Tuple[str, int, bool]] = None):
 
         self.status = {}
         self.name = name
@@ -63,7 +81,10 @@ class PiezoCameraLaserDAQ():
         self.stack_size = self.shape[0]
         self.z_offset = 5.0 - self.stack_size * 0.05
         self.n_increments = 4
-
+        self.waveforms = {}
+        self.transaction = 0
+        self.npoints_daq0 = 0
+        self.npoints_daq1 = 0
 
         self.if_buffer = 0
         self.initiated_flag_camera = 0
@@ -71,8 +92,13 @@ class PiezoCameraLaserDAQ():
         self.device_status = 1
         self.laser_continuous = 0
 
-        self.daq0 = DAQDevice(serial_num_daq0, 0)
-        self.daq1 = DAQDevice(serial_num_daq1, 1)
+        if simulate:
+            self.daq0 = SimulatedDAQDevice(serial_num_daq0, 0, triggers=triggers)
+            self.daq1 = SimulatedDAQDevice(serial_num_daq1, 1)
+        else:
+            from lambda_scope.devices.ul_helpers.daq import DAQDevice
+            self.daq0 = DAQDevice(serial_num_daq0, 0)
+            self.daq1 = DAQDevice(serial_num_daq1, 1)
         for i in range(4):
             self.daq1.v_out(i, 0)
 
@@ -115,15 +141,13 @@ class PiezoCameraLaserDAQ():
         self.shape = (stack_size, self.shape[1], self.shape[2])
         self.stack_size = self.shape[0]
         self.z_offset = 5.0 - self.stack_size * 0.05
-        self._initialize()
-        self._prepare_daq(self.z_offset)
+        self._apply()
         self.publish_status()
 
     def set_voltage_step(self, voltagestep):
         """Sets the thickness of z steps."""
         self.voltage_step = voltagestep
-        self._initialize()
-        self._prepare_daq(self.z_offset)
+        self._apply()
         self.publish_status()
 
     def set_laser_continuous(self, is_continuous):
@@ -137,53 +161,141 @@ class PiezoCameraLaserDAQ():
     def set_exposure_time(self, exposure_time):
         """Set the closest valid exposure time."""
         self.n_increments = int((exposure_time // 5) * 2)
-        self._initialize()
-        self._prepare_daq(self.z_offset)
+        self._apply()
         self.publish_status()
 
     def set_laser(self, laser_idx, laser_power, laser_turn):
         """Sets the order that lasers are turned on, and the lasers power."""
         self.laser_power[laser_idx, laser_turn] = laser_power
+        self._apply()
+        self.publish_status()
+
+    def set_lasers(self, *powers):
+        """Sets the power of every laser at every turn with one rebuild of the
+        waveforms. powers are 16 values, ordered by laser and then turn."""
+        self.laser_power = np.array(powers, dtype=float).reshape(4, 4)
+        self._apply()
+        self.publish_status()
+
+    def begin(self):
+        """Starts a transaction. Setters only record their parameters until
+        commit applies them all at once. Transactions nest, e.g. configure
+        inside a mode switch, and only the outermost commit applies them."""
+        self.transaction += 1
+
+    def commit(self):
+        """Ends a transaction. The outermost commit rebuilds the buffers and
+        moves the piezo once for all changes made since its begin."""
+        self.transaction = max(self.transaction - 1, 0)
+        if self.transaction:
+            return
+        self._apply()
+        self.publish_status()
+
+    def configure(self, params):
+        """Applies several parameters in one transaction. params is a dict, or
+        its JSON without spaces, with any of the keys stack_size,
+        voltage_step, exposure_time, laser_continuous and laser_power, a 4x4
+        list ordered by laser and then turn."""
+
+        if isinstance(params, str):
+            params = json.loads(params)
+
+        self.begin()
+        try:
+            if "stack_size" in params:
+                self.set_stack_size(int(params["stack_size"]))
+            if "voltage_step" in params:
+                self.set_voltage_step(params["voltage_step"])
+            if "exposure_time" in params:
+                self.set_exposure_time(params["exposure_time"])
+            if "laser_continuous" in params:
+                self.set_laser_continuous(params["laser_continuous"])
+            if "laser_power" in params:
+                self.set_lasers(*np.ravel(params["laser_power"]))
+        finally:
+            self.commit()
+
+    def _apply(self):
+        """Rebuilds the buffers and moves the piezo, unless a transaction
+        defers this to its commit."""
+
+        if self.transaction:
+            return
+
         self._initialize()
         self._prepare_daq(self.z_offset)
-        self.publish_status()
 
     def _initialize(self):
-        """Sets the rate to a new value."""
+        """Sets the rate to a new value. The buffers are only reallocated if
+        their size changes."""
 
-        self.npoints_daq0 = 2 * self.n_increments * self.stack_size
-        self.npoints_daq1 = 4 * 4 * self.n_increments * self.stack_size
+        npoints_daq0 = 2 * self.n_increments * self.stack_size
+        npoints_daq1 = 4 * 4 * self.n_increments * self.stack_size
 
-        if self.if_buffer:
-            self.daq0.free_buffer()
-            self.daq1.free_buffer()
+        if not self.if_buffer or \
+                (npoints_daq0, npoints_daq1) != (self.npoints_daq0, self.npoints_daq1):
 
-        self.if_buffer = self.daq0.allocate_buffer(self.npoints_daq0) & \
-                         self.daq1.allocate_buffer(self.npoints_daq1)
+            if self.if_buffer:
+                self.daq0.free_buffer()
+                self.daq1.free_buffer()
+
+            self.npoints_daq0 = npoints_daq0
+            self.npoints_daq1 = npoints_daq1
+            self.if_buffer = self.daq0.allocate_buffer(self.npoints_daq0) & \
+                             self.daq1.allocate_buffer(self.npoints_daq1)
 
         self._prepare_data()
 
     def _prepare_data(self):
         """Create the output data array based on values of steps and period """
 
-        for i in range(self.stack_size):
-            for j in range(self.n_increments):
-                self.daq0.fill_ctypes_array(2 * (self.n_increments * i + j) + 0, self.z_offset + i * self.voltage_step)
-                self.daq0.fill_ctypes_array(2 * (self.n_increments * i + j) + 1, (j % self.n_increments == 0) * 4.0)
+        (counts0, counts1) = self._waveforms()
+        self.daq0.fill_ctypes_buffer(counts0)
+        self.daq1.fill_ctypes_buffer(counts1)
 
-        for i in range(4):
-            for j in range(self.stack_size):
-                for k in range(self.n_increments):
-                    for l in range(4):
-                        value = 0.0 if self.laser_power[l, i] == 0 else 0.4 + 3.6 * (self.laser_power[l, i] - 1) / 99.0
-                        self.daq1.fill_ctypes_array(4 * (i * self.n_increments * self.stack_size + self.n_increments * j + k) + l, value)
+    def _waveforms(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the output counts of both DAQs for the current parameters,
+        built once per set of parameters."""
+
+        key = (self.stack_size, self.n_increments, self.z_offset,
+               self.voltage_step, self.laser_power.tobytes())
+
+        if key not in self.waveforms:
+            if len(self.waveforms) >= WAVEFORM_CACHE_SIZE:
+                self.waveforms.pop(next(iter(self.waveforms)))
+            self.waveforms[key] = self._build_waveforms()
+
+        return self.waveforms[key]
+
+    def _build_waveforms(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Builds the output counts of both DAQs. daq0 interleaves the piezo
+        voltage of each plane with a camera trigger at its first increment.
+        daq1 interleaves the four lasers, for four turns of the whole stack."""
+
+        (planes, increments) = (self.stack_size, self.n_increments)
+
+        volts0 = np.zeros((planes, increments, 2))
+        volts0[:, :, 0] = (self.z_offset + np.arange(planes) * self.voltage_step)[:, None]
+        volts0[:, 0, 1] = 4.0
+
+        volts1 = np.broadcast_to(laser_volts(self.laser_power.T)[:, None, None, :],
+                                 (4, planes, increments, 4))
+
+        return (self.daq0.volts_to_counts(volts0.ravel()),
+                self.daq1.volts_to_counts(volts1.ravel()))
 
     def _prepare_daq(self, destination):
-        """Make the DAQ to initially output 0."""
+        """Make the DAQ to initially output 0, and ramp the piezo to
+        destination unless it is there already."""
 
         self.daq0.v_out(1, 0)
         cur_val_piezo = self.daq0.v_in(0)
         difference = destination - cur_val_piezo
+        if abs(difference) < RAMP_TOLERANCE:
+            self.daq0.v_out(0, destination)
+            return
+
         for i in range(100):
             self.daq0.v_out(0, cur_val_piezo + (difference/99)*i)
             time.sleep(0.005)
@@ -287,11 +399,17 @@ def main():
 
     arguments = docopt(__doc__)
 
+    triggers = None
+    if arguments["--triggers_out"] is not None:
+        triggers = parse_host_and_port(arguments["--triggers_out"])
+
     device = PiezoCameraLaserDAQ(commands=parse_host_and_port(arguments["--commands_in"]),
                                  outbound=parse_host_and_port(arguments["--status_out"]),
                                  fmt=arguments["--format"],
                                  serial_num_daq1=arguments["--serial_num_daq1"],
-                                 serial_num_daq0=arguments["--serial_num_daq0"])
+                                 serial_num_daq0=arguments["--serial_num_daq0"],
+                                 simulate=arguments["--simulate"] or simulate_requested(),
+                                 triggers=triggers)
 
     device.run()
 
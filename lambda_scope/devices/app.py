@@ -2530,9 +2530,9 @@ class LambdaApp():
         self.client.process("DO stop")
         self.client.process("DO _microfluidic_device_stop")
 
-        for i in range(4):
-            for j in range(4):
-                self.client.process("DO _daq_set_laser {} {} {}".format(i, self.gui_imaging_mode["laser_power"][i][j], j))
+        self.client.process("DO _daq_begin")
+        powers = [self.gui_imaging_mode["laser_power"][i][j] for i in range(4) for j in range(4)]
+        self.client.process("DO _daq_set_lasers " + " ".join(map(str, powers)))
         for i in range(13):
             self.client.process("DO _microfluidic_device_set_odor_valve {} {}".format(i, self.gui_microfluidic_mode["odor_valves"][i]))
             if self.gui_microfluidic_mode["odor_names"][i] == "":
@@ -2585,6 +2585,7 @@ class LambdaApp():
                                                                        self.gui_imaging_mode["top_microscope_data_shape"][2]))
         self.client.process("DO _daq_set_stack_size {}".format(self.gui_imaging_mode["top_microscope_data_shape"][0]))
         self.client.process("DO _daq_set_voltage_step {}".format(self.gui_imaging_mode["z_resolution_in_um"]))
+        self.client.process("DO _daq_commit")
         self.client.process("DO _dragonfly_set_filter 1 {}".format(self.gui_imaging_mode["filter1"]))
         self.client.process("DO _dragonfly_set_filter 2 {}".format(self.gui_imaging_mode["filter2"]))
         self.client.process("DO _data_hub_set_timer {} {}".format(self.gui_imaging_mode["total_volume"], self.gui_imaging_mode["rest_time"]))
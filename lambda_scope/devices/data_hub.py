@@ -24,6 +24,25 @@ Options:
                                             [default: UINT16_ZYX_25_512_1024]
     --name=NAME                         This name is used for commands subscription.
                                             [default: data_hub]
+    --transport=TRANSPORT               Transport for outbound array data, tcp or
+                                        shm to share volumes in shared memory.
+                                        shm does not support --data_policy=block.
+                                            [default: tcp]
+    --slots=N                           Number of volumes in the shared memory
+                                        ring. Readers that fall further behind
+                                        drop volumes.
+                                            [default: 4]
+    --data_hwm=N                        High-water mark of outbound array data.
+                                            [default: 1000]
+    --data_buffer_size=BYTES            Kernel send buffer size of outbound array
+                                        data, 0 for the OS default.
+                                            [default: 0]
+    --data_policy=POLICY                What to do when the high-water mark is
+                                        reached: drop-newest, drop-oldest or block.
+                                            [default: drop-newest]
+    --data_timeout=MS                   Send timeout of the block policy, -1 waits
+                                        forever.
+                                            [default: -1]
 """
 
 import time
@@ -37,6 +56,7 @@ from docopt import docopt
 from lambda_scope.zmq.publisher import Publisher
 from lambda_scope.zmq.subscriber import ObjectSubscriber
 from lambda_scope.zmq.array import TimestampedPublisher, Subscriber
+from lambda_scope.zmq.shared_memory import SharedMemoryPublisher
 from lambda_scope.devices.utils import array_props_from_string
 from lambda_scope.zmq.utils import parse_host_and_port
 
@@ -49,7 +69,13 @@ class DataHub():
             data_out: Tuple[str, int, bool],
             status_out: Tuple[str, int],
             fmt: str,
-            name: str):
+            name: str,
+            transport="tcp",
+            hwm=1000,
+            buffer_size=0,
+            policy="drop-newest",
+            timeout=-1,
+            slots=4):
 
         self.status = {}
         self.name = name
@@ -80,19 +106,38 @@ class DataHub():
             port=status_out[1],
             bound=status_out[2])
 
-        self.data_publisher = TimestampedPublisher(
-            host=self.data_out[0],
-            port=self.data_out[1],
-            datatype=self.dtype,
-            shape=self.shape,
-            bound=self.data_out[2])
+        if transport == "shm":
+            self.data_publisher = SharedMemoryPublisher(
+                host=self.data_out[0],
+                port=self.data_out[1],
+                datatype=self.dtype,
+                shape=self.shape,
+                bound=self.data_out[2],
+                slots=slots,
+                hwm=hwm,
+                buffer_size=buffer_size or None,
+                policy=policy,
+                timeout=timeout)
+        else:
+            self.data_publisher = TimestampedPublisher(
+                host=self.data_out[0],
+                port=self.data_out[1],
+                datatype=self.dtype,
+                shape=self.shape,
+                bound=self.data_out[2],
+                header=True,
+                hwm=hwm,
+                buffer_size=buffer_size or None,
+                policy=policy,
+                timeout=timeout)
 
         self.data_subscriber = Subscriber(
             host=self.data_in[0],
             port=self.data_in[1],
             datatype=self.dtype,
             shape=self.shape,
-            bound=self.data_in[2])
+            bound=self.data_in[2],
+            latest_only=True)
 
         self.poller.register(self.command_subscriber.socket, zmq.POLLIN)
         self.poller.register(self.data_subscriber.socket, zmq.POLLIN)
@@ -100,26 +145,21 @@ class DataHub():
         self.publish_status()
 
     def set_shape(self, z, y, x):
-        """Changes the shape of input and output array."""
+        """Changes the shape of input and output array. Outbound messages
+        carry their shape, so only the inbound socket is recreated."""
         self.shape = (z, y, x)
         self.poller.unregister(self.data_subscriber.socket)
 
-        self.data_publisher.socket.close()
+        self.data_publisher.set_shape(self.shape)
         self.data_subscriber.socket.close()
 
-        self.data_publisher = TimestampedPublisher(
-            host=self.data_out[0],
-            port=self.data_out[1],
-            datatype=self.dtype,
-            shape=self.shape,
-            bound=self.data_out[2])
-
         self.data_subscriber = Subscriber(
             host=self.data_in[0],
             port=self.data_in[1],
             datatype=self.dtype,
             shape=self.shape,
-            bound=self.data_in[2])
+            bound=self.data_in[2],
+            latest_only=True)
 
         self.poller.register(self.data_subscriber.socket, zmq.POLLIN)
         self.publish_status()
@@ -231,6 +271,8 @@ class DataHub():
     def update_status(self):
         """updates the status dictionary."""
         self.status["shape"] = self.shape
+        self.status["dropped"] = self.data_publisher.dropped
+        self.status["skipped"] = self.data_subscriber.skipped
         self.status["total_volume"] = self.imaging_volumes
         self.status["rest_time"] = self.resting_time
         self.status["running"] = self.subscription_status
@@ -254,7 +296,13 @@ def main():
         data_out=parse_host_and_port(args["--data_out"]),
         status_out=parse_host_and_port(args["--status_out"]),
         fmt=args["--format"],
-        name=args["--name"])
+        name=args["--name"],
+        transport=args["--transport"],
+        hwm=int(args["--data_hwm"]),
+        buffer_size=int(args["--data_buffer_size"]),
+        policy=args["--data_policy"],
+        timeout=int(args["--data_timeout"]),
+        slots=int(args["--slots"]))
 
     device.run()
 
@@ -5,7 +5,19 @@
 
 """
 This subscribes to a binary stream bound to a socket and displays each message
-as an image.
+as an image. Volumes are received, rendered and shown in separate threads, and
+at most max_fps volumes per second are rendered and shown; newer volumes
+replace ones that are still waiting.
+
+The projection shown is the three-view composite of maximum intensity
+projections, mip, or one of: plane z, a single plane; mean, the mean along z;
+slab z0 z1, the maximum along z of the planes z0 to z1; and roi y0 y1 x0 x1,
+the maximum along z of a region, zoomed. It is set with --projection, with
+the arguments joined by _, or with the set_projection command.
+
+With --headless there is no window. The renderings are encoded as jpeg or
+png instead, published on --preview_out as the parts name, metadata and image,
+and served at --http as /preview with a page that reloads it at /.
 
 Usage:
     displayer.py                    [options]
@@ -16,57 +28,156 @@ Options:
                                         [default: L5005]
     --commands=HOST:PORT            Connection to recieve messages.
                                         [default: L5001]
+    --status_out=HOST:PORT          Connection to publish status.
+                                        [default: L5000]
     --format=UINT16_ZYX_25_512_512  Size and type of image being sent.
                                         [default: UINT16_ZYX_25_512_1024]
     --name=STRING                   Name of image window.
                                         [default: displayer]
     --lookup_table=213_2004         Lookup table.
                                         [default: 0_4095]
+    --auto_contrast                 Set the lookup table from percentiles of a
+                                    running histogram of the projections.
+    --percentiles=1_99.9            Percentiles of the auto contrast bounds.
+                                        [default: 1_99.9]
+    --projection=MODE               Projection shown, e.g. mip, plane_12, mean,
+                                    slab_5_15 or roi_100_300_200_600.
+                                        [default: mip]
+    --transport=TRANSPORT           Transport for inbound messages, tcp or shm
+                                    to read volumes from shared memory.
+                                        [default: tcp]
+    --hwm=N                         High-water mark of inbound messages.
+                                        [default: 1000]
+    --buffer_size=BYTES             Kernel receive buffer size of inbound
+                                    messages, 0 for the OS default.
+                                        [default: 0]
+    --policy=POLICY                 What to do when the high-water mark is
+                                    reached: drop-newest, drop-oldest or block.
+                                        [default: drop-oldest]
+    --workers=N                     Threads computing the projections, 0 to
+                                    compute them in the main thread.
+                                        [default: 0]
+    --max_fps=FPS                   Most volumes rendered and shown per second.
+                                        [default: 15]
+    --status_interval=SECONDS       Time between status messages.
+                                        [default: 5]
+    --headless                      Encode renderings instead of showing a window.
+    --preview_out=HOST:PORT         Socket address to publish encoded renderings.
+    --http=HOST:PORT                Address to serve encoded renderings over HTTP.
+    --preview_format=FORMAT         Encoding of renderings, jpeg or png.
+                                        [default: jpeg]
+    --quality=N                     JPEG quality.
+                                        [default: 80]
+    --width=PIXELS                  Width of headless renderings.
+                                        [default: 540]
 """
 
+import time
+import json
+import threading
 from typing import Optional, Tuple
-from win32api import GetSystemMetrics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from win32api import GetSystemMetrics
+except ImportError:
+    GetSystemMetrics = None
 
-import cv2
+try:
+    import cv2
+except ImportError:
+    cv2 = None
 import zmq
 import numpy as np
 from docopt import docopt
 
+from lambda_scope.zmq.publisher import Publisher
 from lambda_scope.zmq.utils import parse_host_and_port
 from lambda_scope.zmq.subscriber import ObjectSubscriber
 from lambda_scope.zmq.array import TimestampedSubscriber
+from lambda_scope.zmq.shared_memory import SharedMemorySubscriber
 from lambda_scope.devices.utils import array_props_from_string
+from lambda_scope.devices.rendering import (
+    AutoContrast,
+    MIPRenderer,
+    composite_shape,
+    encode_image
+)
+
+# Page served at / by the preview server, which reloads the rendering.
+PREVIEW_PAGE = """<html><body style="margin:0;background:#000">
+<img id="preview" src="preview">
+<script>
+setInterval(function () {{
+    document.getElementById("preview").src = "preview?" + Date.now();
+}}, {interval});
+</script>
+</body></html>
+"""
 
 class Displayer:
     """This creates a displayer with 2 subscribers, one for images
-    and one for commands."""
+    and one for commands.
+
+    A receive thread keeps the newest volume, a render thread renders it at
+    most max_fps times per second, and the main thread handles commands and
+    shows the newest rendering in the window."""
     def __init__(
             self,
             inbound: Tuple[str, int],
             commands: Tuple[str, int, bool],
+            status_out: Tuple[str, int, bool],
             fmt: str,
             name: str,
-            lookup_table: Optional[Tuple[int, int]]):
+            lookup_table: Optional[Tuple[int, int]],
+            transport="tcp",
+            hwm=1000,
+            buffer_size=0,
+            policy="drop-oldest",
+            workers=0,
+            max_fps=15.0,
+            status_interval=5.0,
+            auto_contrast=False,
+            percentiles=(1.0, 99.9),
+            projection=("mip", )):
 
         (self.dtype, _, self.shape) = array_props_from_string(fmt)
-        self.mip_image = np.zeros((self.shape[1] + 4 * self.shape[0],
-                                   self.shape[2] + 4 * self.shape[0]), self.dtype)
-        self.yx_ratio = self.mip_image.shape[0] / self.mip_image.shape[1]
         self.dtype_max = np.iinfo(self.dtype).max
 
+        (self.screen_width, self.screen_height) = self.screen_size()
 
-        self.screen_width = GetSystemMetrics(0)
-        self.screen_height = GetSystemMetrics(1)
-
-        self.displayer_shape = [int(self.yx_ratio * self.screen_height // 2),
-                                int(self.screen_height // 2)]
-        self.displayed_img = cv2.resize(self.mip_image,
-                                        (self.displayer_shape[1], self.displayer_shape[0]))
+        self.displayer_shape = self.display_shape(self.shape)
+        self.renderer = MIPRenderer(self.shape, self.dtype, self.displayer_shape,
+                                    workers=workers)
+        self.status = {}
         self.name = name
         self.running = True
         self.inbound = inbound
         self.lookup_table = lookup_table
 
+        self.frame_interval = 1 / max_fps
+        self.status_interval = status_interval
+
+        # The render thread holds lock while it uses the renderer, and
+        # new_volume signals it that pending holds a volume. frame is the
+        # newest rendering, its timestamp and its number, and is only ever
+        # replaced as a whole.
+        self.lock = threading.RLock()
+        self.new_volume = threading.Condition()
+        self.pending = None
+        self.window_changed = False
+
+        self.received = 0
+        self.rendered = 0
+        self.shown = 0
+        self.shown_number = 0
+        self.replaced = 0
+        self.overwritten = 0
+        self.frame = (self.renderer.canvas.copy(), None, 0)
+        self.status_time = time.time()
+        self.status_shown = 0
+        self.latency = {"receive": 0.0, "render": 0.0, "show": 0.0, "total": 0.0}
+
         self.poller = zmq.Poller()
 
         self.command_subscriber = ObjectSubscriber(
@@ -76,21 +187,60 @@ class Displayer:
             port=commands[1],
             bound=commands[2])
 
-        self.data_subscriber = TimestampedSubscriber(
+        self.status_publisher = Publisher(
+            host=status_out[0],
+            port=status_out[1],
+            bound=status_out[2])
+
+        # Volumes from shared memory stay views of the ring. The render thread
+        # checks that their slot was not reused while it projected them.
+        self.shared_memory = transport == "shm"
+        if self.shared_memory:
+            subscriber_class = SharedMemorySubscriber
+        else:
+            subscriber_class = TimestampedSubscriber
+
+        self.data_subscriber = subscriber_class(
             host=self.inbound[0],
             port=self.inbound[1],
             shape=self.shape,
             datatype=self.dtype,
-            bound=self.inbound[2])
+            bound=self.inbound[2],
+            hwm=hwm,
+            buffer_size=buffer_size or None,
+            policy=policy)
 
         self.poller.register(self.command_subscriber.socket, zmq.POLLIN)
-        self.poller.register(self.data_subscriber.socket, zmq.POLLIN)
 
         try:
             self.sign = int(self.name[-1])
         except:
             self.sign =  0
 
+        self.show_window()
+
+        self.set_lookup_table(lookup_table[0], min(lookup_table[1], self.dtype_max))
+
+        self.auto_contrast = AutoContrast(self.dtype, *percentiles)
+        self.auto = auto_contrast
+
+        self.set_projection(*projection)
+
+    def screen_size(self) -> Tuple[int, int]:
+        """Returns the width and height of the screen."""
+        if GetSystemMetrics is None or cv2 is None:
+            raise RuntimeError("The displayer window needs win32api and OpenCV, "
+                               "use --headless instead.")
+        return (GetSystemMetrics(0), GetSystemMetrics(1))
+
+    def display_shape(self, shape):
+        """Returns the size of the window for volumes of the given shape."""
+        (height, width) = composite_shape(shape)
+        return (int(height / width * self.screen_height // 2),
+                int(self.screen_height // 2))
+
+    def show_window(self):
+        """Creates or resizes the window."""
         self.corner_x = int((self.sign%2) * self.screen_width // 2)
         self.corner_y = int(0.3 * self.screen_height)
 
@@ -98,74 +248,303 @@ class Displayer:
         cv2.moveWindow(self.name, self.corner_x, self.corner_y)
         cv2.resizeWindow(self.name, self.displayer_shape[1], self.displayer_shape[0])
 
-        self.set_lookup_table(lookup_table[0], min(lookup_table[1], np.iinfo(self.dtype).max))
-
     def set_lookup_table(self, lut_low, lut_high):
-        self.lookup_table = (lut_low, lut_high)
-        self.scale = 1 / (self.lookup_table[1] - self.lookup_table[0])
+        """Rebuilds the lookup table of the renderer, and turns auto contrast
+        off."""
+        with self.lock:
+            self.auto = False
+            self.lookup_table = (lut_low, lut_high)
+            self.renderer.set_lookup_table(lut_low, lut_high)
+
+    def set_auto_contrast(self, enabled, low_percentile=None, high_percentile=None):
+        """Turns auto contrast on or off, optionally with new percentiles."""
+        with self.lock:
+            if low_percentile is not None and high_percentile is not None:
+                self.auto_contrast.set_percentiles(low_percentile, high_percentile)
+            if enabled and not self.auto:
+                self.auto_contrast.reset()
+            self.auto = bool(enabled)
+
+    def set_projection(self, mode, *args):
+        """Selects the projection shown: mip, plane z, mean, slab z0 z1 or
+        roi y0 y1 x0 x1."""
+        with self.lock:
+            self.renderer.set_projection(mode, *args)
+            self.auto_contrast.reset()
 
     def set_shape(self, z, y, x):
-        self.poller.unregister(self.data_subscriber.socket)
+        """Changes the shape of the volumes. The window is resized by the
+        main thread."""
+        with self.lock:
+            self.shape = (z, y, x)
 
-        self.shape = (z, y, x)
+            self.data_subscriber.set_shape(self.shape)
 
-        self.data_subscriber.set_shape(self.shape)
+            self.displayer_shape = self.display_shape(self.shape)
+            self.renderer.set_shape(self.shape, self.displayer_shape)
+            self.frame = (self.renderer.canvas.copy(), None, self.frame[2])
+            self.window_changed = True
 
-        self.mip_image = np.zeros((self.shape[1] + 4 * self.shape[0],
-                                   self.shape[2] + 4 * self.shape[0]), np.uint8)
-        self.yx_ratio = self.mip_image.shape[0] / self.mip_image.shape[1]
-        self.displayer_shape = [int(self.yx_ratio * self.screen_height // 2),
-                                int(self.screen_height // 2)]
-        self.displayed_img = cv2.resize(self.mip_image,
-                                        (self.displayer_shape[1], self.displayer_shape[0]))
-        self.poller.register(self.data_subscriber.socket, zmq.POLLIN)
+    def receive(self):
+        """Receives volumes and keeps the newest in pending. A volume that
+        is replaced before it is rendered counts as replaced."""
 
-        self.corner_x = int((self.sign%2) * self.screen_width // 2)
-        self.corner_y = int(0.3 * self.screen_height)
+        poller = zmq.Poller()
+        poller.register(self.data_subscriber.socket, zmq.POLLIN)
 
-        cv2.namedWindow(self.name)
-        cv2.moveWindow(self.name, self.corner_x, self.corner_y)
-        cv2.resizeWindow(self.name, self.displayer_shape[1], self.displayer_shape[0])
+        while self.running:
+            if not poller.poll(100):
+                continue
+
+            msg = self.data_subscriber.get_last()
+            if msg is None:
+                continue
+
+            slot = self.data_subscriber.slot if self.shared_memory else None
+            with self.new_volume:
+                if self.pending is not None:
+                    self.replaced += 1
+                self.pending = (msg[0], time.time(), msg[1], slot)
+                self.received += 1
+                self.new_volume.notify()
+
+    def render(self):
+        """Renders the newest volume, at most once per frame interval. A
+        volume from shared memory whose slot is reused while it is projected
+        is discarded and counted as dropped."""
+
+        next_time = 0
+        while self.running:
+            time.sleep(max(0, next_time - time.time()))
+
+            with self.new_volume:
+                while self.running and self.pending is None:
+                    self.new_volume.wait(0.1)
+                if self.pending is None:
+                    continue
+                (timestamp, received, volume, slot) = self.pending
+                self.pending = None
+
+            start = time.time()
+            next_time = start + self.frame_interval
+            with self.lock:
+                if volume.shape != tuple(self.shape):
+                    self.set_shape(*volume.shape)
+
+                image = self.renderer.project(volume)
+                if slot is not None and not self.data_subscriber.valid(slot):
+                    self.overwritten += 1
+                    continue
+                if self.auto:
+                    lookup_table = self.auto_contrast.update(image)
+                    if lookup_table is not None:
+                        self.lookup_table = lookup_table
+                        self.renderer.set_lookup_table(*lookup_table)
+                self.renderer.draw()
+                self.rendered += 1
+                self.frame = (self.renderer.canvas.copy(), timestamp, self.rendered)
+
+            self.update_latency("receive", received - timestamp)
+            self.update_latency("render", time.time() - start)
+
+    def update_latency(self, stage: str, seconds: float):
+        """Updates the moving average of the latency of a stage."""
+        self.latency[stage] += 0.1 * (1000 * seconds - self.latency[stage])
 
     def process(self):
-        msg = self.data_subscriber.get_last()
+        """Shows the newest rendering if it has not been shown yet."""
 
-        if msg is not None:
-            mip_z = np.max(msg[1], axis=0)
-            mip_y = np.max(msg[1], axis=1)
-            mip_x = np.max(msg[1], axis=2)
+        if self.window_changed:
+            self.window_changed = False
+            self.show_window()
 
-            mip_z = (255 * np.clip((mip_z - self.lookup_table[0]) * self.scale, 0, 1)).astype(np.uint8)
-            mip_y = (255 * np.clip((mip_y - self.lookup_table[0]) * self.scale, 0, 1)).astype(np.uint8)
-            mip_x = (255 * np.clip((mip_x - self.lookup_table[0]) * self.scale, 0, 1)).astype(np.uint8)
+        (image, timestamp, number) = self.frame
 
-            scaled_mip_y = np.repeat(mip_y, 4, axis=0)
-            scaled_mip_x = np.repeat(mip_x, 4, axis=0)
-            t_scaled_mip_x = np.transpose(scaled_mip_x)
+        start = time.time()
+        cv2.imshow(self.name, image)
+        cv2.waitKey(1)
 
-            self.mip_image[:self.shape[1], :self.shape[2]] = mip_z
-            self.mip_image[:self.shape[1], self.shape[2]:] = t_scaled_mip_x
-            self.mip_image[self.shape[1]:, :self.shape[2]] = scaled_mip_y
+        if timestamp is not None and number != self.shown_number:
+            self.shown_number = number
+            self.shown += 1
+            self.update_latency("show", time.time() - start)
+            self.update_latency("total", time.time() - timestamp)
 
-            self.displayed_img = cv2.resize(self.mip_image,
-                                            (self.displayer_shape[1], self.displayer_shape[0]))
+    def run(self):
+        """Handles commands and shows renderings in the main thread, which
+        owns the window, while the other threads receive and render."""
 
-        cv2.imshow(self.name, self.displayed_img)
-        cv2.waitKey(1)
+        threads = [threading.Thread(target=self.receive, daemon=True),
+                   threading.Thread(target=self.render, daemon=True)]
+        for thread in threads:
+            thread.start()
 
-    def run(self):
+        next_frame = time.time()
         while self.running:
 
-            sockets = dict(self.poller.poll())
+            timeout = max(0, 1000 * (next_frame - time.time()))
+            sockets = dict(self.poller.poll(timeout))
 
             if self.command_subscriber.socket in sockets:
                 self.command_subscriber.handle()
 
-            elif self.data_subscriber.socket in sockets:
+            if time.time() >= next_frame:
                 self.process()
+                next_frame = max(next_frame + self.frame_interval, time.time())
+
+            if time.time() - self.status_time >= self.status_interval:
+                self.publish_status()
+
+        for thread in threads:
+            thread.join()
+        self.renderer.close()
+
+    def update_status(self):
+        """Updates the status dictionary. fps is the rate of volumes shown
+        since the last update."""
+
+        now = time.time()
+        elapsed = now - self.status_time
+        shown = self.shown - self.status_shown
+        self.status_time = now
+        self.status_shown = self.shown
+
+        self.status["shape"] = list(self.shape)
+        self.status["lookup_table"] = list(self.lookup_table)
+        self.status["auto_contrast"] = int(self.auto)
+        self.status["projection"] = list(self.renderer.projection)
+        self.status["fps"] = round(shown / elapsed, 2) if elapsed > 0 else 0
+        self.status["received"] = self.received
+        self.status["rendered"] = self.rendered
+        self.status["skipped"] = self.replaced + self.data_subscriber.skipped
+        self.status["dropped"] = self.data_subscriber.dropped + self.overwritten
+        self.status["latency_ms"] = {stage: round(value, 2)
+                                     for (stage, value) in self.latency.items()}
+        self.status["device"] = int(self.running)
+
+    def publish_status(self):
+        """Publishes the status to the hub and logger."""
+        self.update_status()
+        self.status_publisher.send("hub " + json.dumps({self.name: self.status}, default=int))
+        self.status_publisher.send("logger " + json.dumps({self.name: self.status}, default=int))
 
     def shutdown(self):
         self.running = False
+        self.publish_status()
+
+class PreviewServer(Displayer):
+    """This is a displayer without a window. Renderings are encoded at most
+    max_fps times per second, and are published on preview_out and served
+    over HTTP at http, if they are set."""
+
+    def __init__(
+            self,
+            *args,
+            preview_out: Optional[Tuple[str, int, bool]] = None,
+            http: Optional[Tuple[str, int]] = None,
+            image_format="jpeg",
+            quality=80,
+            width=540,
+            **kwargs):
+
+        self.image_format = image_format
+        self.quality = quality
+        self.width = width
+        self.preview = None
+        self.encoded_bytes = 0
+
+        encode_image(np.zeros((8, 8), np.uint8), image_format, quality)
+
+        Displayer.__init__(self, *args, **kwargs)
+
+        self.preview_publisher = None
+        if preview_out is not None:
+            self.preview_publisher = Publisher(
+                host=preview_out[0],
+                port=preview_out[1],
+                bound=preview_out[2])
+
+        self.http_server = None
+        if http is not None:
+            self.http_server = ThreadingHTTPServer(http, self.request_handler())
+            self.http_server.daemon_threads = True
+            threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+
+    def screen_size(self) -> Tuple[int, int]:
+        return (0, 0)
+
+    def display_shape(self, shape):
+        """Returns the size of the renderings, which are width wide."""
+        (height, width) = composite_shape(shape)
+        return (max(int(height / width * self.width), 1), self.width)
+
+    def show_window(self):
+        pass
+
+    def process(self):
+        """Encodes the newest rendering and publishes it, if it has not been
+        encoded yet."""
+
+        (image, timestamp, number) = self.frame
+        if timestamp is None or number == self.shown_number:
+            return
+
+        start = time.time()
+        buf = encode_image(image, self.image_format, self.quality)
+        self.preview = buf
+        self.encoded_bytes = len(buf)
+
+        if self.preview_publisher is not None:
+            metadata = {"timestamp": timestamp,
+                        "shape": list(image.shape),
+                        "format": self.image_format}
+            self.preview_publisher.socket.send_multipart(
+                [self.name.encode(), json.dumps(metadata).encode(), buf])
+
+        self.shown_number = number
+        self.shown += 1
+        self.update_latency("show", time.time() - start)
+        self.update_latency("total", time.time() - timestamp)
+
+    def request_handler(self):
+        """Returns a handler class for the HTTP server of this displayer."""
+
+        server = self
+        content_type = "image/" + self.image_format
+
+        class PreviewHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/":
+                    body = PREVIEW_PAGE.format(
+                        interval=int(1000 * server.frame_interval)).encode()
+                    self.reply(body, "text/html")
+                elif self.path.split("?")[0] == "/preview" and server.preview is not None:
+                    self.reply(server.preview, content_type)
+                else:
+                    self.send_error(404)
+
+            def reply(self, body: bytes, body_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", body_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return PreviewHandler
+
+    def update_status(self):
+        Displayer.update_status(self)
+        self.status["encoded_bytes"] = self.encoded_bytes
+
+    def shutdown(self):
+        Displayer.shutdown(self)
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
 
 def main():
     """CLI entry point."""
@@ -177,11 +556,41 @@ def main():
         lookup_table = tuple(map(int, lookup_table.split("_")))
 
 
-    device = Displayer(inbound=parse_host_and_port(args["--inbound"]),
-                       commands=parse_host_and_port(args["--commands"]),
-                       fmt=args["--format"],
-                       name=args["--name"],
-                       lookup_table=lookup_table)
+    kwargs = dict(inbound=parse_host_and_port(args["--inbound"]),
+                  commands=parse_host_and_port(args["--commands"]),
+                  status_out=parse_host_and_port(args["--status_out"]),
+                  fmt=args["--format"],
+                  name=args["--name"],
+                  lookup_table=lookup_table,
+                  transport=args["--transport"],
+                  hwm=int(args["--hwm"]),
+                  buffer_size=int(args["--buffer_size"]),
+                  policy=args["--policy"],
+                  workers=int(args["--workers"]),
+                  max_fps=float(args["--max_fps"]),
+                  status_interval=float(args["--status_interval"]),
+                  auto_contrast=args["--auto_contrast"],
+                  percentiles=tuple(map(float, args["--percentiles"].split("_"))),
+                  projection=args["--projection"].split("_"))
+
+    if args["--headless"]:
+        preview_out = args["--preview_out"]
+        if preview_out is not None:
+            preview_out = parse_host_and_port(preview_out)
+
+        http = args["--http"]
+        if http is not None:
+            (host, port) = http.split(":")
+            http = (host, int(port))
+
+        device = PreviewServer(preview_out=preview_out,
+                               http=http,
+                               image_format=args["--preview_format"],
+                               quality=int(args["--quality"]),
+                               width=int(args["--width"]),
+                               **kwargs)
+    else:
+        device = Displayer(**kwargs)
 
     device.run()
 
@@ -153,9 +153,21 @@ class LambdaHub(Hub):
     def _daq_set_laser(self, idx, power, position):
         self.send("daq set_laser {} {} {}".format(idx, power, position))
 
+    def _daq_set_lasers(self, *powers):
+        self.send("daq set_lasers " + " ".join(map(str, powers)))
+
     def _daq_stop(self):
         self.send("daq stop")
 
+    def _daq_begin(self):
+        self.send("daq begin")
+
+    def _daq_commit(self):
+        self.send("daq commit")
+
+    def _daq_configure(self, params):
+        self.send("daq configure {}".format(params))
+
     def _daq_set_green_laser(self, power_percentage):
         self.send("daq set_green_laser {}".format(power_percentage))
 
@@ -182,6 +194,16 @@ class LambdaHub(Hub):
             name = "top_displayer{}".format(i)
             self.send("{} set_lookup_table {} {}".format(name, lut_low, lut_high))
 
+    def _displayer_set_auto_contrast(self, enabled):
+        for i in self.zyla_cameras:
+            name = "top_displayer{}".format(i)
+            self.send("{} set_auto_contrast {}".format(name, enabled))
+
+    def _displayer_set_projection(self, mode, *args):
+        for i in self.zyla_cameras:
+            name = "top_displayer{}".format(i)
+            self.send(" ".join(map(str, (name, "set_projection", mode) + args)))
+
     def _displayer_set_shape(self, z, y, x):
         for i in self.zyla_cameras:
             name = "top_displayer{}".format(i)
@@ -192,6 +214,11 @@ class LambdaHub(Hub):
             name = "top_displayer{}".format(i)
             self.send("{} shutdown".format(name))
 
+    def _displayer_publish_status(self):
+        for i in self.zyla_cameras:
+            name = "top_displayer{}".format(i)
+            self.send("{} publish_status".format(name))
+
     def _stage_displayer_set_lookup_table(self, lut_low, lut_high):
         for i in self.flir_cameras:
             name = "bottom_displayer{}".format(i)
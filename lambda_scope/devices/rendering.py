@@ -0,0 +1,358 @@
+#! python
+#
+# Copyright 2021
+# Author: Mahdi Torkashvand, Vivek Venkatachalam
+
+"""This renders volumes as the three-view composite of the displayers: the
+projection along z in the top left, and the projections along x and y,
+stretched along z, to its right and below it. Other projections draw a single
+image in place of the projection along z."""
+
+import zlib
+import struct
+from typing import Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Each plane of the side projections is drawn this many pixels thick.
+Z_SCALE = 4
+
+# Projections and the number of their arguments: the three-view composite, a
+# single plane z, the mean along z, the projection along z of the planes z0
+# to z1, and the projection along z of the region y0:y1, x0:x1, zoomed.
+PROJECTIONS = {"mip": 0, "plane": 1, "mean": 0, "slab": 2, "roi": 4}
+
+
+def composite_shape(shape: Tuple[int, int, int], z_scale=Z_SCALE) -> Tuple[int, int]:
+    """Return the shape of the composite of a volume of the given shape."""
+    return (shape[1] + z_scale * shape[0], shape[2] + z_scale * shape[0])
+
+def lookup_table(lut_low: float, lut_high: float, dtype: np.dtype) -> np.ndarray:
+    """Return a table mapping every value of an integer dtype to uint8, which
+    clips values to [lut_low, lut_high] and rescales them to [0, 255]."""
+
+    values = np.arange(np.iinfo(dtype).max + 1, dtype=np.float64)
+    scale = 1 / max(lut_high - lut_low, 1)
+    return (255 * np.clip((values - lut_low) * scale, 0, 1)).astype(np.uint8)
+
+def png_chunk(tag: bytes, data: bytes) -> bytes:
+    """Return a PNG chunk with its length and checksum."""
+    return struct.pack(">I", len(data)) + tag + data + \
+           struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+def encode_png(image: np.ndarray, level=1) -> bytes:
+    """Encode a uint8 grayscale image as PNG without OpenCV."""
+
+    (height, width) = image.shape
+    rows = np.zeros((height, width + 1), np.uint8)
+    rows[:, 1:] = image
+
+    return b"\x89PNG\r\n\x1a\n" + \
+           png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)) + \
+           png_chunk(b"IDAT", zlib.compress(rows.tobytes(), level)) + \
+           png_chunk(b"IEND", b"")
+
+def encode_image(image: np.ndarray, image_format="jpeg", quality=80) -> bytes:
+    """Encode a uint8 image as jpeg or png. JPEG needs OpenCV."""
+
+    if image_format == "png":
+        if cv2 is None:
+            return encode_png(image)
+        (_, buf) = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        return buf.tobytes()
+
+    if image_format == "jpeg":
+        if cv2 is None:
+            raise ValueError("JPEG images need OpenCV, use png instead.")
+        (_, buf) = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buf.tobytes()
+
+    raise ValueError("Unknown image format {}.".format(image_format))
+
+def nearest_indices(n_out: int, n_in: int) -> np.ndarray:
+    """Return the input index nearest to each output pixel when n_in pixels
+    are resized to n_out."""
+    return ((np.arange(n_out) + 0.5) * n_in / n_out).astype(np.intp)
+
+
+class AutoContrast():
+    """This keeps a histogram of projections, decayed by decay with every
+    frame, and derives a lookup table from its low and high percentiles.
+
+    Values are binned by dropping low bits, so the histogram has at most bins
+    bins and a frame costs one bincount of every stride-th pixel in y and x.
+    New bounds are only returned when one of them moves by more than
+    threshold times the width of the current table."""
+
+    def __init__(
+            self,
+            dtype: np.dtype,
+            low_percentile=1.0,
+            high_percentile=99.9,
+            decay=0.9,
+            threshold=0.05,
+            bins=1024,
+            stride=2):
+
+        n_values = np.iinfo(dtype).max + 1
+        self.shift = max(int(np.log2(n_values / bins)), 0)
+        self.bins = n_values >> self.shift
+        self.histogram = np.zeros(self.bins, np.float64)
+
+        self.percentiles = (low_percentile, high_percentile)
+        self.decay = decay
+        self.threshold = threshold
+        self.stride = stride
+        self.lookup_table = None
+
+    def set_percentiles(self, low_percentile, high_percentile):
+        self.percentiles = (low_percentile, high_percentile)
+        self.lookup_table = None
+
+    def reset(self):
+        """Forgets the histogram of earlier frames."""
+        self.histogram[...] = 0
+        self.lookup_table = None
+
+    def bounds(self) -> Tuple[int, int]:
+        """Returns the values at the percentiles of the histogram."""
+
+        cdf = np.cumsum(self.histogram)
+        targets = np.array(self.percentiles) / 100 * cdf[-1]
+        (low, high) = np.searchsorted(cdf, targets)
+        lut_low = int(low) << self.shift
+        lut_high = max(int(high + 1) << self.shift, lut_low + 1)
+        return (lut_low, lut_high)
+
+    def update(self, image: np.ndarray) -> Optional[Tuple[int, int]]:
+        """Adds an image to the histogram, and returns a new lookup table if
+        the bounds moved past the threshold, or None."""
+
+        sample = image[::self.stride, ::self.stride]
+        counts = np.bincount((sample >> self.shift).ravel(), minlength=self.bins)
+        self.histogram *= self.decay
+        self.histogram += (1 - self.decay) * counts / sample.size
+
+        (lut_low, lut_high) = self.bounds()
+        if self.lookup_table is not None:
+            (old_low, old_high) = self.lookup_table
+            tolerance = self.threshold * (old_high - old_low)
+            if abs(lut_low - old_low) <= tolerance and abs(lut_high - old_high) <= tolerance:
+                return None
+
+        self.lookup_table = (lut_low, lut_high)
+        return self.lookup_table
+
+
+class MIPRenderer():
+    """This computes the three maximum intensity projections of a volume in
+    one pass over its planes, and draws them through a lookup table straight
+    into a canvas at display resolution.
+
+    Each plane is reduced along y and x and merged into the projection along
+    z while it is in cache. With workers, ranges of planes are reduced on a
+    pool of threads and their projections along z are merged at the end.
+
+    The other projections are drawn alone, and only read the pixels of the
+    planes they need that land on the canvas: a plane projection reads one
+    plane, a slab projection the planes of the slab."""
+
+    def __init__(
+            self,
+            shape: Tuple[int, int, int],
+            dtype: np.dtype,
+            display_shape: Tuple[int, int],
+            lookup_table: Tuple[int, int] = (0, 4095),
+            workers=0,
+            z_scale=Z_SCALE):
+
+        self.dtype = np.dtype(dtype)
+        self.z_scale = z_scale
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(workers) if workers > 1 else None
+        self.projection = ("mip", )
+
+        self.set_lookup_table(*lookup_table)
+        self.set_shape(shape, display_shape)
+
+    def set_lookup_table(self, lut_low, lut_high):
+        """Rebuilds the lookup table."""
+        self.lookup_table = (lut_low, lut_high)
+        self.lut = lookup_table(lut_low, lut_high, self.dtype)
+
+    def set_shape(self, shape: Tuple[int, int, int],
+                  display_shape: Optional[Tuple[int, int]] = None):
+        """Reallocates the projections for volumes of a new shape, and the
+        canvas if a new display shape is given."""
+
+        self.shape = tuple(shape)
+        (z, y, x) = self.shape
+
+        self.mip_z = np.zeros((y, x), self.dtype)
+        self.mip_y = np.zeros((z, x), self.dtype)
+        self.mip_x = np.zeros((z, y), self.dtype)
+
+        n_ranges = min(max(self.workers, 1), z)
+        self.bounds = np.linspace(0, z, n_ranges + 1).astype(int)
+        self.partial_mip_z = [self.mip_z] + \
+                             [np.zeros((y, x), self.dtype) for _ in range(n_ranges - 1)]
+
+        if display_shape is not None:
+            self.display_shape = tuple(display_shape)
+            self.canvas = np.zeros(self.display_shape, np.uint8)
+
+        (height, width) = composite_shape(self.shape, self.z_scale)
+        rows = nearest_indices(self.display_shape[0], height)
+        cols = nearest_indices(self.display_shape[1], width)
+
+        self.n_top = int(np.searchsorted(rows, y))
+        self.n_left = int(np.searchsorted(cols, x))
+        self.y_rows = rows[:self.n_top]
+        self.x_cols = cols[:self.n_left]
+        self.z_rows = (rows[self.n_top:] - y) // self.z_scale
+        self.z_cols = (cols[self.n_left:] - x) // self.z_scale
+
+        self.set_projection(*self.projection)
+
+    def set_projection(self, mode: str, *args):
+        """Selects the projection drawn, one of PROJECTIONS with its
+        arguments. Ranges are clipped to the volume."""
+
+        if mode not in PROJECTIONS:
+            raise ValueError("Unknown projection {}, use one of {}.".format(
+                mode, ", ".join(PROJECTIONS)))
+        if len(args) != PROJECTIONS[mode]:
+            raise ValueError("Projection {} takes {} arguments.".format(
+                mode, PROJECTIONS[mode]))
+
+        (z, y, x) = self.shape
+        (rows, cols) = (self.y_rows, self.x_cols)
+        (z0, z1, x0, x1) = (0, z, 0, x)
+        args = [int(arg) for arg in args]
+
+        if mode == "plane":
+            z0 = min(max(args[0], 0), z - 1)
+            (z1, args) = (z0 + 1, [z0])
+        elif mode == "slab":
+            z0 = min(max(args[0], 0), z - 1)
+            z1 = min(max(args[1], z0 + 1), z)
+            args = [z0, z1]
+        elif mode == "roi":
+            y0 = min(max(args[0], 0), y - 1)
+            x0 = min(max(args[2], 0), x - 1)
+            (y1, x1) = (min(max(args[1], y0 + 1), y), min(max(args[3], x0 + 1), x))
+            args = [y0, y1, x0, x1]
+
+            # The region is zoomed to fill the place of the projection along
+            # z, keeping its aspect ratio.
+            scale = min(self.n_top / (y1 - y0), self.n_left / (x1 - x0))
+            rows = y0 + nearest_indices(max(int(round((y1 - y0) * scale)), 1), y1 - y0)
+            cols = x0 + nearest_indices(max(int(round((x1 - x0) * scale)), 1), x1 - x0)
+
+        # Only the rows of the planes z0 to z1 that land on the canvas are
+        # read, between x0 and x1, and reduced before the columns are taken.
+        self.projection = (mode, *args)
+        self.view_planes = (z0, z1)
+        self.view_span = slice(x0, x1)
+        self.view_rows = rows
+        self.view_cols = cols - x0
+        self.view = np.zeros((len(rows), len(cols)), self.dtype)
+        self.view_buffer = np.zeros((len(rows), x1 - x0), self.dtype)
+        if mode == "mean":
+            total_dtype = np.uint32 if self.dtype.itemsize <= 2 else np.uint64
+            self.view_total = np.zeros((len(rows), x1 - x0), total_dtype)
+        else:
+            self.view_total = np.zeros((len(rows), x1 - x0), self.dtype)
+
+        self.canvas[...] = 0
+
+    def _project_planes(self, i: int, z0: int, z1: int):
+        """Reduces the planes z0 to z1 into the side projections and the i-th
+        partial projection along z."""
+
+        mip_z = self.partial_mip_z[i]
+        np.copyto(mip_z, self.volume[z0])
+        for z in range(z0, z1):
+            plane = self.volume[z]
+            np.maximum(mip_z, plane, out=mip_z)
+            plane.max(axis=0, out=self.mip_y[z])
+            plane.max(axis=1, out=self.mip_x[z])
+
+    def _take_rows(self, plane: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """Copies the rows of a plane that land on the canvas into out."""
+        return np.take(plane[:, self.view_span], self.view_rows, axis=0, out=out)
+
+    def _project_view(self, volume: np.ndarray):
+        """Computes the single image of the projections other than mip."""
+
+        (mode, (z0, z1)) = (self.projection[0], self.view_planes)
+        if mode == "plane":
+            self._take_rows(volume[z0], self.view_buffer)
+            np.take(self.view_buffer, self.view_cols, axis=1, out=self.view)
+            return
+
+        self.view_total[...] = self._take_rows(volume[z0], self.view_buffer)
+        for z in range(z0 + 1, z1):
+            rows = self._take_rows(volume[z], self.view_buffer)
+            if mode == "mean":
+                np.add(self.view_total, rows, out=self.view_total)
+            else:
+                np.maximum(self.view_total, rows, out=self.view_total)
+
+        total = np.take(self.view_total, self.view_cols, axis=1)
+        if mode == "mean":
+            total = (total + (z1 - z0) // 2) // (z1 - z0)
+        np.copyto(self.view, total, casting="unsafe")
+
+    def project(self, volume: np.ndarray) -> np.ndarray:
+        """Computes the projections of a volume, and returns the image drawn
+        in the top left: the projection along z or the single image."""
+
+        if self.projection[0] != "mip":
+            self._project_view(volume)
+            return self.view
+
+        self.volume = volume
+        ranges = list(zip(self.bounds[:-1], self.bounds[1:]))
+        if self.pool is None:
+            for (i, (z0, z1)) in enumerate(ranges):
+                self._project_planes(i, z0, z1)
+        else:
+            jobs = [self.pool.submit(self._project_planes, i, z0, z1)
+                    for (i, (z0, z1)) in enumerate(ranges)]
+            for job in jobs:
+                job.result()
+        for partial in self.partial_mip_z[1:]:
+            np.maximum(self.mip_z, partial, out=self.mip_z)
+        self.volume = None
+
+        return self.mip_z
+
+    def draw(self) -> np.ndarray:
+        """Draws the projections into the canvas."""
+
+        if self.projection[0] != "mip":
+            (height, width) = self.view.shape
+            self.canvas[:height, :width] = self.lut[self.view]
+            return self.canvas
+
+        (top, left) = (self.n_top, self.n_left)
+        self.canvas[:top, :left] = self.lut[self.mip_z[np.ix_(self.y_rows, self.x_cols)]]
+        self.canvas[:top, left:] = self.lut[self.mip_x[np.ix_(self.z_cols, self.y_rows)]].T
+        self.canvas[top:, :left] = self.lut[self.mip_y[np.ix_(self.z_rows, self.x_cols)]]
+        return self.canvas
+
+    def render(self, volume: np.ndarray) -> np.ndarray:
+        """Renders a volume into the canvas."""
+        self.project(volume)
+        return self.draw()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
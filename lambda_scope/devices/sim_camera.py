@@ -0,0 +1,295 @@
+#! python
+#
+# Copyright 2021
+# Author: Mahdi Torkashvand, Vivek Venkatachalam
+
+"""
+This publishes synthetic volumes of moving blobs in place of the
+AndorZylaCamera or FlirCamera, so the data pipeline can run without them.
+
+Usage:
+    sim_camera.py                       [options]
+
+Options:
+    -h --help                           Show this help.
+    --data_out=HOST:PORT                Socket address to publish image data.
+                                            [default: *:5003]
+    --commands_in=HOST:PORT             Socket address to receive commands.
+                                            [default: localhost:5001]
+    --status_out=HOST:PORT              Socket address to publish status.
+                                            [default: localhost:5000]
+    --format=UINT16_ZYX_25_512_1024     Size and type of the volumes.
+                                            [default: UINT16_ZYX_25_512_1024]
+    --rate=HZ                           Volumes published per second.
+                                            [default: 10]
+    --blobs=N                           Number of moving blobs.
+                                            [default: 3]
+    --triggers_in=HOST:PORT             Socket address of the camera triggers of a
+                                        simulated DAQ. If set, a volume is published
+                                        after every stack of triggers instead.
+    --name=NAME                         This name is used for commands subscription.
+                                            [default: ZylaCamera]
+"""
+
+import time
+import json
+from typing import Tuple, Optional
+
+import zmq
+import numpy as np
+from docopt import docopt
+
+from lambda_scope.zmq.publisher import Publisher
+from lambda_scope.zmq.subscriber import ObjectSubscriber
+from lambda_scope.zmq.array import Publisher as ArrayPublisher
+from lambda_scope.zmq.utils import parse_host_and_port
+from lambda_scope.devices.utils import array_props_from_string
+
+# Number of noise volumes that are made once and cycled through.
+NOISE_VOLUMES = 4
+
+
+class BlobVolumes():
+    """This makes volumes of Gaussian blobs that drift through the volume and
+    bounce off its walls, over a noisy background. Each blob is only drawn in
+    the box around it, and the noise is made once."""
+
+    def __init__(
+            self,
+            shape: Tuple[int, int, int],
+            dtype: np.dtype,
+            n_blobs=3,
+            background=100.0,
+            seed=0):
+
+        self.rng = np.random.default_rng(seed)
+        self.n_blobs = n_blobs
+        self.dtype = np.dtype(dtype)
+        self.background = background
+        if self.dtype.kind in "ui":
+            self.max_value = min(np.iinfo(self.dtype).max, 4000)
+        else:
+            self.max_value = 4000.0
+        self.set_shape(shape)
+
+    def set_shape(self, shape: Tuple[int, int, int]):
+        """Places new blobs in a volume of the given shape."""
+
+        self.shape = tuple(shape)
+        scale = np.array(self.shape, dtype=np.float64)
+
+        self.position = self.rng.uniform(0.2, 0.8, (self.n_blobs, 3)) * scale
+        self.velocity = self.rng.uniform(-0.01, 0.01, (self.n_blobs, 3)) * scale
+        self.sigma = np.maximum(self.rng.uniform(0.02, 0.05, (self.n_blobs, 3)) * scale, 0.5)
+        self.amplitude = self.rng.uniform(0.4, 1.0, self.n_blobs) * self.max_value
+
+        noise = self.rng.normal(self.background, np.sqrt(self.background),
+                                (NOISE_VOLUMES, *self.shape))
+        self.noise = np.clip(noise, 0, self.max_value).astype(self.dtype)
+        self.volume = np.zeros(self.shape, dtype=self.dtype)
+        self.count = 0
+
+    def step(self):
+        """Moves the blobs by one volume."""
+
+        self.position += self.velocity
+        upper = np.array(self.shape, dtype=np.float64) - 1
+        low = self.position < 0
+        high = self.position > upper
+        self.position = np.where(low, -self.position, self.position)
+        self.position = np.where(high, 2 * upper - self.position, self.position)
+        self.velocity = np.where(low | high, -self.velocity, self.velocity)
+
+    def next(self) -> np.ndarray:
+        """Returns the next volume. It is overwritten by the next call."""
+
+        np.copyto(self.volume, self.noise[self.count % NOISE_VOLUMES])
+        for (center, sigma, amplitude) in zip(self.position, self.sigma, self.amplitude):
+            box = []
+            profiles = []
+            for (c, s, n) in zip(center, sigma, self.shape):
+                lo = max(int(c - 3 * s), 0)
+                hi = min(int(c + 3 * s) + 1, n)
+                box.append(slice(lo, hi))
+                profiles.append(np.exp(-0.5 * ((np.arange(lo, hi) - c) / s)**2))
+            (pz, py, px) = profiles
+            blob = (amplitude * pz[:, None, None]) * (py[:, None] * px[None, :])
+            region = self.volume[tuple(box)]
+            region[...] = np.minimum(region + blob, self.max_value)
+
+        self.step()
+        self.count += 1
+        return self.volume
+
+
+class SimulatedCamera():
+    """This publishes synthetic volumes with the commands and data messages of
+    the camera executables."""
+
+    def __init__(
+            self,
+            data_out: Tuple[str, int, bool],
+            commands_in: Tuple[str, int, bool],
+            status_out: Tuple[str, int, bool],
+            fmt: str,
+            rate: float,
+            n_blobs=3,
+            triggers_in: Optional[Tuple[str, int, bool]] = None,
+            name="ZylaCamera"):
+
+        self.status = {}
+        self.name = name
+        (self.dtype, _, shape) = array_props_from_string(fmt)
+        if len(shape) == 2:
+            shape = (1, *shape)
+        self.shape = shape
+
+        self.rate = rate
+        self.running = 0
+        self.device_status = 1
+        self.sent_volumes = 0
+        self.n_triggers = 0
+        self.next_time = 0
+
+        self.volumes = BlobVolumes(self.shape, self.dtype, n_blobs)
+
+        self.poller = zmq.Poller()
+
+        self.command_subscriber = ObjectSubscriber(
+            obj=self,
+            name=name,
+            host=commands_in[0],
+            port=commands_in[1],
+            bound=commands_in[2])
+
+        self.status_publisher = Publisher(
+            host=status_out[0],
+            port=status_out[1],
+            bound=status_out[2])
+
+        self.data_publisher = ArrayPublisher(
+            host=data_out[0],
+            port=data_out[1],
+            shape=self.shape,
+            datatype=self.dtype,
+            bound=data_out[2])
+
+        self.trigger_subscriber = None
+        if triggers_in is not None:
+            self.trigger_subscriber = zmq.Context.instance().socket(zmq.SUB)
+            address = "tcp://{}:{}".format(triggers_in[0], triggers_in[1])
+            if triggers_in[2]:
+                self.trigger_subscriber.bind(address)
+            else:
+                self.trigger_subscriber.connect(address)
+            self.trigger_subscriber.setsockopt_string(zmq.SUBSCRIBE, "trigger")
+            self.poller.register(self.trigger_subscriber, zmq.POLLIN)
+
+        self.poller.register(self.command_subscriber.socket, zmq.POLLIN)
+        time.sleep(1)
+        self.publish_status()
+
+    def set_shape(self, z, y, x):
+        """Changes the shape of the volumes."""
+        self.shape = (z, y, x)
+        self.data_publisher.set_shape(self.shape)
+        self.volumes.set_shape(self.shape)
+        self.publish_status()
+
+    def start(self):
+        """Starts publishing volumes."""
+        if not self.running:
+            self.running = 1
+            self.n_triggers = 0
+            self.next_time = time.time()
+            self.publish_status()
+
+    def stop(self):
+        """Stops publishing volumes."""
+        if self.running:
+            self.running = 0
+            self.publish_status()
+
+    def shutdown(self):
+        """Shuts down the camera."""
+        self.stop()
+        self.device_status = 0
+        self.publish_status()
+
+    def send_volume(self):
+        """Publishes the next volume."""
+        self.data_publisher.send(self.volumes.next())
+        self.sent_volumes += 1
+
+    def handle_triggers(self):
+        """Counts the triggers waiting and publishes a volume for every
+        finished stack while running."""
+        while True:
+            try:
+                self.trigger_subscriber.recv(zmq.NOBLOCK)
+            except zmq.error.Again:
+                return
+            if self.running:
+                self.n_triggers += 1
+                if self.n_triggers % self.shape[0] == 0:
+                    self.send_volume()
+
+    def run(self):
+        """Publishes volumes on time or on triggers, and handles commands in
+        between."""
+        self.command_subscriber.flush()
+        while self.device_status:
+
+            timeout = None
+            if self.running and self.trigger_subscriber is None:
+                timeout = max(0, 1000 * (self.next_time - time.time()))
+
+            sockets = dict(self.poller.poll(timeout))
+
+            if self.command_subscriber.socket in sockets:
+                self.command_subscriber.handle()
+
+            if self.trigger_subscriber is not None:
+                if self.trigger_subscriber in sockets:
+                    self.handle_triggers()
+            elif self.running and time.time() >= self.next_time:
+                self.send_volume()
+                self.next_time = max(self.next_time + 1 / self.rate, time.time() - 1 / self.rate)
+
+    def update_status(self):
+        """Updates the status dictionary."""
+        self.status["shape"] = list(self.shape)
+        self.status["trigger"] = "Internal" if self.trigger_subscriber is None else "External"
+        self.status["rate"] = self.rate
+        self.status["sent_volumes"] = self.sent_volumes
+        self.status["running"] = self.running
+        self.status["device"] = self.device_status
+
+    def publish_status(self):
+        """Publishes the status to the hub and logger."""
+        self.update_status()
+        self.status_publisher.send("hub " + json.dumps({self.name: self.status}, default=int))
+        self.status_publisher.send("logger " + json.dumps({self.name: self.status}, default=int))
+
+def main():
+    """Create and start a simulated camera."""
+
+    arguments = docopt(__doc__)
+
+    triggers_in = None
+    if arguments["--triggers_in"] is not None:
+        triggers_in = parse_host_and_port(arguments["--triggers_in"])
+
+    camera = SimulatedCamera(data_out=parse_host_and_port(arguments["--data_out"]),
+                             commands_in=parse_host_and_port(arguments["--commands_in"]),
+                             status_out=parse_host_and_port(arguments["--status_out"]),
+                             fmt=arguments["--format"],
+                             rate=float(arguments["--rate"]),
+                             n_blobs=int(arguments["--blobs"]),
+                             triggers_in=triggers_in,
+                             name=arguments["--name"])
+
+    camera.run()
+
+if __name__ == "__main__":
+    main()
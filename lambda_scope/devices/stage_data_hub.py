@@ -24,6 +24,17 @@ Options:
                                             [default: UINT16_ZYX_25_512_1024]
     --name=NAME                         This name is used for commands subscription.
                                             [default: stage_data_hub]
+    --data_hwm=N                        High-water mark of outbound array data.
+                                            [default: 1000]
+    --data_buffer_size=BYTES            Kernel send buffer size of outbound array
+                                        data, 0 for the OS default.
+                                            [default: 0]
+    --data_policy=POLICY                What to do when the high-water mark is
+                                        reached: drop-newest, drop-oldest or block.
+                                            [default: drop-newest]
+    --data_timeout=MS                   Send timeout of the block policy, -1 waits
+                                        forever.
+                                            [default: -1]
 """
 
 import time
@@ -50,7 +61,11 @@ class DataHub():
             data_out: Tuple[str, int, bool],
             status_out: Tuple[str, int],
             fmt: str,
-            name: str):
+            name: str,
+            hwm=1000,
+            buffer_size=0,
+            policy="drop-newest",
+            timeout=-1):
 
         self.status = {}
         self.name = name
@@ -81,14 +96,20 @@ class DataHub():
             port=self.data_out[1],
             datatype=self.dtype,
             shape=self.shape,
-            bound=self.data_out[2])
+            bound=self.data_out[2],
+            header=True,
+            hwm=hwm,
+            buffer_size=buffer_size or None,
+            policy=policy,
+            timeout=timeout)
 
         self.data_subscriber = Subscriber(
             host=self.data_in[0],
             port=self.data_in[1],
             datatype=self.dtype,
             shape=self.shape,
-            bound=self.data_in[2])
+            bound=self.data_in[2],
+            latest_only=True)
 
         self.poller.register(self.command_subscriber.socket, zmq.POLLIN)
         self.poller.register(self.data_subscriber.socket, zmq.POLLIN)
@@ -134,6 +155,8 @@ class DataHub():
     def update_status(self):
         """updates the status dictionary."""
         self.status["shape"] = self.shape
+        self.status["dropped"] = self.data_publisher.dropped
+        self.status["skipped"] = self.data_subscriber.skipped
         self.status["device"] = self.device_status
 
 
@@ -154,7 +177,11 @@ def main():
         data_out=parse_host_and_port(args["--data_out"]),
         status_out=parse_host_and_port(args["--status_out"]),
         fmt=args["--format"],
-        name=args["--name"])
+        name=args["--name"],
+        hwm=int(args["--data_hwm"]),
+        buffer_size=int(args["--data_buffer_size"]),
+        policy=args["--data_policy"],
+        timeout=int(args["--data_timeout"]))
 
     device.run()
 
@@ -95,7 +95,8 @@ class TrackerDevice():
             port=self.data_in[1],
             bound=self.data_in[2],
             shape=self.shape,
-            datatype=self.dtype)
+            datatype=self.dtype,
+            latest_only=True)
 
         self.poller.register(self.command_subscriber.socket, zmq.POLLIN)
         self.poller.register(self.data_subscriber.socket, zmq.POLLIN)
@@ -151,7 +152,8 @@ class TrackerDevice():
             port=port,
             bound=self.data_in[2],
             shape=self.shape,
-            datatype=self.dtype)
+            datatype=self.dtype,
+            latest_only=True)
 
         self.poller.register(self.data_subscriber.socket, zmq.POLLIN)
         self.publish_status()
@@ -208,6 +210,8 @@ class TrackerDevice():
         self.status["feature_size"] = self.tracker.feat_size
         self.status["crop_size"] = self.tracker.crop_size
         self.status["tracking"] = self.tracking
+        self.status["skipped"] = self.data_subscriber.skipped
+        self.status["dropped"] = self.data_subscriber.dropped
         self.status["device"] = self.running
 
 
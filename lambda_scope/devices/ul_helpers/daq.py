@@ -5,8 +5,10 @@
 
 from __future__ import absolute_import, division, print_function
 
+import ctypes
 import threading
 
+import numpy as np
 from mcculw import ul
 from mcculw.enums import (
     ScanOptions,
@@ -147,6 +149,19 @@ class DAQDevice():
         value = ul.from_eng_units(self.board_num, self.ao_range, voltage_value)
         self.ctypes_array[index] = value
 
+    def volts_to_counts(self, voltages: np.ndarray) -> np.ndarray:
+        """Converts an array of voltages to output counts. Waveforms hold few
+        distinct voltages, and each is converted only once."""
+        (values, inverse) = np.unique(voltages, return_inverse=True)
+        counts = np.array([ul.from_eng_units(self.board_num, self.ao_range, float(value))
+                           for value in values], dtype=np.uint16)
+        return counts[inverse].reshape(np.shape(voltages))
+
+    def fill_ctypes_buffer(self, counts: np.ndarray):
+        """Copies an array of counts into the start of the buffer at once."""
+        counts = np.ascontiguousarray(counts, dtype=np.uint16)
+        ctypes.memmove(self.ctypes_array, counts.ctypes.data, counts.nbytes)
+
     def free_buffer(self):
         """Frees a Windows global memory buffer which was previously allocated with
         :func:.win_buf_alloc, :func:.win_buf_alloc_32, :func:.win_buf_alloc_64 or
@@ -0,0 +1,237 @@
+#! python
+#
+# Copyright 2021
+# Author: Mahdi Torkashvand, Vivek Venkatachalam
+
+"""A simulated DAQ device with the interface of DAQDevice. It needs neither
+mcculw nor a board, keeps the output buffers in numpy and records every
+waveform it is asked to output, so the acquisition board can run and be
+profiled on any machine."""
+
+import time
+import ctypes
+import threading
+from collections import deque
+from typing import Tuple, Optional
+
+import numpy as np
+
+from lambda_scope.zmq.publisher import Publisher
+
+# Output range of the boards, -10 V to 10 V in 16 bits.
+V_MIN = -10.0
+V_MAX = 10.0
+MAX_COUNT = 2**16 - 1
+
+# Sample rate used when scans are paced by an external clock, which is
+# 2.5 ms per sample on the rig.
+CLOCK_RATE = 400.0
+
+# Number of the most recent writes and scans that are kept.
+HISTORY_SIZE = 1000
+SCANS_SIZE = 16
+
+
+def volts_to_counts(voltages: np.ndarray) -> np.ndarray:
+    """Converts voltages to output counts of the range."""
+    counts = (np.asarray(voltages, dtype=np.float64) - V_MIN) / (V_MAX - V_MIN) * MAX_COUNT
+    return np.rint(np.clip(counts, 0, MAX_COUNT)).astype(np.uint16)
+
+def counts_to_volts(counts: np.ndarray) -> np.ndarray:
+    """Converts output counts to voltages."""
+    return V_MIN + np.asarray(counts, dtype=np.float64) * (V_MAX - V_MIN) / MAX_COUNT
+
+def rising_edges(x: np.ndarray, threshold: float) -> np.ndarray:
+    """Returns the indices where x crosses threshold from below. A scan that
+    starts high counts as an edge at 0."""
+    high = x >= threshold
+    return np.flatnonzero(high & ~np.concatenate([[False], high[:-1]]))
+
+
+class SimulatedDAQDevice():
+    """This is a simulated DAQ device."""
+
+    def __init__(
+            self,
+            serial_num,
+            board_num,
+            clock_rate=CLOCK_RATE,
+            triggers: Optional[Tuple[str, int, bool]] = None,
+            trigger_channel=1,
+            trigger_threshold=2.0,
+            trigger_topic="trigger",
+            num_chans=4,
+            history_size=HISTORY_SIZE,
+            scans_size=SCANS_SIZE):
+        """If triggers is set, rising edges of trigger_channel in the scans
+        are published there as "<trigger_topic> <index> <time>", at the time
+        the board would output them. Only the last history_size writes and
+        scans_size scans are kept."""
+
+        self.serial_num = serial_num
+        self.board_num = board_num
+        self.ao_range = None
+        self.num_chans = num_chans
+
+        self.clock_rate = clock_rate
+        self.trigger_channel = trigger_channel
+        self.trigger_threshold = trigger_threshold
+        self.trigger_topic = trigger_topic
+        self.trigger_publisher = None
+        if triggers is not None:
+            self.trigger_publisher = Publisher(
+                host=triggers[0],
+                port=triggers[1],
+                bound=triggers[2])
+
+        self.outputs = np.zeros(num_chans)
+        self.port_value = 0
+        self.history = deque(maxlen=history_size)
+        self.scans = deque(maxlen=scans_size)
+        self.n_triggers = 0
+
+        self.buffer = None
+        self.ctypes_array = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        print("DAQ {}: Simulated.".format(self.serial_num))
+
+    def v_out(self, chan_num, voltage_value):
+        """Output voltage_value from channel chan_num."""
+        self.outputs[chan_num] = voltage_value
+        self.history.append((time.time(), "v_out", chan_num, voltage_value))
+
+    def v_in(self, chan_num):
+        """Return the inputs voltage to the channel chan_num. Inputs are wired
+        back to the outputs of the same channel."""
+        return float(self.outputs[chan_num])
+
+    def d_out(self, port_value):
+        """Outputs port_value from the digital port"""
+        self.port_value = port_value
+        self.history.append((time.time(), "d_out", None, port_value))
+
+    def d_bit_out(self, bit_num, bit_value):
+        """Outputs the bit_value (0 or 1) from bit bit_num"""
+        if bit_value:
+            self.port_value |= 1 << bit_num
+        else:
+            self.port_value &= ~(1 << bit_num)
+        self.history.append((time.time(), "d_out", None, self.port_value))
+
+    def a_out_scan(self, low_chan, high_chan, npoints, rate, background=False,
+                   continuous=False, extclock=False, exttrigger=False):
+        """Records the first npoints values of the buffer as a waveform of
+        the channels low_chan to high_chan, and plays it at the sample rate,
+        or at clock_rate if extclock is set. The waveform is kept in scans
+        with its channels, rate and start time."""
+
+        self.stop_background()
+
+        nchans = high_chan - low_chan + 1
+        rate = self.clock_rate if extclock else rate
+        waveform = counts_to_volts(self.buffer[:npoints]).reshape(-1, nchans)
+        scan = {
+            "time": time.time(),
+            "channels": (low_chan, high_chan),
+            "rate": rate,
+            "continuous": bool(continuous),
+            "waveform": waveform
+        }
+        self.scans.append(scan)
+
+        self.stop_event.clear()
+        if background:
+            self.thread = threading.Thread(target=self._play, args=(scan, ), daemon=True)
+            self.thread.start()
+        else:
+            self._play(scan)
+        return rate
+
+    def _play(self, scan: dict):
+        """Waits out the scan and publishes its trigger edges on time. The
+        last sample stays on the outputs when a scan ends."""
+
+        (low_chan, high_chan) = scan["channels"]
+        waveform = scan["waveform"]
+        duration = len(waveform) / scan["rate"]
+
+        edges = np.zeros(0, dtype=np.int64)
+        if self.trigger_publisher is not None and \
+                low_chan <= self.trigger_channel <= high_chan:
+            edges = rising_edges(waveform[:, self.trigger_channel - low_chan],
+                                 self.trigger_threshold)
+        edge_times = edges / scan["rate"]
+
+        t0 = scan["time"]
+        while not self.stop_event.is_set():
+            for edge_time in edge_times:
+                if self.stop_event.wait(max(0, t0 + edge_time - time.time())):
+                    return
+                self.trigger_publisher.send("{} {} {}".format(
+                    self.trigger_topic, self.n_triggers, t0 + edge_time))
+                self.n_triggers += 1
+
+            if self.stop_event.wait(max(0, t0 + duration - time.time())):
+                return
+            if not scan["continuous"]:
+                break
+            t0 += duration
+
+        self.outputs[low_chan:high_chan + 1] = waveform[-1]
+
+    def samples_out(self) -> int:
+        """Returns the number of samples the last scan has output so far."""
+        if not self.scans:
+            return 0
+        scan = self.scans[-1]
+        n = int((time.time() - scan["time"]) * scan["rate"])
+        if scan["continuous"] and self.thread is not None and self.thread.is_alive():
+            return n
+        return min(n, len(scan["waveform"]))
+
+    def stop_background(self):
+        """Stops the scan running in the background."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def allocate_buffer(self, npoints):
+        """Allocates a buffer and creates a ctypes array."""
+        self.buffer = np.zeros(npoints, dtype=np.uint16)
+        self.ctypes_array = self.buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_ushort))
+        return True
+
+    def fill_ctypes_array(self, index, voltage_value):
+        """Converts the voltage_value and uses index to fill the array."""
+        self.buffer[index] = volts_to_counts(voltage_value)
+
+    def volts_to_counts(self, voltages: np.ndarray) -> np.ndarray:
+        """Converts an array of voltages to output counts."""
+        return volts_to_counts(voltages)
+
+    def fill_ctypes_buffer(self, counts: np.ndarray):
+        """Copies an array of counts into the start of the buffer at once."""
+        counts = np.ascontiguousarray(counts, dtype=np.uint16)
+        ctypes.memmove(self.ctypes_array, counts.ctypes.data, counts.nbytes)
+
+    def free_buffer(self):
+        """Frees the buffer."""
+        self.buffer = None
+        self.ctypes_array = None
+
+    def release(self):
+        """Stops any scan and closes the trigger stream."""
+        self.stop_background()
+        if self.trigger_publisher is not None:
+            self.trigger_publisher.socket.close()
+            self.trigger_publisher = None
+
+    def shutdown(self):
+        """Shuts down the device."""
+        for i in range(self.num_chans):
+            self.v_out(i, 0)
+        self.d_out(0)
+        self.release()
@@ -7,7 +7,7 @@
 
 import os
 import datetime
-from typing import Tuple
+from typing import Tuple, Optional
 
 import numpy as np
 
@@ -32,6 +32,33 @@ def array_props_from_string(fmt: str) -> Tuple[np.dtype, str, Tuple[int, ...]]:
     return (dtype, layout, shape)
 
 
+def chunks_from_string(chunks: str) -> Optional[Tuple[int, ...]]:
+    """Convert a string like 1_1_512_1024 into a chunk shape. An empty string
+    gives None, which leaves the choice to the writer."""
+
+    if not chunks:
+        return None
+
+    return tuple(map(int, chunks.split("_")))
+
+
+def compression_from_string(
+        codec: str,
+        level: str
+    ) -> Tuple[Optional[str], Optional[int]]:
+    """Convert the name of a codec and its level into the compression and
+    compression_opts arguments of h5py. none disables compression and an
+    empty level uses the default of the codec."""
+
+    if codec == "none":
+        return (None, None)
+
+    if not level:
+        return (codec, None)
+
+    return (codec, int(level))
+
+
 def apply_lut(x: np.ndarray, lo: float, hi: float, newtype=None) -> np.ndarray:
     """Clip x to the range [lo, hi], then rescale to fill the range of
     newtype."""
@@ -17,6 +17,9 @@ Options:
                                             [default: localhost:5001]
     --status_out=HOST:PORT              Socket Address to publish status.
                                             [default: localhost:5000]
+    --status_in=HOST:PORT               Connection for the status messages of all
+                                        devices, as sent to the logger.
+                                            [default: localhost:5001]
     --directory=PATH                    Directory to write data to.
                                             [default: ]
     --format=UINT16_ZYX_20_512_512      Size and type of image being sent. Allowed
@@ -28,10 +31,82 @@ Options:
                                             [default: data]
     --name=NAME                         Device name.
                                             [default: writer]
+    --transport=TRANSPORT               Transport for inbound array data, tcp or
+                                        shm to read volumes from shared memory.
+                                        shm can drop volumes, so it needs
+                                        --data_policy=drop-newest or drop-oldest.
+                                            [default: tcp]
+    --data_hwm=N                        High-water mark of inbound array data.
+                                            [default: 1000]
+    --data_buffer_size=BYTES            Kernel receive buffer size of inbound array
+                                        data, 0 for the OS default.
+                                            [default: 0]
+    --data_policy=POLICY                What to do when the high-water mark is
+                                        reached: drop-newest, drop-oldest or block.
+                                        block drops nothing here and waits for
+                                        room in the queue, but the data hub also
+                                        needs --data_policy=block for no volume
+                                        to be dropped on the way.
+                                            [default: block]
+    --queue_size=N                      Number of volumes waiting to be written
+                                        that are held in memory.
+                                            [default: 16]
+    --compression_workers=N             Threads compressing planes in parallel,
+                                        0 compresses inside HDF5. Parallel lzf
+                                        needs python-lzf.
+                                            [default: 0]
+    --chunks=T_Z_Y_X                    Chunk shape of the saved data, e.g.
+                                        1_1_512_1024 for one plane per chunk.
+                                        Empty chooses one volume per chunk.
+                                            [default: ]
+    --compression=CODEC                 Compression codec: lzf, gzip or none.
+                                            [default: lzf]
+    --compression_level=N               Compression level, empty for the default
+                                        of the codec.
+                                            [default: ]
+    --segment_frames=N                  Start a new segment file after N volumes,
+                                        0 for no limit.
+                                            [default: 0]
+    --segment_bytes=BYTES               Start a new segment file after BYTES of
+                                        uncompressed data, 0 for no limit.
+                                            [default: 0]
+    --segment_seconds=SECONDS           Start a new segment file after SECONDS,
+                                        0 for no limit. With any limit set, the
+                                        file named after the session is a master
+                                        file that stitches the segments.
+                                            [default: 0]
+    --backend=BACKEND                   File format: hdf5, raw to append
+                                        uncompressed volumes to a raw file with a
+                                        sidecar index for the highest ingest
+                                        rates, or zarr for a directory store that
+                                        can be read while it is written. Convert
+                                        raw files with lambda_raw_to_hdf5. zarr
+                                        stores use gzip or no compression.
+                                            [default: hdf5]
+    --swmr=SWMR                         1 writes hdf5 files in single-writer
+                                        multiple-reader mode, so they can be read
+                                        while they are written.
+                                            [default: 0]
+    --flush_interval=SECONDS            With swmr, the longest time volumes wait
+                                        in memory before readers can see them.
+                                            [default: 1]
+    --metadata=METADATA                 1 saves the laser, filter, valve and stage
+                                        state at every volume in a metadata table
+                                        of hdf5 files.
+                                            [default: 1]
+    --summaries=LIST                    Comma separated summaries saved as extra
+                                        datasets of hdf5 files: mip_z, mip_y,
+                                        mip_x and down_2, down_4 for volumes
+                                        downsampled in Y and X.
+                                            [default: ]
+    --summary_workers=N                 Threads computing the summaries.
+                                            [default: 2]
 """
 
-from typing import Tuple
+from typing import Tuple, Optional
 import multiprocessing
+import threading
+import queue
 import json
 import time
 
@@ -39,15 +114,31 @@ import zmq
 from docopt import docopt
 
 from lambda_scope.writers.array_writer import TimestampedArrayWriter
+from lambda_scope.writers.segmented_writer import SegmentedArrayWriter
+from lambda_scope.writers.raw_writer import RawArrayWriter
+from lambda_scope.writers.directory_writer import DirectoryArrayWriter
+from lambda_scope.writers.metadata import MetadataTable
 from lambda_scope.zmq.array import TimestampedSubscriber
-from lambda_scope.zmq.subscriber import ObjectSubscriber
+from lambda_scope.zmq.shared_memory import SharedMemorySubscriber
+from lambda_scope.zmq.subscriber import ObjectSubscriber, Subscriber
 from lambda_scope.zmq.publisher import Publisher
 from lambda_scope.devices.utils import make_timestamped_filename
-from lambda_scope.zmq.utils import parse_host_and_port
-from lambda_scope.devices.utils import array_props_from_string
+from lambda_scope.zmq.utils import drain, parse_host_and_port
+from lambda_scope.devices.utils import (
+    array_props_from_string,
+    chunks_from_string,
+    compression_from_string)
 
 class  WriteSession(multiprocessing.Process):
-    """This is hdf_writer class"""
+    """This is hdf_writer class. Volumes are received on the main thread and
+    handed to a writer thread through a queue holding at most queue_size
+    volumes, so a slow disk does not delay commands. When the queue is full the
+    volume is dropped, or with the block policy the main thread waits for room.
+    The markers that close files do not count against the limit, so stopping
+    never waits.
+
+    If writing fails, the error is kept in the status, the file is closed and
+    the recording is stopped."""
 
     def __init__(
             self,
@@ -58,7 +149,25 @@ class  WriteSession(multiprocessing.Process):
             saving_mode: str,
             directory: str,
             name="writer",
-            video_name="data"):
+            video_name="data",
+            transport="tcp",
+            hwm=1000,
+            buffer_size=0,
+            policy="block",
+            queue_size=16,
+            compression_workers=0,
+            chunks: Optional[Tuple[int, ...]] = None,
+            compression="lzf",
+            compression_level: Optional[int] = None,
+            segment_frames=0,
+            segment_bytes=0,
+            segment_seconds=0,
+            backend="hdf5",
+            swmr=False,
+            flush_interval=1.0,
+            status_in: Optional[Tuple[str, int]] = None,
+            summaries: Tuple[str, ...] = (),
+            summary_workers=2):
 
         multiprocessing.Process.__init__(self)
 
@@ -74,8 +183,36 @@ class  WriteSession(multiprocessing.Process):
         self.file_name = "TBS"
         self.data_in = data_in
         self.directory = directory
+        self.transport = transport
+        self.policy = policy
+        self.compression_workers = compression_workers
+        self.chunks = chunks
+        self.compression = compression
+        self.compression_level = compression_level
+        self.segment_limits = {
+            "max_frames": segment_frames,
+            "max_bytes": segment_bytes,
+            "max_seconds": segment_seconds
+        }
+        self.backend = backend
+        self.swmr = swmr
+        self.flush_interval = flush_interval
+        self.summaries = summaries
+        self.summary_workers = summary_workers
         self.poller = zmq.Poller()
 
+        self.writer = None
+        self.queue = queue.Queue()
+        self.queue_slots = threading.Semaphore(queue_size)
+        self.queue_dropped = 0
+        self.queue_blocked = 0
+        self.failed_writer = None
+        self.write_error = None
+        self.bytes_written = 0
+        self.status_bytes = 0
+        self.status_time = time.time()
+        self.persist_thread = threading.Thread(target=self.persist, daemon=True)
+
         self.status_publisher = Publisher(
             host=status_out[0],
             port=status_out[1],
@@ -88,12 +225,37 @@ class  WriteSession(multiprocessing.Process):
             port=commands_in[1],
             bound=commands_in[2])
 
-        self.data_subscriber = TimestampedSubscriber(
+        options = {}
+        if transport == "shm":
+            # Volumes wait in the queue, so they are copied out of the ring
+            # and checked against the publisher reusing the slot meanwhile.
+            subscriber_class = SharedMemorySubscriber
+            options["copy"] = True
+        else:
+            subscriber_class = TimestampedSubscriber
+
+        self.data_subscriber = subscriber_class(
             host=self.data_in[0],
             port=self.data_in[1],
             shape=self.shape,
             datatype=self.dtype,
-            bound=self.data_in[2])
+            bound=self.data_in[2],
+            hwm=hwm,
+            buffer_size=buffer_size or None,
+            policy=policy,
+            **options)
+
+        self.metadata = None
+        self.status_subscriber = None
+        if status_in is not None:
+            self.metadata = MetadataTable()
+            self.status_subscriber = Subscriber(
+                port=status_in[1],
+                host=status_in[0],
+                bound=status_in[2])
+            self.status_subscriber.remove_subscription("")
+            self.status_subscriber.add_subscription("logger ")
+            self.poller.register(self.status_subscriber.socket, zmq.POLLIN)
 
         self.poller.register(self.command_subscriber.socket, zmq.POLLIN)
         self.poller.register(self.data_subscriber.socket, zmq.POLLIN)
@@ -109,6 +271,19 @@ class  WriteSession(multiprocessing.Process):
         self.poller.register(self.data_subscriber.socket, zmq.POLLIN)
         self.publish_status()
 
+    def set_chunks(self, *chunks):
+        """Sets the chunk shape used by the next recording, e.g.
+        set_chunks 1 1 512 1024. Without arguments the writer chooses."""
+        self.chunks = chunks or None
+        self.publish_status()
+
+    def set_compression(self, codec, level=None):
+        """Sets the compression codec (lzf, gzip or none) and level used by
+        the next recording."""
+        (self.compression, self.compression_level) = compression_from_string(
+            codec, "" if level is None else str(level))
+        self.publish_status()
+
     def set_saving_mode(self, saving_mode):
         """Updates the saving mode, 1:ON, 0:OFF"""
         self.saving_status = saving_mode
@@ -118,51 +293,198 @@ class  WriteSession(multiprocessing.Process):
         """Registers the data subscriber to the poller."""
 
         if not self.subscription_status and self.saving_status:
+            ext = {"raw": "raw", "zarr": "zarr"}.get(self.backend, "h5")
             self.filename = make_timestamped_filename(self.directory,
-                                                      self.video_name, "h5")
-
-            self.writer = TimestampedArrayWriter.from_source(self.data_subscriber,
-                                                             self.filename)
+                                                      self.video_name, ext)
+
+            kwargs = {
+                "compression": self.compression,
+                "compression_opts": self.compression_level,
+                "workers": self.compression_workers,
+                "chunks": self.chunks
+            }
+
+            if self.backend == "raw":
+                self.writer = RawArrayWriter.from_source(
+                    self.data_subscriber, self.filename)
+            elif self.backend == "zarr":
+                if kwargs["compression"] != "gzip":
+                    kwargs["compression"] = None
+                self.writer = DirectoryArrayWriter.from_source(
+                    self.data_subscriber, self.filename, **kwargs)
+            else:
+                if self.swmr:
+                    kwargs["swmr"] = True
+                    kwargs["flush_interval"] = self.flush_interval
+                if self.metadata is not None:
+                    kwargs["metadata_dtype"] = self.metadata.dtype
+                if self.summaries:
+                    kwargs["summaries"] = self.summaries
+                    kwargs["summary_workers"] = self.summary_workers
+                if any(self.segment_limits.values()):
+                    self.writer = SegmentedArrayWriter.from_source(
+                        self.data_subscriber, self.filename,
+                        **self.segment_limits, **kwargs)
+                else:
+                    self.writer = TimestampedArrayWriter.from_source(
+                        self.data_subscriber, self.filename, **kwargs)
+            self.write_error = None
             self.subscription_status = 1
             self.publish_status()
 
     def stop(self):
-        """Closes the hdf file, updates the status. """
+        """Queues the closing of the hdf file, updates the status. The file is
+        closed once the volumes queued before it are written."""
         if self.subscription_status:
             self.subscription_status = 0
-            self.writer.close()
+            self.queue.put((self.writer, None))
             self.publish_status()
 
     def shutdown(self):
-        """Close the hdf file and end while true loop of the poller"""
+        """Close the hdf file, wait for the queue to drain and end while true
+        loop of the poller"""
         self.stop()
+        self.queue.put((None, None))
+        self.persist_thread.join()
         self.device_status = 0
         self.publish_status()
 
     def run(self):
         """Start a while true loop with a poller that has command_subscriber already registered."""
 
+        self.persist_thread.start()
+
         while self.device_status:
 
-            sockets = dict(self.poller.poll())
+            sockets = dict(self.poller.poll(1000))
+
+            if self.status_subscriber is not None and self.status_subscriber.socket in sockets:
+                self.receive_status()
+
+            if self.data_subscriber.socket in sockets:
+                if self.subscription_status:
+                    self.receive()
+                else:
+                    self.discard()
 
             if self.command_subscriber.socket in sockets:
-                self.data_subscriber.get_last()
                 self.command_subscriber.handle()
 
-
             if self.subscription_status:
-                if self.data_subscriber.socket in sockets:
-                    self.writer.save_frame()
-
+                if time.time() - self.status_time >= 1.0:
+                    self.publish_status()
+
+    def receive(self):
+        """Receive a volume and queue it for the writer thread."""
+
+        if self.writer is self.failed_writer:
+            self.stop()
+            return
+
+        if self.data_subscriber.latest_only:
+            msg = self.data_subscriber.get_last()
+            if msg is None:
+                return
+        else:
+            msg = self.data_subscriber.recv()
+        if getattr(self.writer, "metadata_dtype", None) is not None:
+            msg = (*msg, self.metadata.snapshot())
+
+        if not self.queue_slots.acquire(blocking=False):
+            if self.policy != "block":
+                self.queue_dropped += 1
+                return
+            self.queue_blocked += 1
+            self.queue_slots.acquire()
+        self.queue.put((self.writer, msg))
+
+    def discard(self):
+        """Discard the volumes that arrive while not recording, so they do not
+        pile up in the unbounded receive queue of the block policy. The gap
+        they leave in the sequence numbers is not counted as dropped."""
+        drain(self.data_subscriber.recv_frames)
+        self.data_subscriber.sequence = None
+
+    def receive_status(self):
+        """Apply all pending status messages to the metadata table."""
+
+        while True:
+            try:
+                msg = self.status_subscriber.socket.recv_string(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+
+            try:
+                self.metadata.update(json.loads(msg[7:]))
+            except (ValueError, AttributeError):
+                pass
+
+    def persist(self):
+        """Write queued volumes to their files, and close each file when its
+        stop marker arrives. This runs on the writer thread until shutdown.
+        After an error the file is closed and the rest of its volumes are
+        discarded."""
+
+        while True:
+            (writer, msg) = self.queue.get()
+            if writer is None:
+                break
+            if msg is not None:
+                self.queue_slots.release()
+            if writer is self.failed_writer:
+                continue
+
+            try:
+                if msg is None:
+                    writer.close()
+                else:
+                    writer.append_data(msg)
+                    self.bytes_written += msg[1].nbytes
+            except Exception as exc:
+                self.write_error = "{}: {}".format(type(exc).__name__, exc)
+                self.failed_writer = writer
+                print(self.write_error)
+                self.close_failed(writer)
+
+    def close_failed(self, writer):
+        """Close a writer after an error. Errors while closing are printed,
+        the first error stays in the status."""
+        try:
+            writer.close()
+        except Exception as exc:
+            print(str(exc))
 
     def update_status(self):
         """Updates the status dictionary."""
         self.status["shape"] = self.shape
         self.status["saving"] = self.saving_status
+        self.status["chunks"] = self.chunks
+        self.status["compression"] = self.compression
+        self.status["compression_level"] = self.compression_level
+        self.status["backend"] = self.backend
+        self.status["swmr"] = int(self.swmr)
+        self.status["metadata"] = int(self.metadata is not None and self.backend == "hdf5")
+        if self.metadata is not None:
+            self.status["metadata_errors"] = sum(self.metadata.errors.values())
+        self.status["summaries"] = self.summaries
         self.status["running"] = self.subscription_status
+        self.status["dropped"] = self.data_subscriber.dropped
+        self.status["skipped"] = self.data_subscriber.skipped
+        self.status["queue_depth"] = self.queue.qsize()
+        self.status["queue_dropped"] = self.queue_dropped
+        self.status["queue_blocked"] = self.queue_blocked
+        self.status["bytes_per_second"] = self.bytes_per_second()
+        self.status["error"] = self.write_error or getattr(self.writer, "error", None)
         self.status["device"] = self.device_status
 
+    def bytes_per_second(self) -> float:
+        """Return the rate at which data was written since the last status."""
+        now = time.time()
+        rate = (self.bytes_written - self.status_bytes) / max(now - self.status_time, 1e-3)
+        self.status_bytes = self.bytes_written
+        self.status_time = now
+        return rate
+
     def publish_status(self):
         """Publishes the status to the hub and logger."""
         self.update_status()
@@ -175,6 +497,9 @@ def main():
 
     args = docopt(__doc__)
 
+    (compression, compression_level) = compression_from_string(
+        args["--compression"], args["--compression_level"])
+
     writer = WriteSession(
         data_in=parse_host_and_port(args["--data_in"]),
         commands_in=parse_host_and_port(args["--commands_in"]),
@@ -183,7 +508,25 @@ def main():
         saving_mode=args["--saving_mode"],
         directory=args["--directory"],
         name=args["--name"],
-        video_name=args["--video_name"])
+        video_name=args["--video_name"],
+        transport=args["--transport"],
+        hwm=int(args["--data_hwm"]),
+        buffer_size=int(args["--data_buffer_size"]),
+        policy=args["--data_policy"],
+        queue_size=int(args["--queue_size"]),
+        compression_workers=int(args["--compression_workers"]),
+        chunks=chunks_from_string(args["--chunks"]),
+        compression=compression,
+        compression_level=compression_level,
+        segment_frames=int(args["--segment_frames"]),
+        segment_bytes=int(args["--segment_bytes"]),
+        segment_seconds=float(args["--segment_seconds"]),
+        backend=args["--backend"],
+        swmr=bool(int(args["--swmr"])),
+        flush_interval=float(args["--flush_interval"]),
+        status_in=parse_host_and_port(args["--status_in"]) if int(args["--metadata"]) else None,
+        summaries=tuple(filter(None, args["--summaries"].split(","))),
+        summary_workers=int(args["--summary_workers"]))
 
     writer.run()
 
@@ -36,6 +36,7 @@ def execute(job, fmt: str, zyla_camera: str):
 
     saving_mode = "0"
     trigger_mode = "2"
+    transport = "tcp"
     flir_exposure = "25000"
     dragonfly_usb_port = "COM6"
     serial_num_las_daq = "1D3B333"
@@ -109,6 +110,7 @@ def execute(job, fmt: str, zyla_camera: str):
                           "--inbound=L" + str(data_stamped + i),
                           "--format=" + fmt,
                           "--commands=L" + obound,
+                          "--transport=" + transport,
                           "--name=top_displayer"+ str(camera_number)]))
 
         job.append(Popen(["lambda_data_hub",
@@ -117,6 +119,7 @@ def execute(job, fmt: str, zyla_camera: str):
                           "--data_out=" + str(data_stamped + i),
                           "--status_out=L" + ibound,
                           "--format=" + fmt,
+                          "--transport=" + transport,
                           "--name=data_hub"+ str(camera_number)]))
 
         job.append(Popen(["lambda_writer",
@@ -127,6 +130,7 @@ def execute(job, fmt: str, zyla_camera: str):
                           "--saving_mode=" + saving_mode,
                           "--directory="+ data_directory,
                           "--video_name=camera" + str(camera_number),
+                          "--transport=" + transport,
                           "--name=writer"+ str(camera_number)]))
 
         if i == 1:
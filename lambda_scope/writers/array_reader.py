@@ -0,0 +1,451 @@
+#! python
+#
+# Copyright 2021
+# Author: Mahdi Torkashvand, Vivek Venkatachalam
+
+import os
+import json
+import time
+import zlib
+import queue
+import operator
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Tuple, Union, Optional
+
+import h5py
+import numpy as np
+
+from lambda_scope.writers.raw_writer import read_raw
+from lambda_scope.writers.directory_writer import chunk_key
+
+CACHE_NBYTES = 2 ** 28
+
+
+def parse_key(key, shape: Tuple[int, ...]) -> Tuple[tuple, tuple]:
+    """Split an index into the box of the array it touches, as (start, stop)
+    per axis, and the index that picks the requested elements out of that
+    box. Integers, slices and an Ellipsis are supported."""
+
+    if not isinstance(key, tuple):
+        key = (key, )
+
+    for (i, k) in enumerate(key):
+        if k is Ellipsis:
+            fill = (slice(None), ) * (len(shape) - len(key) + 1)
+            key = key[:i] + fill + key[i + 1:]
+            break
+
+    if len(key) > len(shape):
+        raise IndexError("Too many indices for an array with {} dimensions.".format(
+            len(shape)))
+    key = key + (slice(None), ) * (len(shape) - len(key))
+
+    box = []
+    index = []
+    for (k, n) in zip(key, shape):
+        if isinstance(k, slice):
+            r = range(*k.indices(n))
+            if len(r) == 0:
+                box.append((0, 0))
+                index.append(slice(0, 0))
+                continue
+            lo = min(r[0], r[-1])
+            stop = r[-1] - lo + (1 if r.step > 0 else -1)
+            box.append((lo, max(r[0], r[-1]) + 1))
+            index.append(slice(r[0] - lo, stop if stop >= 0 else None, r.step))
+        else:
+            k = operator.index(k)
+            if k < 0:
+                k += n
+            if not 0 <= k < n:
+                raise IndexError("Index {} is out of bounds for an axis of size {}.".format(
+                    k, n))
+            box.append((k, k + 1))
+            index.append(0)
+
+    return (tuple(box), tuple(index))
+
+def box_slices(box: tuple) -> tuple:
+    return tuple(slice(lo, hi) for (lo, hi) in box)
+
+
+class ChunkCache():
+    """A thread safe LRU cache of decoded chunks, bounded by their total
+    size in bytes."""
+
+    def __init__(self, nbytes=CACHE_NBYTES):
+        self.max_nbytes = nbytes
+        self.nbytes = 0
+        self.chunks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, load) -> np.ndarray:
+        """Return the chunk stored under key, calling load to read it if it is
+        not cached."""
+
+        with self.lock:
+            if key in self.chunks:
+                self.chunks.move_to_end(key)
+                return self.chunks[key]
+
+        chunk = load()
+
+        with self.lock:
+            if key not in self.chunks:
+                self.chunks[key] = chunk
+                self.nbytes += chunk.nbytes
+            while self.nbytes > self.max_nbytes and len(self.chunks) > 1:
+                (_, old) = self.chunks.popitem(last=False)
+                self.nbytes -= old.nbytes
+
+        return chunk
+
+
+class MappedSource():
+    """Reads boxes of a memory mapped array."""
+
+    def __init__(self, array: np.ndarray):
+        self.array = array
+        self.shape = array.shape
+        self.dtype = array.dtype
+
+    def read(self, box: tuple) -> np.ndarray:
+        return np.array(self.array[box_slices(box)])
+
+
+class ChunkedSource():
+    """Reads boxes of a chunked array chunk by chunk. Subclasses return the
+    chunk starting at an offset from chunk."""
+
+    def chunk(self, offset: Tuple[int, ...]) -> np.ndarray:
+        raise NotImplementedError
+
+    def read(self, box: tuple) -> np.ndarray:
+        out = np.empty([hi - lo for (lo, hi) in box], self.dtype)
+        starts = [range(lo // c * c, hi, c) for ((lo, hi), c) in zip(box, self.chunks)]
+
+        for offset in itertools.product(*starts):
+            chunk = self.chunk(offset)
+            src = tuple(slice(max(lo - o, 0), min(hi - o, c))
+                        for ((lo, hi), o, c) in zip(box, offset, self.chunks))
+            dst = tuple(slice(max(o - lo, 0), min(o + c, hi) - lo)
+                        for ((lo, hi), o, c) in zip(box, offset, self.chunks))
+            out[dst] = chunk[src]
+
+        return out
+
+
+class DatasetSource(ChunkedSource):
+    """Reads a chunked HDF5 dataset. Without filters the chunks are views of a
+    memory map of the file. Otherwise they are decoded by HDF5 once and kept
+    in the cache."""
+
+    def __init__(self, dataset: h5py.Dataset, cache: ChunkCache, mmap=None):
+        self.dataset = dataset
+        self.cache = cache
+        self.mmap = mmap
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+        self.chunks = dataset.chunks
+
+    def chunk(self, offset: Tuple[int, ...]) -> np.ndarray:
+        if self.mmap is not None:
+            info = self.dataset.id.get_chunk_info_by_coord(offset)
+            if info.byte_offset is None:
+                return np.zeros(self.chunks, self.dtype)
+            return np.ndarray(self.chunks, self.dtype, self.mmap, info.byte_offset)
+
+        slices = tuple(slice(o, o + c) for (o, c) in zip(offset, self.chunks))
+        return self.cache.get((id(self), offset), lambda: self.dataset[slices])
+
+
+class DirectorySource(ChunkedSource):
+    """Reads an array of a directory store written by DirectoryArrayWriter.
+    Decoded chunks are kept in the cache, if there is one."""
+
+    def __init__(self, path: str, metadata: dict, cache: Optional[ChunkCache]):
+        compressor = metadata["compressor"]
+        if compressor is not None and compressor["id"] != "zlib":
+            raise ValueError("Unsupported compressor {}.".format(compressor["id"]))
+
+        self.path = path
+        self.cache = cache
+        self.compressed = compressor is not None
+        self.shape = tuple(metadata["shape"])
+        self.dtype = np.dtype(metadata["dtype"])
+        self.chunks = tuple(metadata["chunks"])
+
+    def load(self, offset: Tuple[int, ...]) -> np.ndarray:
+        try:
+            with open(os.path.join(self.path, chunk_key(offset, self.chunks)), "rb") as file:
+                buf = file.read()
+        except FileNotFoundError:
+            return np.zeros(self.chunks, self.dtype)
+
+        if self.compressed:
+            buf = zlib.decompress(buf)
+        return np.frombuffer(buf, self.dtype).reshape(self.chunks)
+
+    def chunk(self, offset: Tuple[int, ...]) -> np.ndarray:
+        if self.cache is None:
+            return self.load(offset)
+        return self.cache.get((self.path, offset), lambda: self.load(offset))
+
+
+def dataset_source(dataset: h5py.Dataset, cache: ChunkCache):
+    """Choose how to read a dataset: memory mapped if it is stored without
+    filters in a plain file, through the chunk cache otherwise."""
+
+    mmap = None
+    unfiltered = dataset.id.get_create_plist().get_nfilters() == 0
+    if unfiltered and dataset.file.driver == "sec2" and dataset.size:
+        mmap = np.memmap(dataset.file.filename, np.uint8, "r")
+
+    if dataset.chunks is None:
+        offset = dataset.id.get_offset()
+        if mmap is None or offset is None:
+            return MappedSource(dataset[...])
+        return MappedSource(np.ndarray(dataset.shape, dataset.dtype, mmap, offset))
+
+    return DatasetSource(dataset, cache, mmap)
+
+
+class LazyArray():
+    """A read-only array that stays on disk until it is indexed. It stacks its
+    sources along the first axis, so rolled segments read as one array.
+    Indexing returns a numpy array of only the requested elements."""
+
+    def __init__(self, sources: list):
+        self.sources = sources
+        self.starts = np.cumsum([0] + [s.shape[0] for s in sources])
+        self.shape = (int(self.starts[-1]), *sources[0].shape[1:])
+        self.dtype = sources[0].dtype
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        (box, index) = parse_key(key, self.shape)
+        return self.read(box)[index]
+
+    def read(self, box: tuple) -> np.ndarray:
+        """Read a box given as (start, stop) per axis."""
+
+        (lo, hi) = box[0]
+        parts = []
+        for (source, start) in zip(self.sources, self.starts):
+            a = max(lo - start, 0)
+            b = min(hi - start, source.shape[0])
+            if a < b:
+                parts.append(source.read(((a, b), *box[1:])))
+
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return np.empty([hi - lo for (lo, hi) in box], self.dtype)
+        return np.concatenate(parts)
+
+
+class ArrayReader():
+    def __init__(self,
+                 filename: str,
+                 groupname: Union[None, str] = None,
+                 cache_nbytes=CACHE_NBYTES):
+        """ This reads files written by TimestampedArrayWriter,
+        SegmentedArrayWriter, RawArrayWriter and DirectoryArrayWriter. data is a LazyArray of all
+        frames and times holds their timestamps. metadata holds the per frame
+        records of the experiment state, if they were saved, and summaries
+        maps the names of saved projections and downsampled volumes to
+        LazyArrays. For a master file of rolled
+        segments, the segments it lists are read directly.
+
+        Uncompressed data is memory mapped. Compressed chunks are kept in an
+        LRU cache of cache_nbytes, so neighbouring reads decode them once."""
+
+        self.filename = filename
+        self.cache = ChunkCache(cache_nbytes)
+        self.files = []
+        self.metadata = None
+        self.summaries = {}
+
+        if os.path.splitext(filename)[1] == ".raw":
+            (self.times, data) = read_raw(filename)
+            self.data = LazyArray([MappedSource(data)])
+            return
+
+        prefix = "" if groupname is None else groupname.strip("/") + "/"
+
+        if os.path.isdir(filename):
+            with open(os.path.join(filename, ".zmetadata")) as file:
+                metadata = json.load(file)["metadata"]
+            times = DirectorySource(os.path.join(filename, prefix + "times"),
+                                    metadata[prefix + "times/.zarray"], self.cache)
+            data = DirectorySource(os.path.join(filename, prefix + "data"),
+                                   metadata[prefix + "data/.zarray"], self.cache)
+            self.times = times.read(((0, times.shape[0]), ))
+            self.data = LazyArray([data])
+            return
+
+        file = h5py.File(filename, "r")
+        if "segments" in file.attrs:
+            directory = os.path.dirname(filename)
+            names = [os.path.join(directory, n) for n in file.attrs["segments"]]
+            file.close()
+            self.files = [h5py.File(n, "r") for n in names]
+        else:
+            self.files = [file]
+
+        self.times = np.concatenate([f[prefix + "times"][:] for f in self.files])
+        if prefix + "metadata" in self.files[0]:
+            self.metadata = np.concatenate([f[prefix + "metadata"][:] for f in self.files])
+        self.data = LazyArray([dataset_source(f[prefix + "data"], self.cache)
+                               for f in self.files])
+        for name in self.files[0][prefix + "data"].attrs.get("summaries", []):
+            self.summaries[name] = LazyArray([
+                dataset_source(f[prefix + name], self.cache) for f in self.files])
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.data.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.data.dtype
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key) -> np.ndarray:
+        return self.data[key]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for file in self.files:
+            file.close()
+        self.files = []
+
+    def find(self, start: float, stop: float) -> slice:
+        """Return the slice of frames with timestamps in [start, stop)."""
+
+        (i, j) = np.searchsorted(self.times, [start, stop])
+        return slice(int(i), int(j))
+
+    def nearest(self, times) -> np.ndarray:
+        """Return the index of the frame closest in time to each of times."""
+
+        times = np.asarray(times, np.float64)
+        if len(self.times) < 2:
+            return np.zeros(times.shape, np.intp)
+
+        i = np.clip(np.searchsorted(self.times, times), 1, len(self.times) - 1)
+        left = times - self.times[i - 1]
+        right = self.times[i] - times
+        return np.where(left <= right, i - 1, i)
+
+    def stream(self,
+               start=0,
+               stop: Optional[int] = None,
+               step=1,
+               read_ahead=4):
+        """Yield (time, frame) tuples in order. Up to read_ahead frames are
+        read in advance on a background thread while the caller works."""
+
+        frames = range(*slice(start, stop, step).indices(len(self)))
+        buffer = queue.Queue(maxsize=read_ahead)
+        done = threading.Event()
+
+        def put(item) -> bool:
+            while not done.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read():
+            try:
+                for i in frames:
+                    if not put((self.times[i], self.data[i])):
+                        return
+            except Exception as exc:
+                put(exc)
+                return
+            put(None)
+
+        threading.Thread(target=read, daemon=True).start()
+
+        try:
+            while True:
+                item = buffer.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            done.set()
+
+
+def tail(filename: str,
+         groupname: Union[None, str] = None,
+         start=0,
+         poll_interval=0.1,
+         timeout: Optional[float] = None):
+    """Yield (time, frame) tuples of a recording that is still being written,
+    from frame start on, as soon as they land. This follows HDF5 files written
+    with swmr set and directory stores. It stops after timeout seconds without
+    new frames, or never if timeout is None."""
+
+    prefix = "" if groupname is None else groupname.strip("/") + "/"
+    file = None
+
+    if os.path.isdir(filename):
+        cache = ChunkCache()
+
+        # The last chunk of times is rewritten as frames arrive, so only the
+        # chunks of data are cached.
+        def refresh():
+            with open(os.path.join(filename, ".zmetadata")) as meta_file:
+                metadata = json.load(meta_file)["metadata"]
+            times = DirectorySource(os.path.join(filename, prefix + "times"),
+                                    metadata[prefix + "times/.zarray"], None)
+            data = DirectorySource(os.path.join(filename, prefix + "data"),
+                                   metadata[prefix + "data/.zarray"], cache)
+            return (LazyArray([times]), LazyArray([data]))
+    else:
+        file = h5py.File(filename, "r", libver="latest", swmr=True)
+        times = file[prefix + "times"]
+        data = file[prefix + "data"]
+
+        def refresh():
+            times.refresh()
+            data.refresh()
+            return (times, data)
+
+    i = start
+    last = time.time()
+    try:
+        while True:
+            (times, data) = refresh()
+            n = min(len(times), len(data))
+            if i < n:
+                last = time.time()
+            while i < n:
+                yield (times[i], data[i])
+                i += 1
+
+            if timeout is not None and time.time() - last >= timeout:
+                return
+            time.sleep(poll_interval)
+    finally:
+        if file is not None:
+            file.close()
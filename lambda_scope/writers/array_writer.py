@@ -3,11 +3,49 @@
 # Copyright 2021
 # Author: Vivek Venkatachalam
 
-from typing import Tuple, Union
+import zlib
+import time
+import itertools
+from typing import Tuple, Union, Optional, Sequence
+from concurrent.futures import ThreadPoolExecutor
 
 import h5py
 import numpy as np
 
+from lambda_scope.writers.summaries import summarize, summary_shape
+
+try:
+    import lzf
+except ImportError:
+    lzf = None
+
+BATCH_NBYTES = 2 ** 27
+TIMES_CHUNK = 4096
+
+
+def compress_lzf(buf, level) -> Optional[bytes]:
+    """Compress buf the way the h5py LZF filter does, or return None if it
+    does not shrink."""
+    return lzf.compress(buf, len(buf) - 1)
+
+def compress_gzip(buf, level) -> Optional[bytes]:
+    """Compress buf the way the HDF5 deflate filter does."""
+    return zlib.compress(buf, 4 if level is None else level)
+
+COMPRESSORS = {
+    "lzf": compress_lzf,
+    "gzip": compress_gzip
+}
+
+
+def chunk_slices(shape: Tuple[int, ...], chunks: Tuple[int, ...]):
+    """Yield the offset and the slices of every chunk covering an array of
+    the given shape."""
+
+    starts = [range(0, n, c) for (n, c) in zip(shape, chunks)]
+    for offset in itertools.product(*starts):
+        yield (offset, tuple(slice(o, o + c) for (o, c) in zip(offset, chunks)))
+
 
 class ArrayWriter():
     def __init__(self,
@@ -17,9 +55,49 @@ class ArrayWriter():
                  dtype: np.dtype,
                  groupname: Union[None, str] = None,
                  compression="lzf",
-                 compression_opts=None):
+                 compression_opts=None,
+                 batch_size: Optional[int] = None,
+                 workers=0,
+                 chunks: Optional[Tuple[int, ...]] = None,
+                 swmr=False,
+                 flush_interval: Optional[float] = None,
+                 summaries: Sequence[str] = (),
+                 summary_workers=1):
         """ src.recv must be a coroutine that returns numpy arrays of the
-        specified shape and type."""
+        specified shape and type.
+
+        Frames are buffered in memory and written batch_size at a time, by
+        default as many as fit in BATCH_NBYTES, rounded up to whole chunks
+        along time. The datasets grow geometrically and are trimmed to the
+        number of frames on close, so buffered frames are lost and unused
+        space remains if the writer is not closed.
+
+        chunks is the chunk shape of the data including the time axis, by
+        default one frame per chunk. With workers set, the default is one
+        plane per chunk, the chunks are compressed with lzf or gzip on a pool
+        of that many threads and written with write_direct_chunk. The files
+        are read by h5py as usual. The chunk shape and compression are also
+        stored as attributes of the data.
+
+        With swmr set, the file is opened with libver="latest" and switched to
+        single-writer multiple-reader mode once the datasets exist, so other
+        processes can read it while it is written (see array_reader.tail).
+        The datasets then grow exactly to the frames written. flush_interval
+        additionally flushes buffered frames once they are that many seconds
+        old, checked as frames arrive.
+
+        summaries names projections and downsampled volumes (see
+        writers.summaries) that are saved as extra datasets of the same name,
+        e.g. mip_z or down_2. They are computed on a pool of summary_workers
+        threads as frames arrive and written with their batch."""
+
+        if workers:
+            if compression not in COMPRESSORS:
+                raise ValueError("Parallel compression supports {}.".format(
+                    ", ".join(COMPRESSORS)))
+            if compression == "lzf" and lzf is None:
+                raise ImportError("Parallel lzf compression needs python-lzf, "
+                                  "install lambda_scope[lzf].")
 
         self.src = src
 
@@ -29,7 +107,11 @@ class ArrayWriter():
         self.N_complete = 0
 
         self.filename = filename
-        self.file = h5py.File(filename, "a")
+        self.swmr = swmr
+        if swmr:
+            self.file = h5py.File(filename, "a", libver="latest")
+        else:
+            self.file = h5py.File(filename, "a")
 
         if groupname is None:
             groupname = "/"
@@ -39,19 +121,177 @@ class ArrayWriter():
                 groupname = "/" + groupname
             self.group = self.file.create_group(groupname)
 
+        if chunks is None:
+            if workers and len(shape) > 2:
+                chunks = (1, 1, *shape[1:])
+            else:
+                chunks = (1, *shape)
+        elif len(chunks) != len(shape) + 1:
+            raise ValueError("Chunks {} do not match frames of shape {}.".format(
+                chunks, shape))
+        chunks = (chunks[0], *(min(c, n) for (c, n) in zip(chunks[1:], shape)))
+
+        self.chunks = chunks
+        self.compression = compression
+        self.compression_opts = compression_opts
+
+        if batch_size is None:
+            frame_nbytes = np.prod(shape) * np.dtype(dtype).itemsize
+            batch_size = max(1, int(BATCH_NBYTES // frame_nbytes))
+        batch_size = -(-batch_size // chunks[0]) * chunks[0]
+
+        self.batch_size = batch_size
+        self.batch = np.empty((batch_size, *shape), dtype=dtype)
+        self.N_batched = 0
+        self.capacity = 0
+
+        self.flush_interval = flush_interval
+        self.flush_time = time.time()
+
+        self.pool = None
+        if workers:
+            self.pool = ThreadPoolExecutor(workers)
+            self.compressor = COMPRESSORS[compression]
+
+        self.summaries = list(summaries)
+        self.summary_shapes = [summary_shape(name, shape) for name in self.summaries]
+        self.summary_batches = [np.empty((batch_size, *s), dtype=dtype)
+                                for s in self.summary_shapes]
+        self.summary_jobs = []
+        self.summary_pool = None
+        if self.summaries:
+            self.summary_pool = ThreadPoolExecutor(summary_workers)
+
+        self.create_datasets()
+        if swmr:
+            self.file.swmr_mode = True
+
+    def create_datasets(self):
+        """Create the datasets. Subclasses add theirs here, before SWMR mode
+        forbids new ones."""
+
         self.data = self.group.create_dataset(
-            "data", (0, *shape),
-            chunks=(1, *shape),
-            dtype=dtype,
-            compression=compression,
-            compression_opts=compression_opts,
-            maxshape=(None, *shape))
+            "data", (0, *self.shape),
+            chunks=self.chunks,
+            dtype=self.dtype,
+            compression=self.compression,
+            compression_opts=self.compression_opts,
+            maxshape=(None, *self.shape))
+
+        self.data.attrs["chunks"] = self.chunks
+        self.data.attrs["compression"] = self.compression or "none"
+        if self.compression_opts is not None:
+            self.data.attrs["compression_opts"] = self.compression_opts
+
+        self.summary_datasets = []
+        for (name, shape) in zip(self.summaries, self.summary_shapes):
+            self.summary_datasets.append(self.group.create_dataset(
+                name, (0, *shape),
+                chunks=(1, *shape),
+                dtype=self.dtype,
+                compression=self.compression,
+                compression_opts=self.compression_opts,
+                maxshape=(None, *shape)))
+        if self.summaries:
+            self.data.attrs["summaries"] = self.summaries
 
     def close(self):
+        self.flush()
+        self.trim()
         self.file.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.summary_pool is not None:
+            self.summary_pool.shutdown()
+
+    def reserve(self, n: int):
+        """Make room for at least n frames, growing the datasets
+        geometrically so that resizing is rare. In SWMR mode readers take the
+        shape as the number of frames, so they grow to exactly n."""
+
+        if n > self.capacity:
+            if self.swmr:
+                self.capacity = n
+            else:
+                self.capacity = max(n, 2 * self.capacity, self.batch_size)
+            self.resize(self.capacity)
+
+    def resize(self, n: int):
+        self.data.resize((n, *self.shape))
+        for (dataset, shape) in zip(self.summary_datasets, self.summary_shapes):
+            dataset.resize((n, *shape))
+
+    def trim(self):
+        """Shrink the datasets to the number of frames written."""
+        self.capacity = self.N_complete
+        self.resize(self.N_complete)
+
+    def flush(self):
+        """Write all buffered frames in a single hyperslab write."""
+
+        if self.N_batched == 0:
+            return
+
+        start = self.N_complete - self.N_batched
+        self.reserve(self.N_complete)
+        self.write_batch(start, self.N_complete)
+        self.N_batched = 0
+
+        if self.swmr:
+            self.file.flush()
+        self.flush_time = time.time()
+
+    def write_batch(self, start: int, stop: int):
+        self.write_summaries(start, stop)
+
+        # Batches flushed early can start inside a chunk along time, which
+        # only HDF5 itself can merge.
+        if self.pool is None or start % self.data.chunks[0]:
+            self.data[start:stop, ...] = self.batch[:stop - start]
+            return
+
+        block = self.batch[:stop - start]
+        chunks = []
+        for (offset, slices) in chunk_slices(block.shape, self.data.chunks):
+            future = self.pool.submit(self.compress_chunk, block[slices])
+            chunks.append(((start + offset[0], *offset[1:]), future))
+
+        for (offset, future) in chunks:
+            (buf, filter_mask) = future.result()
+            self.data.id.write_direct_chunk(offset, buf, filter_mask)
+
+    def write_summaries(self, start: int, stop: int):
+        """Collect the summaries of the batch and write them."""
+
+        if not self.summaries:
+            return
+
+        for (i, job) in enumerate(self.summary_jobs):
+            for (batch, summary) in zip(self.summary_batches, job.result()):
+                batch[i] = summary
+        self.summary_jobs = []
+
+        for (dataset, batch) in zip(self.summary_datasets, self.summary_batches):
+            dataset[start:stop] = batch[:stop - start]
+
+    def compress_chunk(self, x: np.ndarray) -> Tuple[bytes, int]:
+        """Compress a chunk, padding it to the full chunk shape at the edges
+        of the dataset. Chunks that do not shrink are stored uncompressed with
+        the filter skipped through the filter mask."""
+
+        if x.shape != self.data.chunks:
+            padded = np.zeros(self.data.chunks, self.dtype)
+            padded[tuple(slice(0, n) for n in x.shape)] = x
+            x = padded
+
+        buf = x.tobytes()
+        compressed = self.compressor(buf, self.compression_opts)
+        if compressed is None or len(compressed) >= len(buf):
+            return (buf, 1)
+        return (compressed, 0)
 
     def save_frame(self):
-        x = self.src.get_last()
+        x = self.src.recv()
         self.append_data(x)
 
     def save_recent_frame(self):
@@ -65,18 +305,28 @@ class ArrayWriter():
             self.append_data(msg)
 
     def append_data(self, x):
+        self.batch[self.N_batched, ...] = x
+        if self.summaries:
+            self.summary_jobs.append(self.summary_pool.submit(
+                summarize, self.batch[self.N_batched], self.summaries))
+        self.N_batched += 1
         self.N_complete += 1
-        self.data.resize((self.N_complete, *self.shape))
-        self.data[self.N_complete - 1, ...] = x
+
+        if self.N_batched == self.batch_size:
+            self.flush()
+        elif (self.flush_interval is not None and
+              time.time() - self.flush_time >= self.flush_interval):
+            self.flush()
 
     @classmethod
     def from_source(cls,
                     src,
                     filename: str,
-                    groupname: Union[None, str] = None):
+                    groupname: Union[None, str] = None,
+                    **kwargs):
         """If the source has shape and dtype fields, this can be used to
         construct the writer more succinctly."""
-        return cls(src, filename, src.shape, src.dtype, groupname)
+        return cls(src, filename, src.shape, src.dtype, groupname, **kwargs)
 
 
 class TimestampedArrayWriter(ArrayWriter):
@@ -87,26 +337,64 @@ class TimestampedArrayWriter(ArrayWriter):
                  dtype: np.dtype,
                  groupname: Union[None, str] = None,
                  compression="lzf",
-                 compression_opts=None):
+                 compression_opts=None,
+                 batch_size: Optional[int] = None,
+                 workers=0,
+                 chunks: Optional[Tuple[int, ...]] = None,
+                 swmr=False,
+                 flush_interval: Optional[float] = None,
+                 metadata_dtype: Optional[np.dtype] = None,
+                 summaries: Sequence[str] = (),
+                 summary_workers=1):
         """ src must yield numpy arrays with shape and dtype matching the shape
-        and dtype provided."""
+        and dtype provided.
+
+        With metadata_dtype set, messages are (time, frame, record) and the
+        records are saved in a metadata dataset of that record dtype, one per
+        frame and batched with the frames."""
+
+        self.metadata_dtype = metadata_dtype
 
         ArrayWriter.__init__(self, src, filename, shape, dtype, groupname,
-                             compression, compression_opts)
+                             compression, compression_opts, batch_size,
+                             workers, chunks, swmr, flush_interval,
+                             summaries, summary_workers)
 
+        self.time_batch = np.empty((self.batch_size, ), dtype=np.float64)
+        if metadata_dtype is not None:
+            self.metadata_batch = np.zeros((self.batch_size, ), dtype=metadata_dtype)
+
+    def create_datasets(self):
+        ArrayWriter.create_datasets(self)
         self.times = self.group.create_dataset("times", (0, ),
-                                               chunks=(1, ),
+                                               chunks=(TIMES_CHUNK, ),
                                                dtype=np.dtype("float64"),
                                                maxshape=(None, ))
+        if self.metadata_dtype is not None:
+            self.metadata = self.group.create_dataset("metadata", (0, ),
+                                                      chunks=(TIMES_CHUNK, ),
+                                                      dtype=self.metadata_dtype,
+                                                      maxshape=(None, ))
 
-    def append_data(self, msg):
+    def resize(self, n: int):
+        ArrayWriter.resize(self, n)
+        self.times.resize((n, ))
+        if self.metadata_dtype is not None:
+            self.metadata.resize((n, ))
 
-        (t, x) = msg
+    def write_batch(self, start: int, stop: int):
+        ArrayWriter.write_batch(self, start, stop)
+        self.times[start:stop] = self.time_batch[:stop - start]
+        if self.metadata_dtype is not None:
+            self.metadata[start:stop] = self.metadata_batch[:stop - start]
 
-        self.N_complete += 1
+    def append_data(self, msg):
 
-        self.data.resize((self.N_complete, *self.shape))
-        self.times.resize((self.N_complete, ))
+        if self.metadata_dtype is None:
+            (t, x) = msg
+        else:
+            (t, x, record) = msg
+            self.metadata_batch[self.N_batched] = record
 
-        self.data[self.N_complete - 1, ...] = x
-        self.times[self.N_complete - 1] = t
\ No newline at end of file
+        self.time_batch[self.N_batched] = t
+        ArrayWriter.append_data(self, x)
@@ -0,0 +1,158 @@
+#! python
+#
+# Copyright 2021
+# Author: Mahdi Torkashvand, Vivek Venkatachalam
+
+"""
+Benchmarks chunk shapes and compression codecs of the array writer. For every
+configuration it reports the write throughput and the read latency of a whole
+volume, a single plane and a time series of a small ROI.
+
+Usage:
+    benchmark.py                        [options]
+
+Options:
+    -h --help                           Show this help.
+    --format=UINT16_ZYX_25_512_1024     Size and type of the volumes.
+                                            [default: UINT16_ZYX_25_512_1024]
+    --volumes=N                         Number of volumes written per configuration.
+                                            [default: 50]
+    --chunks=LIST                       Comma separated chunk shapes. Empty entries
+                                        let the writer choose.
+                                            [default: ,1_1_512_1024,16_1_64_64]
+    --compression=LIST                  Comma separated codecs: lzf, gzip or none.
+                                            [default: none,lzf,gzip]
+    --compression_level=N               Compression level, empty for the default
+                                        of the codec.
+                                            [default: ]
+    --workers=N                         Threads compressing chunks in parallel.
+                                            [default: 0]
+    --roi=SIZE                          Side length of the ROI read as time series.
+                                            [default: 64]
+    --directory=PATH                    Directory for the temporary files.
+                                            [default: .]
+"""
+
+import os
+import time
+from typing import Tuple, Optional
+
+import h5py
+import numpy as np
+from docopt import docopt
+
+from lambda_scope.writers.array_writer import TimestampedArrayWriter
+from lambda_scope.devices.utils import (
+    array_props_from_string,
+    chunks_from_string,
+    compression_from_string)
+
+def synthetic_volumes(
+        shape: Tuple[int, ...],
+        dtype: np.dtype,
+        n: int
+    ) -> np.ndarray:
+    """Create n volumes of camera-like noise with a few bright blobs, so
+    compression ratios are realistic."""
+
+    rng = np.random.default_rng(0)
+    grid = np.ogrid[tuple(slice(0, s) for s in shape)]
+    vols = rng.poisson(100, (n, *shape)).astype(dtype)
+
+    for vol in vols:
+        for _ in range(10):
+            center = [rng.uniform(0, s) for s in shape]
+            dist = sum((g - c) ** 2 for (g, c) in zip(grid, center))
+            vol += (1000 * np.exp(-dist / 50)).astype(dtype)
+
+    return vols
+
+def benchmark(
+        filename: str,
+        vols: np.ndarray,
+        count: int,
+        chunks: Optional[Tuple[int, ...]],
+        compression: Optional[str],
+        compression_opts: Optional[int],
+        workers: int,
+        roi: int) -> dict:
+    """Write count volumes with one configuration and time the common read
+    patterns."""
+
+    shape = vols.shape[1:]
+    writer = TimestampedArrayWriter(None, filename, shape, vols.dtype,
+                                    compression=compression,
+                                    compression_opts=compression_opts,
+                                    workers=workers,
+                                    chunks=chunks)
+
+    t0 = time.time()
+    for i in range(count):
+        writer.append_data((time.time(), vols[i % len(vols)]))
+    writer.close()
+    write_time = time.time() - t0
+
+    result = {
+        "compression": compression or "none",
+        "write_MBps": count * vols[0].nbytes / write_time / 2**20,
+        "file_MB": os.path.getsize(filename) / 2**20
+    }
+
+    rng = np.random.default_rng(1)
+    ts = rng.integers(0, count, 10)
+    zs = rng.integers(0, shape[0], 10)
+
+    with h5py.File(filename, "r") as file:
+        data = file["data"]
+        result["chunks"] = chunks_str(data.chunks)
+
+        t0 = time.time()
+        for t in ts:
+            _ = data[t]
+        result["volume_ms"] = 100 * (time.time() - t0)
+
+        t0 = time.time()
+        for (t, z) in zip(ts, zs):
+            _ = data[t, z]
+        result["plane_ms"] = 100 * (time.time() - t0)
+
+        (y, x) = (shape[-2] // 2, shape[-1] // 2)
+        t0 = time.time()
+        _ = data[:, zs[0], y:y + roi, x:x + roi]
+        result["roi_series_ms"] = 1000 * (time.time() - t0)
+
+    os.remove(filename)
+    return result
+
+def chunks_str(chunks: Tuple[int, ...]) -> str:
+    return "_".join(map(str, chunks))
+
+def main():
+    """CLI entry point."""
+
+    args = docopt(__doc__)
+
+    (dtype, _, shape) = array_props_from_string(args["--format"])
+    count = int(args["--volumes"])
+    vols = synthetic_volumes(shape, dtype, min(count, 8))
+    filename = os.path.join(args["--directory"], "benchmark.h5")
+
+    columns = ["chunks", "compression", "write_MBps", "file_MB",
+               "volume_ms", "plane_ms", "roi_series_ms"]
+    print(" ".join("{:>16}".format(c) for c in columns))
+
+    for chunks in args["--chunks"].split(","):
+        for codec in args["--compression"].split(","):
+            (compression, level) = compression_from_string(
+                codec, args["--compression_level"])
+            result = benchmark(filename, vols, count,
+                               chunks_from_string(chunks),
+                               compression, level,
+                               int(args["--workers"]),
+                               int(args["--roi"]))
+            print(" ".join("{:>16.2f}".format(result[c])
+                           if isinstance(result[c], float)
+                           else "{:>16}".format(result[c]) for c in columns))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#! python
+#
+# Copyright 2021
+# Author: Mahdi Torkashvand, Vivek Venkatachalam
+
+import os
+import json
+import time
+from typing import Tuple, Union, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from lambda_scope.writers.array_writer import TIMES_CHUNK, chunk_slices, compress_gzip
+
+# Codecs of the directory store and their Zarr (numcodecs) ids.
+CODECS = {
+    "gzip": "zlib"
+}
+DEFAULT_LEVEL = 4
+
+
+def write_atomic(filename: str, buf: bytes):
+    """Write a file next to its final name and swap it in, so readers see
+    either the old or the new file and never a partial one."""
+
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as file:
+        file.write(buf)
+    os.replace(tmp_filename, filename)
+
+def chunk_key(offset: Tuple[int, ...], chunks: Tuple[int, ...]) -> str:
+    """Return the file name of the chunk starting at offset."""
+    return ".".join(str(o // c) for (o, c) in zip(offset, chunks))
+
+def array_metadata(shape: Tuple[int, ...],
+                   chunks: Tuple[int, ...],
+                   dtype: np.dtype,
+                   compression: Optional[str],
+                   compression_opts: Optional[int]) -> dict:
+    """Return the .zarray document of an array."""
+
+    compressor = None
+    if compression is not None:
+        level = DEFAULT_LEVEL if compression_opts is None else compression_opts
+        compressor = {"id": CODECS[compression], "level": level}
+
+    return {
+        "chunks": list(chunks),
+        "compressor": compressor,
+        "dtype": np.dtype(dtype).str,
+        "fill_value": 0,
+        "filters": None,
+        "order": "C",
+        "shape": list(shape),
+        "zarr_format": 2
+    }
+
+
+class DirectoryArrayWriter():
+    def __init__(self,
+                 src,
+                 filename: str,
+                 shape: Tuple[int, ...],
+                 dtype: np.dtype,
+                 groupname: Union[None, str] = None,
+                 compression="gzip",
+                 compression_opts=None,
+                 workers=0,
+                 chunks: Optional[Tuple[int, ...]] = None,
+                 metadata_interval=1.0):
+        """ This has the same interface as TimestampedArrayWriter, but writes
+        a Zarr version 2 directory store named filename, with the arrays data
+        and times. Every chunk is a file of its own and other processes can
+        read the store while it is written.
+
+        Frames are collected until a chunk along time is full. Its chunk files
+        are then written, on a pool of workers threads if workers is set, each
+        next to its final name and swapped in. The array shapes in .zarray and
+        the consolidated .zmetadata only cover frames whose chunks are on disk,
+        and are rewritten at most every metadata_interval seconds and on close.
+
+        compression is gzip or None, which zarr reads with its zlib codec.
+        chunks follows ArrayWriter."""
+
+        if compression is not None and compression not in CODECS:
+            raise ValueError("Directory stores support {} or no compression.".format(
+                ", ".join(CODECS)))
+
+        self.src = src
+
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+
+        if chunks is None:
+            if workers and len(shape) > 2:
+                chunks = (1, 1, *shape[1:])
+            else:
+                chunks = (1, *shape)
+        elif len(chunks) != len(shape) + 1:
+            raise ValueError("Chunks {} do not match frames of shape {}.".format(
+                chunks, shape))
+        self.chunks = (chunks[0], *(min(c, n) for (c, n) in zip(chunks[1:], shape)))
+
+        self.compression = compression
+        self.compression_opts = compression_opts
+
+        self.filename = filename
+        self.prefix = "" if groupname is None else groupname.strip("/") + "/"
+        for name in ("data", "times"):
+            os.makedirs(os.path.join(filename, self.prefix, name), exist_ok=True)
+
+        self.batch = np.zeros((self.chunks[0], *shape), self.dtype)
+        self.times = np.zeros((TIMES_CHUNK, ), np.float64)
+
+        self.N_complete = 0
+        self.N_batched = 0
+        self.N_written = 0
+
+        self.pool = ThreadPoolExecutor(workers) if workers else None
+
+        self.metadata_interval = metadata_interval
+        self.metadata_time = 0
+        self.write_metadata()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.filename, self.prefix, name)
+
+    def write_chunk(self, name: str, key: str, x: np.ndarray, compress=True):
+        """Write a chunk file, padding chunks at the edges of the frame to the
+        full chunk shape as zarr expects."""
+
+        if name == "data" and x.shape != self.chunks:
+            padded = np.zeros(self.chunks, self.dtype)
+            padded[tuple(slice(0, n) for n in x.shape)] = x
+            x = padded
+
+        buf = x.tobytes()
+        if compress and self.compression is not None:
+            buf = compress_gzip(buf, self.compression_opts)
+        write_atomic(os.path.join(self.path(name), key), buf)
+
+    def write_metadata(self):
+        """Rewrite the array and consolidated metadata for the frames on
+        disk."""
+
+        n = self.N_written
+        metadata = {".zgroup": {"zarr_format": 2}}
+        if self.prefix:
+            metadata[self.prefix + ".zgroup"] = {"zarr_format": 2}
+        metadata[self.prefix + "data/.zarray"] = array_metadata(
+            (n, *self.shape), self.chunks, self.dtype,
+            self.compression, self.compression_opts)
+        metadata[self.prefix + "times/.zarray"] = array_metadata(
+            (n, ), (TIMES_CHUNK, ), np.float64, None, None)
+
+        for (key, value) in metadata.items():
+            write_atomic(os.path.join(self.filename, key),
+                         json.dumps(value).encode())
+
+        consolidated = {"zarr_consolidated_format": 1, "metadata": metadata}
+        write_atomic(os.path.join(self.filename, ".zmetadata"),
+                     json.dumps(consolidated).encode())
+
+        self.metadata_time = time.time()
+
+    def flush(self):
+        """Write the chunks of the buffered frames and their timestamps."""
+
+        if self.N_batched == 0:
+            return
+
+        t0 = self.N_written
+        jobs = []
+        for (offset, slices) in chunk_slices(self.batch.shape, self.chunks):
+            key = chunk_key((t0 + offset[0], *offset[1:]), self.chunks)
+            if self.pool is None:
+                self.write_chunk("data", key, self.batch[slices])
+            else:
+                jobs.append(self.pool.submit(self.write_chunk, "data", key,
+                                             self.batch[slices]))
+
+        for job in jobs:
+            job.result()
+
+        first = t0 // TIMES_CHUNK
+        last = (self.N_complete - 1) // TIMES_CHUNK
+        for i in range(first, last + 1):
+            self.write_chunk("times", str(i), self.times[i * TIMES_CHUNK:(i + 1) * TIMES_CHUNK],
+                             compress=False)
+
+        self.N_written = self.N_complete
+        self.N_batched = 0
+
+        if time.time() - self.metadata_time >= self.metadata_interval:
+            self.write_metadata()
+
+    def close(self):
+        self.flush()
+        self.write_metadata()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def save_frame(self):
+        self.append_data(self.src.recv())
+
+    def save_recent_frame(self):
+
+        result = self.src.get_last()
+
+        if result is None:
+            return
+        else:
+            self.append_data(result)
+
+    def append_data(self, msg):
+
+        (t, x) = msg
+
+        if self.N_complete == len(self.times):
+            self.times = np.concatenate([self.times, np.zeros_like(self.times)])
+
+        self.batch[self.N_batched, ...] = x
+        self.times[self.N_complete] = t
+        self.N_batched += 1
+        self.N_complete += 1
+
+        if self.N_batched == self.chunks[0]:
+            self.flush()
+
+    @classmethod
+    def from_source(cls,
+                    src,
+                    filename: str,
+                    groupname: Union[None, str] = None,
+                    **kwargs):
+        """If the source has shape and dtype fields, this can be used to
+        construct the writer more succinctly."""
+        return cls(src, filename, src.shape, src.dtype, groupname, **kwargs)
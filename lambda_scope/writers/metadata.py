@@ -0,0 +1,75 @@
+#! python
+#
+# Copyright 2021
+# Author: Mahdi Torkashvand, Vivek Venkatachalam
+
+from typing import List, Tuple
+
+import numpy as np
+
+# Fields of the default table as (name, path, dtype). A path is the device
+# name and a key of its status, as published to the logger.
+FIELDS = [
+    ("405nm", "daq.405nm", ("f4", (4, ))),
+    ("488nm", "daq.488nm", ("f4", (4, ))),
+    ("561nm", "daq.561nm", ("f4", (4, ))),
+    ("640nm", "daq.640nm", ("f4", (4, ))),
+    ("laser_running", "daq.laser_running", "u1"),
+    ("z_offset", "daq.z_offset", "f4"),
+    ("low_power", "AndorILE.low_power", "u1"),
+    ("filter_1", "dragonfly.filter_1", "S32"),
+    ("filter_2", "dragonfly.filter_2", "S32"),
+    ("valves", "valve.valve_status", ("u1", (16, ))),
+    ("flow", "microfluidic_device.flow", "S32"),
+    ("stage_x", "position.X", "f8"),
+    ("stage_y", "position.Y", "f8")
+]
+
+
+def convert(value, dtype: np.dtype):
+    """Convert a status value to a field of the given dtype. Numbers may come
+    as strings made by np.array_str."""
+
+    if dtype.kind == "S":
+        return str(value).encode()
+    if isinstance(value, str):
+        return np.array(value.strip("[]").split(), dtype.base).reshape(dtype.shape)
+    return value
+
+
+class MetadataTable():
+    """This tracks the state of the experiment from status messages and keeps
+    it as a single record, which is attached to every saved frame. Values
+    that can not be converted are counted in errors by field, and only the
+    first error of every field is printed."""
+
+    def __init__(self, fields: List[Tuple[str, str, object]] = FIELDS):
+        self.paths = {path: name for (name, path, _) in fields}
+        self.dtype = np.dtype([(name, dtype) for (name, _, dtype) in fields])
+        self.row = np.zeros((), self.dtype)
+        self.updates = 0
+        self.errors = {}
+
+    def update(self, status: dict):
+        """Apply a status message of the form {device: {key: value}}."""
+
+        for (device, values) in status.items():
+            if not isinstance(values, dict):
+                continue
+
+            for (key, value) in values.items():
+                name = self.paths.get("{}.{}".format(device, key))
+                if name is None:
+                    continue
+
+                try:
+                    self.row[name] = convert(value, self.dtype[name])
+                    self.updates += 1
+                except (TypeError, ValueError) as exc:
+                    if name not in self.errors:
+                        print("Metadata field {}: {}".format(name, exc))
+                    self.errors[name] = self.errors.get(name, 0) + 1
+
+    def snapshot(self) -> np.ndarray:
+        """Return a copy of the current record."""
+        return self.row.copy()
@@ -0,0 +1,242 @@
+#! python
+#
+# Copyright 2021
+# Author: Mahdi Torkashvand, Vivek Venkatachalam
+
+"""
+Converts a raw recording made by RawArrayWriter into the HDF5 layout written
+by TimestampedArrayWriter.
+
+Usage:
+    raw_writer.py --input=PATH          [options]
+
+Options:
+    -h --help                           Show this help.
+    --input=PATH                        Raw file to convert.
+    --output=PATH                       HDF5 file to write, by default the raw
+                                        file with the extension h5.
+                                            [default: ]
+    --chunks=T_Z_Y_X                    Chunk shape of the saved data. Empty
+                                        chooses one volume per chunk.
+                                            [default: ]
+    --compression=CODEC                 Compression codec: lzf, gzip or none.
+                                            [default: lzf]
+    --compression_level=N               Compression level, empty for the default
+                                        of the codec.
+                                            [default: ]
+    --workers=N                         Threads compressing chunks in parallel.
+                                            [default: 0]
+"""
+
+import os
+import json
+from typing import Tuple, Union, Optional
+
+import numpy as np
+from docopt import docopt
+
+from lambda_scope.writers.array_writer import BATCH_NBYTES, TimestampedArrayWriter
+from lambda_scope.devices.utils import chunks_from_string, compression_from_string
+
+ALIGNMENT = 4096
+PREALLOCATE_NBYTES = 2 ** 30
+INDEX_DTYPE = np.dtype([("frame", "<u8"), ("offset", "<u8"), ("time", "<f8")])
+
+
+def aligned_empty(nbytes: int, alignment=ALIGNMENT) -> np.ndarray:
+    """Allocate a byte buffer whose address is a multiple of alignment."""
+
+    buf = np.empty(nbytes + alignment, np.uint8)
+    start = -buf.ctypes.data % alignment
+    return buf[start:start + nbytes]
+
+def sidecar_filenames(filename: str) -> Tuple[str, str]:
+    """Return the names of the index and metadata files of a raw file."""
+
+    root = os.path.splitext(filename)[0]
+    return (root + ".idx", root + ".json")
+
+def read_raw(filename: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Open a raw recording and return its timestamps and a memory mapped
+    array of its frames. Only frames listed in the index are included, so
+    this also works on a recording that was never closed."""
+
+    (index_filename, meta_filename) = sidecar_filenames(filename)
+
+    with open(meta_filename) as file:
+        meta = json.load(file)
+
+    index = np.fromfile(index_filename, INDEX_DTYPE)
+    shape = tuple(meta["shape"])
+    dtype = np.dtype(meta["dtype"])
+    frame_nbytes = int(np.prod(shape)) * dtype.itemsize
+
+    if len(index) == 0:
+        return (index["time"], np.empty((0, *shape), dtype))
+
+    raw = np.memmap(filename, np.uint8, "r",
+                    shape=(len(index), meta["stride"]))
+    data = raw[:, :frame_nbytes].view(dtype).reshape((len(index), *shape))
+    return (index["time"], data)
+
+
+class RawArrayWriter():
+    def __init__(self,
+                 src,
+                 filename: str,
+                 shape: Tuple[int, ...],
+                 dtype: np.dtype,
+                 groupname: Union[None, str] = None,
+                 batch_size: Optional[int] = None,
+                 preallocate=PREALLOCATE_NBYTES,
+                 direct=False):
+        """ This has the same interface as TimestampedArrayWriter, but
+        appends frames to a raw file for the highest ingest rates.
+
+        Every frame starts on an ALIGNMENT boundary, frames are collected in
+        an aligned buffer and written batch_size at a time in one sequential
+        write, and the file is grown preallocate bytes at a time. With direct
+        set, the file is opened with O_DIRECT where the platform has it.
+
+        The sidecar .idx file holds a (frame, offset, time) record for every
+        written frame and the .json file holds the dtype, shape and stride.
+        groupname is ignored. Use read_raw to open the recording, or main to
+        convert it to HDF5."""
+
+        self.src = src
+
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+
+        self.frame_nbytes = int(np.prod(shape)) * self.dtype.itemsize
+        self.stride = -(-self.frame_nbytes // ALIGNMENT) * ALIGNMENT
+
+        if batch_size is None:
+            batch_size = max(1, int(BATCH_NBYTES // self.stride))
+
+        self.batch_size = batch_size
+        self.batch = aligned_empty(batch_size * self.stride)
+        self.time_batch = np.empty((batch_size, ), np.float64)
+
+        self.N_complete = 0
+        self.N_batched = 0
+        self.allocated = 0
+        self.preallocate = preallocate
+
+        self.filename = filename
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+        if direct:
+            flags |= getattr(os, "O_DIRECT", 0)
+        self.fd = os.open(filename, flags, 0o644)
+
+        (index_filename, self.meta_filename) = sidecar_filenames(filename)
+        self.index = open(index_filename, "wb")
+        self.write_meta()
+
+    def write_meta(self):
+        meta = {
+            "dtype": self.dtype.str,
+            "shape": list(self.shape),
+            "stride": self.stride,
+            "frames": self.N_complete
+        }
+        with open(self.meta_filename, "w") as file:
+            json.dump(meta, file)
+
+    def flush(self):
+        """Write all buffered frames and their index records."""
+
+        if self.N_batched == 0:
+            return
+
+        start = self.N_complete - self.N_batched
+        nbytes = self.N_batched * self.stride
+        end = self.N_complete * self.stride
+
+        if end > self.allocated:
+            self.allocated = max(end, self.allocated + self.preallocate)
+            os.ftruncate(self.fd, self.allocated)
+
+        buf = memoryview(self.batch[:nbytes])
+        while buf:
+            buf = buf[os.write(self.fd, buf):]
+
+        records = np.empty((self.N_batched, ), INDEX_DTYPE)
+        records["frame"] = np.arange(start, self.N_complete)
+        records["offset"] = records["frame"] * self.stride
+        records["time"] = self.time_batch[:self.N_batched]
+        self.index.write(records.tobytes())
+        self.index.flush()
+
+        self.N_batched = 0
+
+    def close(self):
+        self.flush()
+        os.ftruncate(self.fd, self.N_complete * self.stride)
+        os.close(self.fd)
+        self.index.close()
+        self.write_meta()
+
+    def save_frame(self):
+        self.append_data(self.src.recv())
+
+    def save_recent_frame(self):
+
+        result = self.src.get_last()
+
+        if result is None:
+            return
+        else:
+            self.append_data(result)
+
+    def append_data(self, msg):
+
+        (t, x) = msg
+
+        start = self.N_batched * self.stride
+        frame = self.batch[start:start + self.frame_nbytes]
+        np.copyto(frame.view(self.dtype).reshape(self.shape), x)
+        self.time_batch[self.N_batched] = t
+
+        self.N_batched += 1
+        self.N_complete += 1
+
+        if self.N_batched == self.batch_size:
+            self.flush()
+
+    @classmethod
+    def from_source(cls,
+                    src,
+                    filename: str,
+                    groupname: Union[None, str] = None,
+                    **kwargs):
+        """If the source has shape and dtype fields, this can be used to
+        construct the writer more succinctly."""
+        return cls(src, filename, src.shape, src.dtype, groupname, **kwargs)
+
+
+def main():
+    """CLI entry point."""
+
+    args = docopt(__doc__)
+
+    filename = args["--input"]
+    output = args["--output"] or os.path.splitext(filename)[0] + ".h5"
+    (compression, compression_level) = compression_from_string(
+        args["--compression"], args["--compression_level"])
+
+    (times, data) = read_raw(filename)
+
+    writer = TimestampedArrayWriter(None, output, data.shape[1:], data.dtype,
+                                    compression=compression,
+                                    compression_opts=compression_level,
+                                    workers=int(args["--workers"]),
+                                    chunks=chunks_from_string(args["--chunks"]))
+
+    for (t, x) in zip(times, data):
+        writer.append_data((t, x))
+
+    writer.close()
+
+if __name__ == "__main__":
+    main()
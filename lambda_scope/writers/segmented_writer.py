@@ -0,0 +1,196 @@
+#! python
+#
+# Copyright 2021
+# Author: Mahdi Torkashvand, Vivek Venkatachalam
+
+import os
+import time
+from typing import Tuple, Union
+
+import h5py
+import numpy as np
+
+from lambda_scope.writers.array_writer import TimestampedArrayWriter
+from lambda_scope.writers.summaries import summary_shape
+
+
+class SegmentedArrayWriter():
+    def __init__(self,
+                 src,
+                 filename: str,
+                 shape: Tuple[int, ...],
+                 dtype: np.dtype,
+                 groupname: Union[None, str] = None,
+                 max_frames=0,
+                 max_bytes=0,
+                 max_seconds=0,
+                 **kwargs):
+        """ This has the same interface as TimestampedArrayWriter, but rolls
+        over to a new segment file once a segment holds max_frames frames,
+        max_bytes of uncompressed data or is max_seconds old. Zero disables a
+        limit.
+
+        Segments are named after filename with a running index appended, and
+        every segment is closed and complete once the next one starts.
+        filename itself is a master file whose virtual datasets data and times
+        stitch the finished segments into one array. It is rewritten after
+        every rollover, so finished segments can be processed while the
+        recording goes on. If it can not be replaced at a rollover, e.g. while
+        a reader holds it open, the reason is kept in error until a later
+        rollover succeeds, and close raises it. Other keyword arguments are
+        passed on to the TimestampedArrayWriter of every segment."""
+
+        self.src = src
+
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.kwargs = kwargs
+        self.metadata_dtype = kwargs.get("metadata_dtype")
+
+        self.filename = filename
+        self.groupname = groupname
+
+        self.N_complete = 0
+        self.segments = []
+        self.segment_frames = []
+
+        self.writer = None
+        self.error = None
+        self.open_segment()
+
+    def open_segment(self):
+        """Start writing to the next segment file."""
+
+        (root, ext) = os.path.splitext(self.filename)
+        segment = "{}_{:04d}{}".format(root, len(self.segments), ext)
+
+        self.writer = TimestampedArrayWriter(None, segment, self.shape,
+                                             self.dtype, self.groupname,
+                                             **self.kwargs)
+        self.segment_start = time.time()
+        self.segments.append(segment)
+
+    def close_segment(self, strict=True):
+        """Close the current segment and update the master file. If the
+        master file can not be updated, the error is kept in error, and
+        raised if strict is set."""
+
+        self.writer.close()
+        self.segment_frames.append(self.writer.N_complete)
+        self.writer = None
+
+        try:
+            self.write_master()
+        except OSError as exc:
+            self.error = "Master file not updated: {}".format(exc)
+            if strict:
+                raise
+        else:
+            self.error = None
+
+    def rollover(self):
+        self.close_segment(strict=False)
+        self.open_segment()
+
+    def is_full(self) -> bool:
+        """Check whether the current segment reached one of its limits."""
+
+        n = self.writer.N_complete
+        frame_nbytes = np.prod(self.shape) * self.dtype.itemsize
+
+        return bool(
+            (self.max_frames and n >= self.max_frames) or
+            (self.max_bytes and n * frame_nbytes >= self.max_bytes) or
+            (self.max_seconds and
+             time.time() - self.segment_start >= self.max_seconds))
+
+    def write_master(self):
+        """Write the master file with virtual datasets over all closed
+        segments. It is written next to the old one and then swapped in, so
+        readers never see a partial file."""
+
+        names = [os.path.basename(s) for s in self.segments[:len(self.segment_frames)]]
+        total = sum(self.segment_frames)
+        path = "data" if self.groupname is None else self.groupname + "/data"
+        times_path = "times" if self.groupname is None else self.groupname + "/times"
+
+        metadata_dtype = self.metadata_dtype
+        metadata_path = "metadata" if self.groupname is None else self.groupname + "/metadata"
+
+        data = h5py.VirtualLayout((total, *self.shape), self.dtype)
+        times = h5py.VirtualLayout((total, ), np.float64)
+        if metadata_dtype is not None:
+            metadata = h5py.VirtualLayout((total, ), metadata_dtype)
+
+        start = 0
+        for (name, n) in zip(names, self.segment_frames):
+            data[start:start + n] = h5py.VirtualSource(
+                name, path, shape=(n, *self.shape))
+            times[start:start + n] = h5py.VirtualSource(
+                name, times_path, shape=(n, ))
+            if metadata_dtype is not None:
+                metadata[start:start + n] = h5py.VirtualSource(
+                    name, metadata_path, shape=(n, ))
+            start += n
+
+        summaries = []
+        for name in self.kwargs.get("summaries", ()):
+            shape = summary_shape(name, self.shape)
+            summary_path = name if self.groupname is None else self.groupname + "/" + name
+            layout = h5py.VirtualLayout((total, *shape), self.dtype)
+            start = 0
+            for (segment, n) in zip(names, self.segment_frames):
+                layout[start:start + n] = h5py.VirtualSource(
+                    segment, summary_path, shape=(n, *shape))
+                start += n
+            summaries.append((summary_path, layout))
+
+        tmp_filename = self.filename + ".tmp"
+        with h5py.File(tmp_filename, "w") as file:
+            file.create_virtual_dataset(path, data)
+            file.create_virtual_dataset(times_path, times)
+            if metadata_dtype is not None:
+                file.create_virtual_dataset(metadata_path, metadata)
+            for (summary_path, layout) in summaries:
+                file.create_virtual_dataset(summary_path, layout)
+            file.attrs["segments"] = names
+            file.attrs["segment_frames"] = self.segment_frames
+
+        os.replace(tmp_filename, self.filename)
+
+    def close(self):
+        self.close_segment()
+
+    def save_frame(self):
+        self.append_data(self.src.recv())
+
+    def save_recent_frame(self):
+
+        result = self.src.get_last()
+
+        if result is None:
+            return
+        else:
+            self.append_data(result)
+
+    def append_data(self, msg):
+
+        if self.is_full():
+            self.rollover()
+
+        self.writer.append_data(msg)
+        self.N_complete += 1
+
+    @classmethod
+    def from_source(cls,
+                    src,
+                    filename: str,
+                    groupname: Union[None, str] = None,
+                    **kwargs):
+        """If the source has shape and dtype fields, this can be used to
+        construct the writer more succinctly."""
+        return cls(src, filename, src.shape, src.dtype, groupname, **kwargs)
@@ -0,0 +1,75 @@
+#! python
+#
+# Copyright 2021
+# Author: Mahdi Torkashvand, Vivek Venkatachalam
+
+"""Small summaries of ZYX volumes that are saved next to the data: maximum
+intensity projections along each axis and volumes downsampled in Y and X by
+powers of two."""
+
+from typing import List, Tuple, Sequence
+
+import numpy as np
+
+# Axis each projection reduces, matching the projections of the displayer.
+MIPS = {
+    "mip_z": 0,
+    "mip_y": 1,
+    "mip_x": 2
+}
+
+
+def downsample_factor(name: str) -> int:
+    """Return the factor of a downsampled summary such as down_4."""
+
+    (prefix, _, factor) = name.partition("_")
+    if prefix != "down" or not factor.isdigit():
+        raise ValueError("Unknown summary {}.".format(name))
+
+    factor = int(factor)
+    if factor < 2 or factor & (factor - 1):
+        raise ValueError("Downsampling factors must be powers of two, got {}.".format(
+            factor))
+    return factor
+
+def summary_shape(name: str, shape: Tuple[int, ...]) -> Tuple[int, ...]:
+    """Return the shape of a summary of a volume of the given shape."""
+
+    if len(shape) != 3:
+        raise ValueError("Summaries need ZYX volumes, got shape {}.".format(shape))
+
+    if name in MIPS:
+        return tuple(n for (i, n) in enumerate(shape) if i != MIPS[name])
+
+    factor = downsample_factor(name)
+    return (shape[0], shape[1] // factor, shape[2] // factor)
+
+def bin2(x: np.ndarray) -> np.ndarray:
+    """Average 2x2 blocks in Y and X, dropping an odd last row or column."""
+
+    x = x[:, :x.shape[1] // 2 * 2, :x.shape[2] // 2 * 2]
+    rows = x[:, 0::2].astype(np.float32)
+    rows += x[:, 1::2]
+    return (rows[:, :, 0::2] + rows[:, :, 1::2]) * 0.25
+
+def summarize(x: np.ndarray, names: Sequence[str]) -> List[np.ndarray]:
+    """Compute the named summaries of a volume. Downsampled volumes are
+    computed as a pyramid, each level from the one before."""
+
+    out = {}
+    for name in names:
+        if name in MIPS:
+            out[name] = x.max(axis=MIPS[name])
+
+    level = x
+    factor = 1
+    for name in sorted((n for n in names if n not in MIPS), key=downsample_factor):
+        while factor < downsample_factor(name):
+            level = bin2(level)
+            factor *= 2
+        if x.dtype.kind in "ui":
+            out[name] = np.rint(level).astype(x.dtype)
+        else:
+            out[name] = level.astype(x.dtype)
+
+    return [out[name] for name in names]
@@ -6,18 +6,59 @@
 """This contains tools to send arrays of numbers between processes using TCP
 and ZeroMQ's Pub/Sub."""
 
-from typing import Tuple, Optional
+import time
+import struct
+from typing import List, Tuple, Optional
 
 import zmq
 import numpy as np
 
 from lambda_scope.zmq.utils import (
-    get_last,
+    drain,
+    make_timestamp,
+    unpack_timestamp,
     push_timestamp,
     pop_timestamp)
 
+HEADER_FORMAT = "<cBQd"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+def pack_header(
+        dtype: np.dtype,
+        shape: Tuple[int, ...],
+        sequence: int,
+        timestamp: float) -> bytes:
+    """Pack a compact description of an array: dtype code, number of
+    dimensions, frame sequence number, timestamp and shape."""
+
+    fmt = HEADER_FORMAT + "{}I".format(len(shape))
+    code = np.dtype(dtype).char.encode()
+    return struct.pack(fmt, code, len(shape), sequence, timestamp, *shape)
+
+def unpack_header(buf: bytes) -> Tuple[np.dtype, Tuple[int, ...], int, float]:
+    """Unpack a header made by pack_header into a tuple of (dtype, shape,
+    sequence, timestamp)."""
+
+    (code, ndim, sequence, timestamp) = struct.unpack_from(HEADER_FORMAT, buf)
+    shape = struct.unpack_from("<{}I".format(ndim), buf, HEADER_SIZE)
+    return (np.dtype(code.decode()), shape, sequence, timestamp)
+
+POLICIES = ("drop-newest", "drop-oldest", "block")
+
+def check_policy(policy: str):
+    """Raise a ValueError if policy is not a known backpressure policy."""
+    if policy not in POLICIES:
+        raise ValueError("Unknown policy {}, expected one of {}.".format(
+            policy, ", ".join(POLICIES)))
+
 class Publisher():
-    """This publishes arrays over TCP using ZMQ."""
+    """This publishes arrays over TCP using ZMQ. The policy decides what
+    happens once hwm messages are queued for a subscriber: drop-newest
+    discards new messages (the ZMQ default), drop-oldest keeps only the newest
+    message, and block waits up to timeout milliseconds (-1 waits forever)
+    before the message is counted in dropped."""
+
+    conflate = True
 
     def __init__(
             self,
@@ -25,11 +66,31 @@ class Publisher():
             port: int,
             shape: Tuple[int, ...],
             datatype: np.dtype,
-            bound=False):
+            bound=False,
+            hwm: Optional[int] = None,
+            buffer_size: Optional[int] = None,
+            policy="drop-newest",
+            timeout=-1):
+
+        check_policy(policy)
 
         self.context = zmq.Context.instance()
         self.socket = self.context.socket(zmq.PUB)
 
+        if hwm is not None:
+            self.socket.setsockopt(zmq.SNDHWM, hwm)
+        if buffer_size is not None:
+            self.socket.setsockopt(zmq.SNDBUF, buffer_size)
+        if policy == "drop-oldest":
+            if self.conflate:
+                self.socket.setsockopt(zmq.CONFLATE, 1)
+            else:
+                self.socket.setsockopt(zmq.SNDHWM, 1)
+        elif policy == "block":
+            self.socket.setsockopt(zmq.XPUB_NODROP, 1)
+            self.socket.setsockopt(zmq.SNDTIMEO, timeout)
+        self.policy = policy
+
         self.bound = bound
         address = "tcp://{}:{}".format(host, port)
         if bound:
@@ -42,6 +103,9 @@ class Publisher():
         self.numel = np.prod(shape)
         self.nbytes = self.numel * self.dtype.itemsize
 
+        self.sequence = 0
+        self.dropped = 0
+
     def set_shape(self, shape):
         self.shape = shape
         self.numel = np.prod(shape)
@@ -49,18 +113,80 @@ class Publisher():
 
     def send(self, data):
         """Publish an array."""
-        self.socket.send(data)
+        self.send_parts([data])
+
+    def send_parts(self, parts: List, copy=True):
+        """Send the parts of a message. If the send times out, the message is
+        counted as dropped."""
+        try:
+            self.socket.send_multipart(parts, copy=copy)
+        except zmq.error.Again:
+            self.dropped += 1
 
 class TimestampedPublisher(Publisher):
-    """This publishes arrays after appending timestamps as float64s."""
+    """This publishes arrays after appending timestamps as float64s. In
+    multipart mode the timestamp travels in its own small frame and the array
+    is handed to ZMQ without being copied. With header set, that first frame
+    also describes the dtype, shape and sequence number of the array, so
+    subscribers can follow shape changes on their own.
 
-    def send(self, data):
-        """Publish a time stamped array."""
-        data = push_timestamp(bytes(data))
-        self.socket.send(data)
+    ZMQ cannot conflate multipart messages, so with them drop-oldest limits
+    the send queue to a single message instead."""
+
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            shape: Tuple[int, ...],
+            datatype: np.dtype,
+            bound=False,
+            multipart=False,
+            header=False,
+            hwm: Optional[int] = None,
+            buffer_size: Optional[int] = None,
+            policy="drop-newest",
+            timeout=-1):
+
+        self.conflate = not (multipart or header)
+
+        Publisher.__init__(self, host, port, shape, datatype, bound,
+                           hwm, buffer_size, policy, timeout)
+
+        self.header = header
+        self.multipart = multipart or header
+
+    def send(self, data, timestamp: Optional[float] = None):
+        """Publish a time stamped array. In multipart mode the array must not
+        be modified after this call, since ZMQ sends from its memory."""
+
+        self.sequence += 1
+
+        if self.header:
+            data = np.ascontiguousarray(data)
+            if timestamp is None:
+                timestamp = time.time()
+            header = pack_header(data.dtype, data.shape, self.sequence, timestamp)
+            self.send_parts([header, data], copy=False)
+        elif self.multipart:
+            data = np.ascontiguousarray(data)
+            self.send_parts([make_timestamp(timestamp), data], copy=False)
+        else:
+            data = push_timestamp(bytes(data), timestamp)
+            self.send_parts([data])
 
 class Subscriber():
-    """This is a ZMQ subscriber that interprets messages as arrays."""
+    """This is a ZMQ subscriber that interprets messages as arrays. In latest
+    only mode the socket keeps at most the newest message, so a slow consumer
+    never has to work through a backlog. The number of messages discarded by
+    get_last is counted in skipped.
+
+    The policy decides what happens once hwm messages are queued: drop-newest
+    discards new messages (the ZMQ default), drop-oldest is the same as
+    latest only mode, and block leaves the queue unbounded. Nothing is dropped
+    here with block, but the publisher still drops messages at its own
+    high-water mark unless it uses block as well."""
+
+    conflate = True
 
     def __init__(
             self,
@@ -68,11 +194,31 @@ class Subscriber():
             port: int,
             shape: Tuple[int, ...],
             datatype: np.dtype,
-            bound=False):
+            bound=False,
+            latest_only=False,
+            hwm: Optional[int] = None,
+            buffer_size: Optional[int] = None,
+            policy="drop-newest"):
+
+        check_policy(policy)
 
         self.context = zmq.Context.instance()
         self.socket = self.context.socket(zmq.SUB)
 
+        if policy == "drop-oldest":
+            latest_only = True
+        elif policy == "block":
+            hwm = 0
+
+        if hwm is not None:
+            self.socket.setsockopt(zmq.RCVHWM, hwm)
+        if buffer_size is not None:
+            self.socket.setsockopt(zmq.RCVBUF, buffer_size)
+
+        self.latest_only = latest_only
+        if latest_only and self.conflate:
+            self.socket.setsockopt(zmq.CONFLATE, 1)
+
         self.bound = bound
         self.address = "tcp://{}:{}".format(host, port)
         if self.bound:
@@ -88,6 +234,14 @@ class Subscriber():
         self.numel = np.prod(shape)
         self.nbytes = self.numel * self.dtype.itemsize
 
+        self.sequence = None
+        self.dropped = 0
+        self.skipped = 0
+
+        # Messages get_last skipped since the last header, which are part of
+        # the next sequence gap but already counted in skipped.
+        self.unsequenced = 0
+
     def set_shape(self, shape):
         self.shape = shape
         self.numel = np.prod(shape)
@@ -96,42 +250,94 @@ class Subscriber():
     def recv(self) -> np.ndarray:
         """ This will block until a message appears on the channel, and if
         multiple messages are present it will return them in order."""
-        buf = self.socket.recv()
-        return self.array_from_bytes(buf)
+        frame = self.socket.recv(copy=False)
+        return self.array_from_bytes(frame.buffer)
 
     def get_last(self) -> Optional[np.ndarray]:
         """ This will return the most recent message present on the channel,
         and if no messages are present it will return None."""
-        buf = get_last(self.socket.recv)
+        (frame, skipped) = drain(self.recv_frame)
+        self.skipped += skipped
 
-        if buf is None:
+        if frame is None:
             return None
 
-        return self.array_from_bytes(buf)
+        return self.array_from_bytes(frame.buffer)
+
+    def recv_frame(self, flags=0) -> zmq.Frame:
+        """Receive a single frame without copying it out of ZMQ."""
+        return self.socket.recv(flags=flags, copy=False)
+
+    def recv_frames(self, flags=0) -> List[zmq.Frame]:
+        """Receive all frames of a message without copying them out of
+        ZMQ."""
+        return self.socket.recv_multipart(flags=flags, copy=False)
 
     def array_from_bytes(self, buf: bytes) -> np.ndarray:
-        """Convert a message of bytes into an array."""
+        """Convert a message of bytes into an array. The array is a view of
+        buf, so no data is copied."""
 
-        array_buf = buf[:self.nbytes]
-        data = np.frombuffer(array_buf, self.dtype)
+        data = np.frombuffer(buf, self.dtype, count=self.numel)
         shape = self.shape
         shape_list = list(shape)
         return data.reshape(shape_list)
 
 class TimestampedSubscriber(Subscriber):
-    """This subscribes to arrays generated by a TimestampedPublisher."""
+    """This subscribes to arrays generated by a TimestampedPublisher. Both
+    single frame and multipart messages are accepted. If messages carry a
+    header, the shape and dtype follow the header and gaps in the sequence
+    numbers are counted in dropped, except for the messages get_last skipped,
+    which are only counted in skipped. ZMQ cannot conflate multipart messages,
+    so in latest only mode they queue up to hwm as usual and get_last skips
+    to the newest. Frames are not copied out of ZMQ, so skipping is cheap."""
+
+    conflate = False
 
     def recv(self) -> Tuple[float, np.ndarray]:
-        buf = self.socket.recv()
-        return self.unpack_buffer(buf)
+        frames = self.recv_frames()
+        return self.unpack_frames(frames)
 
     def get_last(self) -> Optional[Tuple[float, np.ndarray]]:
-        buf = get_last(self.socket.recv)
+        (frames, skipped) = drain(self.recv_frames)
+        self.skipped += skipped
+        self.unsequenced += skipped
 
-        if buf is None:
+        if frames is None:
             return None
 
-        return self.unpack_buffer(buf)
+        return self.unpack_frames(frames)
+
+    def unpack_frames(self, frames: List[zmq.Frame]) -> Tuple[float, np.ndarray]:
+        """Convert the frames of a message into a tuple with the timestamp and
+        a view of the array."""
+
+        if len(frames) == 1:
+            return self.unpack_buffer(frames[0].buffer)
+
+        if len(frames[0]) == 8:
+            timestamp = unpack_timestamp(frames[0].buffer)
+        else:
+            timestamp = self.apply_header(frames[0].buffer)
+
+        data = self.array_from_bytes(frames[1].buffer)
+        return (timestamp, data)
+
+    def apply_header(self, buf: bytes) -> float:
+        """Update the shape and dtype from a header, count any frames missing
+        since the last one, and return the timestamp."""
+
+        (dtype, shape, sequence, timestamp) = unpack_header(buf)
+
+        if dtype != self.dtype or shape != tuple(self.shape):
+            self.dtype = dtype
+            self.set_shape(shape)
+
+        if self.sequence is not None and sequence > self.sequence:
+            self.dropped += max(sequence - self.sequence - 1 - self.unsequenced, 0)
+        self.sequence = sequence
+        self.unsequenced = 0
+
+        return timestamp
 
     def unpack_buffer(self, buf: bytes) -> Tuple[float, np.ndarray]:
         """Convert a buffer containing an image and a timestamp into a tuple
@@ -0,0 +1,233 @@
+#! python
+#
+# Copyright 2021
+# Author: Mahdi Torkashvand, Vivek Venkatachalam
+
+"""This contains tools to share arrays of numbers between processes on the
+same host. Arrays are copied once into a ring of slots in shared memory, and
+only a header and the location of the slot are sent over ZeroMQ's Pub/Sub."""
+
+import os
+import time
+import struct
+from typing import List, Tuple, Optional
+from multiprocessing import shared_memory, resource_tracker
+
+import zmq
+import numpy as np
+
+from lambda_scope.zmq.utils import drain
+from lambda_scope.zmq.array import (
+    TimestampedPublisher,
+    TimestampedSubscriber,
+    pack_header)
+
+SLOT_HEADER_SIZE = 64
+
+def check_ring_policy(policy: str):
+    """Raise a ValueError for the block policy, which the ring can not keep:
+    slots are reused whether or not readers are done with them."""
+    if policy == "block":
+        raise ValueError("Shared memory does not support the block policy, "
+                         "use tcp for volumes that must not be dropped.")
+
+def slot_size(nbytes: int) -> int:
+    """Return the size of a slot holding nbytes of data, padded so every slot
+    starts on a 64 byte boundary."""
+    return SLOT_HEADER_SIZE + -(-nbytes // 64) * 64
+
+class SharedMemoryPublisher(TimestampedPublisher):
+    """This publishes time stamped arrays through a ring of shared memory
+    slots. Only the header, the offset of the slot and the name of the shared
+    memory block are sent over TCP.
+
+    Slots are reused in turn, so a reader that falls slots arrays behind
+    loses the older ones. The block policy is therefore not supported."""
+
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            shape: Tuple[int, ...],
+            datatype: np.dtype,
+            bound=False,
+            slots=4,
+            hwm: Optional[int] = None,
+            buffer_size: Optional[int] = None,
+            policy="drop-newest",
+            timeout=-1):
+
+        check_ring_policy(policy)
+
+        TimestampedPublisher.__init__(self, host, port, shape, datatype, bound,
+                                      header=True, hwm=hwm,
+                                      buffer_size=buffer_size, policy=policy,
+                                      timeout=timeout)
+
+        self.slots = slots
+        self.memory = None
+        self.slot_nbytes = 0
+        self.allocate(self.nbytes)
+
+    def allocate(self, nbytes: int):
+        """Replace the ring with one whose slots can hold nbytes of data."""
+
+        self.release()
+        self.slot_nbytes = slot_size(int(nbytes))
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=self.slots * self.slot_nbytes)
+        self.memory_name = self.memory.name.encode()
+
+    def release(self):
+        """Close and remove the shared memory block."""
+
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+    def close(self):
+        """Close the socket and remove the shared memory block."""
+
+        self.socket.close()
+        self.release()
+
+    def send(self, data, timestamp: Optional[float] = None):
+        """Copy an array into the next slot and publish its location."""
+
+        data = np.ascontiguousarray(data)
+        if SLOT_HEADER_SIZE + data.nbytes > self.slot_nbytes:
+            self.allocate(data.nbytes)
+
+        self.sequence += 1
+        if timestamp is None:
+            timestamp = time.time()
+
+        offset = (self.sequence % self.slots) * self.slot_nbytes
+        stamp = np.ndarray((1,), np.uint64, self.memory.buf, offset)
+        slot = np.ndarray(data.shape, data.dtype, self.memory.buf,
+                          offset + SLOT_HEADER_SIZE)
+
+        stamp[0] = 0
+        slot[...] = data
+        stamp[0] = self.sequence
+
+        header = pack_header(data.dtype, data.shape, self.sequence, timestamp)
+        self.send_parts([header, struct.pack("<Q", offset), self.memory_name])
+
+class SharedMemorySubscriber(TimestampedSubscriber):
+    """This subscribes to arrays generated by a SharedMemoryPublisher. The
+    returned arrays are views into the ring, and stay valid until the
+    publisher has sent as many new arrays as it has slots. Readers that fall
+    behind skip straight to the newest slot in get_last.
+
+    Slots work as a seqlock: the publisher clears the stamp of a slot before
+    it writes and sets it to the sequence number after. With copy set, arrays
+    are copied out of the ring and the stamp is read again after the copy, so
+    an array the publisher overwrote while it was being copied is counted in
+    dropped instead of being returned. Readers of views can do the same with
+    valid."""
+
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            shape: Tuple[int, ...],
+            datatype: np.dtype,
+            bound=False,
+            latest_only=False,
+            hwm: Optional[int] = None,
+            buffer_size: Optional[int] = None,
+            policy="drop-newest",
+            copy=False):
+
+        check_ring_policy(policy)
+
+        TimestampedSubscriber.__init__(self, host, port, shape, datatype, bound,
+                                       latest_only, hwm, buffer_size, policy)
+
+        self.memory = None
+        self.copy = copy
+        self.slot = None
+
+    def attach(self, name: str):
+        """Open the shared memory block called name, if it is not open
+        already."""
+
+        if self.memory is not None and self.memory.name == name:
+            return
+
+        self.detach()
+        self.memory = shared_memory.SharedMemory(name=name)
+
+        # The publisher owns the block; stop the resource tracker from
+        # removing it when this process exits.
+        if os.name == "posix":
+            resource_tracker.unregister(self.memory._name, "shared_memory")
+
+    def detach(self):
+        """Close the shared memory block."""
+
+        if self.memory is not None:
+            try:
+                self.memory.close()
+            except BufferError:
+                pass
+            self.memory = None
+
+    def recv(self) -> Tuple[float, np.ndarray]:
+        while True:
+            msg = self.unpack_frames(self.recv_frames())
+            if msg is not None:
+                return msg
+
+    def get_last(self) -> Optional[Tuple[float, np.ndarray]]:
+        while True:
+            (frames, skipped) = drain(self.recv_frames)
+            self.skipped += skipped
+            self.unsequenced += skipped
+
+            if frames is None:
+                return None
+
+            msg = self.unpack_frames(frames)
+            if msg is not None:
+                return msg
+
+    def unpack_frames(
+            self,
+            frames: List[zmq.Frame]
+        ) -> Optional[Tuple[float, np.ndarray]]:
+        """Convert the frames of a message into a tuple with the timestamp and
+        a view of the slot, or a copy of it with copy set. If the slot has
+        already been reused, this counts the array as dropped and returns
+        None."""
+
+        timestamp = self.apply_header(frames[0].buffer)
+        (offset,) = struct.unpack("<Q", frames[1].buffer)
+        self.attach(frames[2].bytes.decode())
+
+        self.slot = (self.memory, offset, self.sequence)
+        if not self.valid():
+            self.dropped += 1
+            return None
+
+        data = np.ndarray(self.shape, self.dtype, self.memory.buf,
+                          offset + SLOT_HEADER_SIZE)
+        if self.copy:
+            data = data.copy()
+            if not self.valid():
+                self.dropped += 1
+                return None
+
+        return (timestamp, data)
+
+    def valid(self, slot=None) -> bool:
+        """Return whether a slot still holds its array, by default the slot of
+        the last array received. A reader of a view checks this after it is
+        done with the view. Readers that keep views while receiving more
+        arrays keep their slots to check them later."""
+
+        (memory, offset, sequence) = self.slot if slot is None else slot
+        stamp = np.ndarray((1,), np.uint64, memory.buf, offset)
+        return int(stamp[0]) == sequence
@@ -26,18 +26,21 @@ from lambda_scope.zmq.utils import (
     connect_or_bind,
     coerce_string,
     coerce_bytes,
-    get_last,
+    drain,
     try_num
 )
 
 class Subscriber():
-    """This wraps a ZMQ SUB socket."""
+    """This wraps a ZMQ SUB socket. In latest only mode the socket conflates
+    messages and keeps only the newest one. The number of messages discarded
+    by recv_last is counted in skipped."""
 
     def __init__(
             self,
             port: int,
             host="localhost",
-            bound=False):
+            bound=False,
+            latest_only=False):
 
         self.port = port
         self.host = host
@@ -46,6 +49,12 @@ class Subscriber():
         self.context = zmq.Context.instance()
         self.socket = self.context.socket(zmq.SUB)
 
+        self.latest_only = latest_only
+        if latest_only:
+            self.socket.setsockopt(zmq.CONFLATE, 1)
+
+        self.skipped = 0
+
         self.address = address_from_host_and_port(self.host,
                                                   self.port,
                                                   self.bound)
@@ -85,12 +94,16 @@ class Subscriber():
     def recv_last(self) -> Optional[bytes]:
         """Receive the last message sent, or None if none are present."""
 
-        return get_last(self.socket.recv)
+        (msg, skipped) = drain(self.socket.recv)
+        self.skipped += skipped
+        return msg
 
     def recv_last_string(self) -> Optional[str]:
         """Receive the last message sent, or None if none are present."""
 
-        return get_last(self.socket.recv_string)
+        (msg, skipped) = drain(self.socket.recv_string)
+        self.skipped += skipped
+        return msg
 
     def flush(self):
         """Receive and dump all available messages."""
@@ -7,7 +7,7 @@
 
 import time
 import struct
-from typing import Union, Tuple
+from typing import Union, Tuple, Optional
 
 import zmq
 
@@ -62,17 +62,27 @@ def get_last(receiver):
     """This retrieves the most recent message sent to a socket by calling
     receiver. If no messages are available, this will return None."""
 
+    (msg, _) = drain(receiver)
+    return msg
+
+def drain(receiver):
+    """This retrieves the most recent message sent to a socket by calling
+    receiver, and returns it with the number of older messages that were
+    discarded. If no messages are available, the message is None."""
+
     msg = None
+    received = 0
 
     while True:
         try:
             msg = receiver(flags=zmq.NOBLOCK)
+            received += 1
         except zmq.error.Again:
             break
         except:
             raise
 
-    return msg
+    return (msg, max(received - 1, 0))
 
 
 def parse_host_and_port(val: str) -> Tuple[str, int, bool]:
@@ -107,15 +117,26 @@ def parse_host_and_port(val: str) -> Tuple[str, int, bool]:
 
     return (host, port, bound)
 
-def push_timestamp(msg: bytes) -> bytes:
+def make_timestamp(timestamp: Optional[float] = None) -> bytes:
+    """ This packs a timestamp as a double. If none is given, the one returned
+    by python's time.time() is used."""
+    if timestamp is None:
+        timestamp = time.time()
+    return struct.pack('d', timestamp)
+
+def unpack_timestamp(buf: bytes) -> float:
+    """ This unpacks a timestamp packed by make_timestamp."""
+    return struct.unpack_from('d', buf)[0]
+
+def push_timestamp(msg: bytes, timestamp: Optional[float] = None) -> bytes:
     """ This prepends a timestamp returned by python's time.time() as a double
     to the buffer specified by msg."""
-    now = struct.pack('d', time.time())
-    return msg + now
+    return msg + make_timestamp(timestamp)
 
 def pop_timestamp(msg: bytes) -> Tuple[float, bytes]:
     """ This pulls out a timestamp as returned by python's time.time() from the
-    front of a message."""
+    front of a message. msg may be any buffer; a memoryview is sliced without
+    copying."""
     (timestamp, msg) = (msg[-8:], msg[:-8])
-    timestamp = struct.unpack('d', timestamp)[0]
+    timestamp = unpack_timestamp(timestamp)
     return (timestamp, msg)
@@ -6,6 +6,11 @@ requirements = [
     'pyzmq'
 ]
 
+# python-lzf lets the writers compress lzf chunks in parallel.
+extras = {
+    'lzf': ['python-lzf']
+}
+
 console_scripts = [
     'lambda_client=lambda_scope.zmq.client:main',
     'lambda_forwarder=lambda_scope.zmq.forwarder:main',
@@ -19,7 +24,10 @@ console_scripts = [
     'lambda_displayer=lambda_scope.devices.displayer:main',
     'lambda_data_hub=lambda_scope.devices.data_hub:main',
     'lambda_stage_data_hub=lambda_scope.devices.stage_data_hub:main',
+    'lambda_sim_camera=lambda_scope.devices.sim_camera:main',
     'lambda_writer=lambda_scope.devices.writer:main',
+    'lambda_writer_benchmark=lambda_scope.writers.benchmark:main',
+    'lambda_raw_to_hdf5=lambda_scope.writers.raw_writer:main',
     'lambda_processor=lambda_scope.devices.processor:main',
     'lambda_commands=lambda_scope.devices.commands:main',
     'lambda_zaber=lambda_scope.devices.zaber:main',
@@ -50,6 +58,7 @@ setuptools.setup(
         'console_scripts': console_scripts
     },
     install_requires=requirements,
+    extras_require=extras,
     packages=['lambda_scope'],
-    python_requires=">=3.6",
+    python_requires=">=3.8",
 )
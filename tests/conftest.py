@@ -0,0 +1,26 @@
+import time
+import socket
+
+import pytest
+
+
+def free_ports(n):
+    """n distinct free TCP ports on localhost."""
+    sockets = [socket.socket() for _ in range(n)]
+    for sock in sockets:
+        sock.bind(("localhost", 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+@pytest.fixture
+def port():
+    """A free TCP port on localhost."""
+    return free_ports(1)[0]
+
+
+def settle():
+    """Give ZMQ subscribers time to connect before anything is sent."""
+    time.sleep(0.3)
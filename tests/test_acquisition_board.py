@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from lambda_scope.devices.acquisition_board import WAVEFORM_CACHE_SIZE, PiezoCameraLaserDAQ
+
+from conftest import free_ports
+
+
+@pytest.fixture
+def daq():
+    (commands_port, outbound_port) = free_ports(2)
+    daq = PiezoCameraLaserDAQ(commands=("localhost", commands_port, False),
+                              outbound=("localhost", outbound_port, False),
+                              fmt="UINT16_ZYX_10_64_64",
+                              serial_num_daq1="sim1",
+                              serial_num_daq0="sim0",
+                              simulate=True)
+    yield daq
+    daq.daq0.release()
+    daq.daq1.release()
+
+
+@pytest.fixture
+def applied(daq, monkeypatch):
+    """Counts how often the board is reconfigured."""
+    calls = []
+    monkeypatch.setattr(daq, "_prepare_daq", lambda *args: calls.append(args))
+    return calls
+
+
+def test_setters_apply_immediately(daq, applied):
+    daq.set_stack_size(12)
+    daq.set_voltage_step(0.2)
+    assert len(applied) == 2
+
+
+def test_configure_applies_once(daq, applied):
+    daq.configure('{"stack_size":12,"voltage_step":0.2,"exposure_time":5}')
+    assert len(applied) == 1
+    assert daq.stack_size == 12
+    assert daq.voltage_step == 0.2
+
+
+def test_configure_inside_a_transaction_waits_for_the_outer_commit(daq, applied):
+    daq.begin()
+    daq.set_stack_size(12)
+    daq.configure({"voltage_step": 0.2})
+    daq.set_laser_continuous(1)
+    assert applied == []
+
+    daq.commit()
+    assert len(applied) == 1
+    assert daq.transaction == 0
+
+
+def test_unmatched_commit_applies(daq, applied):
+    daq.commit()
+    assert len(applied) == 1
+    assert daq.transaction == 0
+
+
+def loop_waveforms(daq):
+    """The waveforms as the board built them sample by sample."""
+    counts0 = np.zeros(2 * daq.stack_size * daq.n_increments, np.uint16)
+    counts1 = np.zeros(16 * daq.stack_size * daq.n_increments, np.uint16)
+
+    for i in range(daq.stack_size):
+        for j in range(daq.n_increments):
+            counts0[2 * (daq.n_increments * i + j) + 0] = daq.daq0.volts_to_counts(
+                daq.z_offset + i * daq.voltage_step)
+            counts0[2 * (daq.n_increments * i + j) + 1] = daq.daq0.volts_to_counts(
+                (j % daq.n_increments == 0) * 4.0)
+
+    for i in range(4):
+        for j in range(daq.stack_size):
+            for k in range(daq.n_increments):
+                for l in range(4):
+                    value = 0.0 if daq.laser_power[l, i] == 0 else \
+                        0.4 + 3.6 * (daq.laser_power[l, i] - 1) / 99.0
+                    counts1[4 * (i * daq.n_increments * daq.stack_size +
+                                 daq.n_increments * j + k) + l] = daq.daq1.volts_to_counts(value)
+
+    return (counts0, counts1)
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"stack_size": 7, "voltage_step": 0.25, "exposure_time": 15},
+    {"stack_size": 3, "exposure_time": 5},
+])
+def test_waveforms_match_the_sample_loop(daq, applied, params):
+    daq.configure(params)
+    daq.laser_power = np.array([[0, 1, 50, 100],
+                                [100, 0, 0, 0],
+                                [0, 0, 25, 0],
+                                [75, 75, 0, 1]], dtype=float)
+
+    (counts0, counts1) = daq._waveforms()
+    (expected0, expected1) = loop_waveforms(daq)
+    assert np.array_equal(counts0, expected0)
+    assert np.array_equal(counts1, expected1)
+
+
+def test_waveforms_are_cached_per_parameters(daq, applied):
+    first = daq._waveforms()
+    assert daq._waveforms() is first
+
+    daq.set_voltage_step(0.2)
+    assert daq._waveforms() is not first
+    daq.set_voltage_step(0.1)
+    assert daq._waveforms() is first
+
+
+def test_waveform_cache_is_bounded(daq, applied):
+    for step in range(WAVEFORM_CACHE_SIZE + 5):
+        daq.voltage_step = 0.01 * step
+        daq._waveforms()
+    assert len(daq.waveforms) == WAVEFORM_CACHE_SIZE
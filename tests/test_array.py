@@ -0,0 +1,119 @@
+import time
+
+import numpy as np
+import pytest
+
+from lambda_scope.zmq.array import (
+    TimestampedPublisher,
+    TimestampedSubscriber,
+    pack_header,
+    unpack_header)
+
+from conftest import settle
+
+
+def make_pair(port, shape=(2, 3, 4), publisher_options=None, subscriber_options=None):
+    publisher = TimestampedPublisher("*", port, shape, np.uint16, bound=True,
+                                     **(publisher_options or {}))
+    subscriber = TimestampedSubscriber("localhost", port, shape, np.uint16,
+                                       **(subscriber_options or {}))
+    settle()
+    return (publisher, subscriber)
+
+
+def close(*ends):
+    for end in ends:
+        end.socket.close()
+
+
+@pytest.mark.parametrize("options", [{}, {"multipart": True}, {"header": True}])
+def test_round_trip(port, options):
+    (publisher, subscriber) = make_pair(port, publisher_options=options)
+    volume = np.arange(24, dtype=np.uint16).reshape(2, 3, 4)
+
+    publisher.send(volume, timestamp=3.25)
+    (timestamp, data) = subscriber.recv()
+
+    assert timestamp == 3.25
+    assert data.dtype == np.uint16
+    assert (data == volume).all()
+    close(publisher, subscriber)
+
+
+def test_multipart_sends_a_noncontiguous_array(port):
+    (publisher, subscriber) = make_pair(port, publisher_options={"multipart": True})
+    volume = np.arange(48, dtype=np.uint16).reshape(2, 3, 8)[:, :, ::2]
+
+    publisher.send(volume)
+    (_, data) = subscriber.recv()
+
+    assert (data == volume).all()
+    close(publisher, subscriber)
+
+
+def test_header_round_trip():
+    header = pack_header(np.dtype("<u2"), (25, 512, 1024), 7, 12.5)
+    assert unpack_header(header) == (np.dtype("<u2"), (25, 512, 1024), 7, 12.5)
+
+
+def test_header_follows_shape_and_dtype(port):
+    (publisher, subscriber) = make_pair(port, publisher_options={"header": True})
+    publisher.send(np.ones((5, 6), np.float32))
+
+    (_, data) = subscriber.recv()
+    assert data.shape == (5, 6)
+    assert data.dtype == np.float32
+    assert subscriber.shape == (5, 6)
+    close(publisher, subscriber)
+
+
+def test_header_gaps_are_dropped(port):
+    (publisher, subscriber) = make_pair(port, publisher_options={"header": True})
+    volume = np.zeros((2, 3, 4), np.uint16)
+
+    publisher.send(volume)
+    subscriber.recv()
+    publisher.sequence += 3
+    publisher.send(volume)
+    subscriber.recv()
+
+    assert subscriber.dropped == 3
+    assert subscriber.skipped == 0
+    close(publisher, subscriber)
+
+
+def test_latest_only_never_drains_a_backlog(port):
+    # Frames of 4 MB overflow the socket buffers, so a backlog also waits in
+    # the publisher's queue.
+    shape = (2, 1024, 1024)
+    (publisher, subscriber) = make_pair(port, shape,
+                                        publisher_options={"header": True},
+                                        subscriber_options={"latest_only": True})
+    for i in range(40):
+        publisher.send(np.full(shape, i, np.uint16))
+    time.sleep(1)
+
+    (_, data) = subscriber.get_last()
+    assert (data == 39).all()
+    assert subscriber.get_last() is None
+
+    publisher.send(np.full(shape, 40, np.uint16))
+    time.sleep(0.3)
+    (_, data) = subscriber.get_last()
+    assert (data == 40).all()
+    assert subscriber.skipped == 39
+    assert subscriber.dropped == 0
+    close(publisher, subscriber)
+
+
+def test_get_last_counts_skipped_messages_once(port):
+    (publisher, subscriber) = make_pair(port, publisher_options={"header": True})
+    for i in range(5):
+        publisher.send(np.full((2, 3, 4), i, np.uint16))
+    time.sleep(0.1)
+
+    (_, data) = subscriber.get_last()
+    assert (data == 4).all()
+    assert subscriber.skipped == 4
+    assert subscriber.dropped == 0
+    close(publisher, subscriber)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from lambda_scope.writers.array_reader import ArrayReader, parse_key
+from lambda_scope.writers.array_writer import TimestampedArrayWriter
+from lambda_scope.writers.raw_writer import RawArrayWriter
+from lambda_scope.writers.segmented_writer import SegmentedArrayWriter
+
+SHAPE = (3, 8, 10)
+
+
+def frames(n):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 4096, (n, *SHAPE), dtype=np.uint16)
+
+
+def write(writer, data):
+    for (i, x) in enumerate(data):
+        writer.append_data((float(i), x))
+    writer.close()
+
+
+@pytest.fixture(params=["h5", "gzip", "segmented", "raw"])
+def recording(request, tmp_path):
+    data = frames(7)
+    if request.param == "raw":
+        filename = str(tmp_path / "data.raw")
+        write(RawArrayWriter(None, filename, SHAPE, np.uint16), data)
+    elif request.param == "segmented":
+        filename = str(tmp_path / "data.h5")
+        write(SegmentedArrayWriter(None, filename, SHAPE, np.uint16, max_frames=3), data)
+    else:
+        filename = str(tmp_path / "data.h5")
+        compression = "gzip" if request.param == "gzip" else None
+        write(TimestampedArrayWriter(None, filename, SHAPE, np.uint16,
+                                     compression=compression), data)
+    return (filename, data)
+
+
+@pytest.mark.parametrize("key", [
+    2,
+    -1,
+    slice(1, 6),
+    slice(None, None, 2),
+    slice(6, 0, -2),
+    (slice(2, 5), 1),
+    (Ellipsis, slice(3, 7)),
+    (4, slice(None), 2, slice(1, 9, 3)),
+])
+def test_indexing_matches_numpy(recording, key):
+    (filename, data) = recording
+    with ArrayReader(filename) as reader:
+        assert reader.shape == data.shape
+        assert reader.dtype == data.dtype
+        assert len(reader) == len(data)
+        assert np.array_equal(reader[key], data[key])
+
+
+def test_find_and_nearest(recording):
+    (filename, _) = recording
+    with ArrayReader(filename) as reader:
+        assert list(reader.times) == list(range(7))
+        assert reader.find(2, 5) == slice(2, 5)
+        assert reader.find(2.5, 100) == slice(3, 7)
+        assert list(reader.nearest([-1, 1.4, 1.6, 10])) == [0, 1, 2, 6]
+
+
+def test_stream(recording):
+    (filename, data) = recording
+    with ArrayReader(filename) as reader:
+        items = list(reader.stream(1, 6, 2, read_ahead=1))
+    assert [t for (t, _) in items] == [1, 3, 5]
+    assert all(np.array_equal(x, data[int(t)]) for (t, x) in items)
+
+
+def test_stream_can_stop_early(recording):
+    (filename, _) = recording
+    with ArrayReader(filename) as reader:
+        for (t, _) in reader.stream(read_ahead=1):
+            if t == 2:
+                break
+
+
+def test_parse_key_errors():
+    with pytest.raises(IndexError):
+        parse_key(5, (5, 2))
+    with pytest.raises(IndexError):
+        parse_key((0, 0, 0), (5, 2))
@@ -0,0 +1,108 @@
+import h5py
+import numpy as np
+import pytest
+
+from lambda_scope.writers.array_writer import TimestampedArrayWriter
+
+SHAPE = (3, 8, 10)
+
+
+def frames(n):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 4096, (n, *SHAPE), dtype=np.uint16)
+
+
+def write(filename, data, **kwargs):
+    writer = TimestampedArrayWriter(None, filename, SHAPE, np.uint16, **kwargs)
+    for (i, x) in enumerate(data):
+        writer.append_data((float(i), x))
+    return writer
+
+
+def test_batches_grow_and_trim(tmp_path):
+    filename = str(tmp_path / "data.h5")
+    data = frames(10)
+    writer = write(filename, data, batch_size=4)
+
+    assert writer.N_batched == 2
+    assert writer.data.shape[0] >= 8
+    writer.close()
+
+    with h5py.File(filename, "r") as file:
+        assert file["data"].shape == (10, *SHAPE)
+        assert (file["data"][:] == data).all()
+        assert list(file["times"][:]) == list(range(10))
+
+
+@pytest.mark.parametrize("compression", ["gzip", "lzf"])
+def test_parallel_compression_reads_back(tmp_path, compression):
+    if compression == "lzf":
+        pytest.importorskip("lzf")
+    filename = str(tmp_path / "data.h5")
+    data = frames(5)
+    write(filename, data, batch_size=2, workers=2, compression=compression).close()
+
+    with h5py.File(filename, "r") as file:
+        assert file["data"].chunks == (1, 1, *SHAPE[1:])
+        assert file["data"].compression == compression
+        assert (file["data"][:] == data).all()
+
+
+def test_incompressible_chunks_are_stored_raw(tmp_path):
+    filename = str(tmp_path / "data.h5")
+    noise = np.random.default_rng(1).integers(0, 2**16, (2, *SHAPE), dtype=np.uint16)
+    writer = write(filename, noise, workers=1, compression="gzip")
+
+    (buf, filter_mask) = writer.compress_chunk(noise[0:1, 0:1])
+    assert filter_mask == 1
+    assert len(buf) == noise[0, 0].nbytes
+    writer.close()
+
+    with h5py.File(filename, "r") as file:
+        assert (file["data"][:] == noise).all()
+
+
+def test_parallel_compression_needs_a_known_codec(tmp_path):
+    with pytest.raises(ValueError):
+        TimestampedArrayWriter(None, str(tmp_path / "data.h5"), SHAPE, np.uint16,
+                               workers=2, compression="szip")
+
+
+def test_chunks_and_compression_are_configurable(tmp_path):
+    filename = str(tmp_path / "data.h5")
+    data = frames(4)
+    write(filename, data, chunks=(2, 1, 4, 100), compression="gzip",
+          compression_opts=6).close()
+
+    with h5py.File(filename, "r") as file:
+        dataset = file["data"]
+        assert dataset.chunks == (2, 1, 4, 10)
+        assert dataset.compression == "gzip"
+        assert dataset.compression_opts == 6
+        assert tuple(dataset.attrs["chunks"]) == (2, 1, 4, 10)
+        assert dataset.attrs["compression"] == "gzip"
+        assert (dataset[:] == data).all()
+
+
+def test_uncompressed(tmp_path):
+    filename = str(tmp_path / "data.h5")
+    write(filename, frames(2), compression=None).close()
+
+    with h5py.File(filename, "r") as file:
+        assert file["data"].compression is None
+        assert file["data"].attrs["compression"] == "none"
+
+
+def test_chunks_must_match_the_frames(tmp_path):
+    with pytest.raises(ValueError):
+        write(str(tmp_path / "data.h5"), [], chunks=(1, 8, 10))
+
+
+def test_chunk_and_compression_strings():
+    from lambda_scope.devices.utils import chunks_from_string, compression_from_string
+
+    assert chunks_from_string("") is None
+    assert chunks_from_string("1_1_512_1024") == (1, 1, 512, 1024)
+    assert compression_from_string("none", "4") == (None, None)
+    assert compression_from_string("gzip", "") == ("gzip", None)
+    assert compression_from_string("gzip", "4") == ("gzip", 4)
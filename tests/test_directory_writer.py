@@ -0,0 +1,61 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from lambda_scope.writers.array_reader import ArrayReader
+from lambda_scope.writers.directory_writer import DirectoryArrayWriter
+
+SHAPE = (3, 8, 10)
+
+
+def frames(n):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 4096, (n, *SHAPE), dtype=np.uint16)
+
+
+def write(filename, data, **kwargs):
+    writer = DirectoryArrayWriter(None, filename, SHAPE, np.uint16, **kwargs)
+    for (i, x) in enumerate(data):
+        writer.append_data((float(i), x))
+    return writer
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"compression": None},
+    {"workers": 2},
+    {"chunks": (2, 2, 5, 4)},
+    {"groupname": "scope"},
+])
+def test_round_trip(tmp_path, kwargs):
+    filename = str(tmp_path / "data.zarr")
+    data = frames(7)
+    write(filename, data, **kwargs).close()
+
+    with ArrayReader(filename, kwargs.get("groupname")) as reader:
+        assert reader.shape == data.shape
+        assert list(reader.times) == list(range(7))
+        assert np.array_equal(reader[:], data)
+        assert np.array_equal(reader[3, :, 2:7], data[3, :, 2:7])
+
+
+def test_metadata_covers_written_frames(tmp_path):
+    filename = str(tmp_path / "data.zarr")
+    writer = write(filename, frames(5), chunks=(2, *SHAPE), metadata_interval=0)
+
+    with open(os.path.join(filename, ".zmetadata")) as file:
+        metadata = json.load(file)["metadata"]
+    assert metadata["data/.zarray"]["shape"] == [4, *SHAPE]
+    assert metadata["data/.zarray"]["compressor"]["id"] == "zlib"
+
+    writer.close()
+    with open(os.path.join(filename, "data", ".zarray")) as file:
+        assert json.load(file)["shape"] == [5, *SHAPE]
+
+
+def test_unsupported_compression(tmp_path):
+    with pytest.raises(ValueError):
+        DirectoryArrayWriter(None, str(tmp_path / "data.zarr"), SHAPE, np.uint16,
+                             compression="lzf")
@@ -0,0 +1,260 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+
+import zmq
+import numpy as np
+import pytest
+
+from lambda_scope.devices import rendering
+from lambda_scope.devices.displayer import PreviewServer
+from lambda_scope.devices.rendering import MIPRenderer, encode_image, encode_png
+from lambda_scope.zmq.array import TimestampedPublisher
+from lambda_scope.zmq.shared_memory import SharedMemoryPublisher
+
+from conftest import free_ports, settle
+
+FORMAT = "UINT16_ZYX_4_16_24"
+SHAPE = (4, 16, 24)
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            raise TimeoutError
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def make_preview():
+    """Builds headless displayers that are shut down after the test."""
+    devices = []
+
+    def make(**kwargs):
+        (inbound_port, commands_port, status_port) = free_ports(3)
+        options = dict(inbound=("localhost", inbound_port, True),
+                       commands=("localhost", commands_port, False),
+                       status_out=("localhost", status_port, False),
+                       fmt=FORMAT,
+                       name="displayer",
+                       lookup_table=(0, 4095),
+                       image_format="png",
+                       width=60,
+                       max_fps=100)
+        options.update(kwargs)
+        device = PreviewServer(**options)
+        devices.append(device)
+        return device
+
+    yield make
+    for device in devices:
+        device.shutdown()
+
+
+def start_threads(device):
+    threads = [threading.Thread(target=device.receive, daemon=True),
+               threading.Thread(target=device.render, daemon=True)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def test_render_thread_renders_the_pending_volume(make_preview):
+    device = make_preview()
+    volume = np.random.default_rng(0).integers(0, 4096, SHAPE, dtype=np.uint16)
+    device.pending = (1.5, time.time(), volume, None)
+
+    thread = threading.Thread(target=device.render, daemon=True)
+    thread.start()
+    wait_for(lambda: device.rendered == 1)
+    device.running = False
+    thread.join()
+
+    renderer = MIPRenderer(SHAPE, np.uint16, device.displayer_shape)
+    (image, timestamp, number) = device.frame
+    assert timestamp == 1.5
+    assert number == 1
+    assert np.array_equal(image, renderer.render(volume))
+    assert device.pending is None
+
+
+def test_volumes_flow_from_socket_to_frame(make_preview):
+    device = make_preview()
+    publisher = TimestampedPublisher("localhost", device.inbound[1], SHAPE, np.uint16)
+    threads = start_threads(device)
+    settle()
+
+    for i in range(3):
+        publisher.send(np.full(SHAPE, 1000 * i, np.uint16), timestamp=float(i))
+        wait_for(lambda: device.frame[1] == float(i))
+
+    device.running = False
+    for thread in threads:
+        thread.join()
+    publisher.socket.close()
+
+    assert device.received == 3
+    assert device.rendered == 3
+    (image, _, _) = device.frame
+    assert image[0, 0] == device.renderer.lut[2000]
+
+
+def test_a_new_shape_is_followed(make_preview):
+    device = make_preview()
+    device.pending = (0.0, time.time(), np.zeros((2, 8, 8), np.uint16), None)
+
+    thread = threading.Thread(target=device.render, daemon=True)
+    thread.start()
+    wait_for(lambda: device.rendered == 1)
+    device.running = False
+    thread.join()
+
+    assert device.shape == (2, 8, 8)
+    assert device.window_changed
+    assert device.frame[0].shape == device.displayer_shape
+
+
+def decode_png(buf):
+    """Decode the unfiltered grayscale PNGs of encode_png."""
+    assert buf[:8] == b"\x89PNG\r\n\x1a\n"
+    (pos, chunks) = (8, {})
+    while pos < len(buf):
+        n = int.from_bytes(buf[pos:pos + 4], "big")
+        chunks[buf[pos + 4:pos + 8]] = buf[pos + 8:pos + 8 + n]
+        pos += n + 12
+    (width, height) = (int.from_bytes(chunks[b"IHDR"][:4], "big"),
+                       int.from_bytes(chunks[b"IHDR"][4:8], "big"))
+    rows = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), np.uint8)
+    return rows.reshape(height, width + 1)[:, 1:]
+
+
+def test_encode_png():
+    image = np.random.default_rng(0).integers(0, 256, (7, 11), dtype=np.uint8)
+    assert np.array_equal(decode_png(encode_png(image)), image)
+
+
+def test_encode_image_errors():
+    with pytest.raises(ValueError):
+        encode_image(np.zeros((2, 2), np.uint8), "gif")
+    if rendering.cv2 is None:
+        with pytest.raises(ValueError):
+            encode_image(np.zeros((2, 2), np.uint8), "jpeg")
+
+
+def test_preview_is_encoded_published_and_served(make_preview):
+    (preview_port, http_port) = free_ports(2)
+    device = make_preview(preview_out=("localhost", preview_port, True),
+                          http=("localhost", http_port))
+    assert device.display_shape(SHAPE)[1] == 60
+
+    subscriber = zmq.Context.instance().socket(zmq.SUB)
+    subscriber.connect("tcp://localhost:{}".format(preview_port))
+    subscriber.setsockopt(zmq.SUBSCRIBE, b"")
+    settle()
+
+    device.process()
+    assert device.preview is None
+
+    image = np.arange(device.displayer_shape[0] * 60, dtype=np.uint8).reshape(-1, 60)
+    device.frame = (image, 2.5, 1)
+    device.process()
+    device.process()
+    assert device.shown == 1
+    assert np.array_equal(decode_png(device.preview), image)
+
+    (name, metadata, buf) = subscriber.recv_multipart()
+    assert name == b"displayer"
+    assert json.loads(metadata) == {"timestamp": 2.5, "shape": list(image.shape),
+                                    "format": "png"}
+    assert buf == device.preview
+    subscriber.close()
+
+    url = "http://localhost:{}".format(http_port)
+    with urllib.request.urlopen(url + "/preview?1") as response:
+        assert response.headers["Content-Type"] == "image/png"
+        assert response.read() == device.preview
+    with urllib.request.urlopen(url + "/") as response:
+        assert b"preview" in response.read()
+    with pytest.raises(urllib.error.HTTPError):
+        urllib.request.urlopen(url + "/other")
+
+    device.update_status()
+    assert device.status["encoded_bytes"] == len(device.preview)
+
+
+def test_auto_contrast_sets_the_lookup_table(make_preview):
+    device = make_preview(auto_contrast=True)
+    volume = np.random.default_rng(0).integers(1000, 2000, SHAPE, dtype=np.uint16)
+    device.pending = (0.0, time.time(), volume, None)
+
+    thread = threading.Thread(target=device.render, daemon=True)
+    thread.start()
+    wait_for(lambda: device.rendered == 1)
+    device.running = False
+    thread.join()
+
+    (lut_low, lut_high) = device.lookup_table
+    assert 900 < lut_low < lut_high < 2100
+    assert device.renderer.lookup_table == device.lookup_table
+
+    device.set_lookup_table(0, 4095)
+    assert not device.auto
+    device.set_auto_contrast(1, 5, 95)
+    assert device.auto
+    assert device.auto_contrast.percentiles == (5, 95)
+    assert device.auto_contrast.histogram.sum() == 0
+
+
+def test_set_projection(make_preview):
+    device = make_preview(projection=("plane", "2"))
+    assert device.renderer.projection == ("plane", 2)
+
+    device.set_projection("roi", 2, 10, 4, 20)
+    device.update_status()
+    assert device.status["projection"] == ["roi", 2, 10, 4, 20]
+
+    with pytest.raises(ValueError):
+        device.set_projection("max")
+    assert device.renderer.projection == ("roi", 2, 10, 4, 20)
+
+
+def test_shared_memory_views_are_checked_after_projecting(make_preview):
+    (data_port,) = free_ports(1)
+    publisher = SharedMemoryPublisher("*", data_port, SHAPE, np.uint16, bound=True,
+                                      slots=2)
+    device = make_preview(transport="shm", inbound=("localhost", data_port, False))
+    settle()
+
+    def receive(i):
+        publisher.send(np.full(SHAPE, 1000 * i, np.uint16), timestamp=float(i))
+        time.sleep(0.1)
+        (timestamp, volume) = device.data_subscriber.get_last()
+        assert not volume.flags.owndata
+        return (timestamp, time.time(), volume, device.data_subscriber.slot)
+
+    thread = threading.Thread(target=device.render, daemon=True)
+    try:
+        # The slot of the first volume is reused by the third.
+        device.pending = receive(1)
+        receive(2)
+        publisher.send(np.full(SHAPE, 3000, np.uint16), timestamp=3.0)
+        thread.start()
+        wait_for(lambda: device.overwritten == 1)
+        assert device.rendered == 0
+
+        device.pending = receive(4)
+        wait_for(lambda: device.rendered == 1)
+        assert device.frame[1] == 4.0
+        assert device.frame[0][0, 0] == device.renderer.lut[4000]
+
+        device.update_status()
+        assert device.status["dropped"] == 1
+    finally:
+        device.running = False
+        thread.join()
+        device.data_subscriber.detach()
+        publisher.close()
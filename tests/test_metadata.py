@@ -0,0 +1,29 @@
+from lambda_scope.writers.metadata import MetadataTable
+
+
+def test_update_and_snapshot():
+    table = MetadataTable()
+    table.update({"daq": {"488nm": "[1. 0. 0. 0.5]", "z_offset": 2.5},
+                  "dragonfly": {"filter_1": "GFP"},
+                  "valve": {"valve_status": list(range(16))},
+                  "other": {"ignored": 1}})
+
+    row = table.snapshot()
+    assert list(row["488nm"]) == [1, 0, 0, 0.5]
+    assert row["z_offset"] == 2.5
+    assert row["filter_1"] == b"GFP"
+    assert list(row["valves"]) == list(range(16))
+    assert table.updates == 4
+
+    table.update({"daq": {"z_offset": 3.0}})
+    assert row["z_offset"] == 2.5
+
+
+def test_malformed_values_are_counted_and_printed_once(capsys):
+    table = MetadataTable()
+    for _ in range(5):
+        table.update({"daq": {"z_offset": "not a number", "488nm": "[1 2]"}})
+
+    assert table.errors == {"z_offset": 5, "488nm": 5}
+    assert len(capsys.readouterr().out.splitlines()) == 2
+    assert table.snapshot()["z_offset"] == 0
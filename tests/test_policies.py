@@ -0,0 +1,44 @@
+import time
+import threading
+
+import zmq
+import numpy as np
+
+from lambda_scope.zmq.array import TimestampedPublisher, TimestampedSubscriber
+
+from conftest import settle
+
+
+def test_drop_oldest_multipart_keeps_one_message(port):
+    publisher = TimestampedPublisher("*", port, (4, 4), np.uint16, bound=True,
+                                     header=True, policy="drop-oldest")
+    try:
+        assert publisher.socket.getsockopt(zmq.SNDHWM) == 1
+    finally:
+        publisher.socket.close()
+
+
+def test_block_on_both_ends_drops_nothing(port):
+    publisher = TimestampedPublisher("*", port, (64, 64), np.uint16, bound=True,
+                                     header=True, hwm=2, policy="block")
+    subscriber = TimestampedSubscriber("localhost", port, (64, 64), np.uint16,
+                                       policy="block")
+    settle()
+
+    n = 50
+    sender = threading.Thread(
+        target=lambda: [publisher.send(np.full((64, 64), i, np.uint16)) for i in range(n)])
+    sender.start()
+
+    received = []
+    for _ in range(n):
+        (_, data) = subscriber.recv()
+        received.append(int(data[0, 0]))
+        time.sleep(0.002)
+    sender.join()
+
+    assert received == list(range(n))
+    assert publisher.dropped == 0
+    assert subscriber.dropped == 0
+    publisher.socket.close()
+    subscriber.socket.close()
@@ -0,0 +1,53 @@
+import sys
+
+import h5py
+import numpy as np
+import pytest
+
+from lambda_scope.writers import raw_writer
+from lambda_scope.writers.raw_writer import RawArrayWriter, read_raw
+
+
+def write_raw(filename, n, batch_size=2):
+    writer = RawArrayWriter(None, filename, (2, 3, 5), np.uint16, batch_size=batch_size)
+    for i in range(n):
+        writer.append_data((float(i), np.full((2, 3, 5), i, np.uint16)))
+    return writer
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / "data.raw")
+    write_raw(filename, 5).close()
+
+    (times, data) = read_raw(filename)
+    assert list(times) == list(range(5))
+    assert data.shape == (5, 2, 3, 5)
+    assert all((data[i] == i).all() for i in range(5))
+
+
+def test_unclosed_recording_reads_flushed_frames(tmp_path):
+    filename = str(tmp_path / "data.raw")
+    writer = write_raw(filename, 5)
+
+    (times, data) = read_raw(filename)
+    assert len(times) == 4
+    assert (data[3] == 3).all()
+    writer.close()
+
+
+def test_convert_to_hdf5(tmp_path, monkeypatch):
+    filename = str(tmp_path / "data.raw")
+    write_raw(filename, 3).close()
+
+    monkeypatch.setattr(sys, "argv", ["raw_writer.py", "--input=" + filename])
+    raw_writer.main()
+
+    with h5py.File(str(tmp_path / "data.h5"), "r") as file:
+        assert file["data"].shape == (3, 2, 3, 5)
+        assert list(file["times"][:]) == [0.0, 1.0, 2.0]
+
+
+def test_input_is_required(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["raw_writer.py"])
+    with pytest.raises(SystemExit):
+        raw_writer.main()
@@ -0,0 +1,214 @@
+import numpy as np
+import pytest
+
+from lambda_scope.devices.rendering import (
+    AutoContrast,
+    MIPRenderer,
+    composite_shape,
+    lookup_table,
+    nearest_indices)
+
+SHAPE = (6, 20, 30)
+
+
+def volume(seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 4096, SHAPE, dtype=np.uint16)
+
+
+def composite(x, z_scale=4):
+    """The three views at full resolution, before the lookup table."""
+    (z, y, x_) = x.shape
+    image = np.zeros(composite_shape(x.shape, z_scale), x.dtype)
+    image[:y, :x_] = x.max(axis=0)
+    image[:y, x_:] = np.repeat(x.max(axis=2).T, z_scale, axis=1)
+    image[y:, :x_] = np.repeat(x.max(axis=1), z_scale, axis=0)
+    return image
+
+
+def reference(x, display_shape, lut_low, lut_high):
+    image = composite(x)
+    rows = nearest_indices(display_shape[0], image.shape[0])
+    cols = nearest_indices(display_shape[1], image.shape[1])
+    canvas = lookup_table(lut_low, lut_high, x.dtype)[image[np.ix_(rows, cols)]]
+    canvas[np.ix_(rows >= x.shape[1], cols >= x.shape[2])] = 0
+    return canvas
+
+
+def test_lookup_table():
+    lut = lookup_table(100, 1100, np.uint16)
+    assert lut.shape == (65536, )
+    assert lut[0] == lut[100] == 0
+    assert lut[600] == 127
+    assert lut[1100] == lut[65535] == 255
+    assert (np.diff(lut.astype(int)) >= 0).all()
+
+
+@pytest.mark.parametrize("workers", [0, 2, 4])
+def test_projections_match_numpy(workers):
+    x = volume()
+    renderer = MIPRenderer(SHAPE, np.uint16, (44, 54), workers=workers)
+    mip_z = renderer.project(x)
+
+    assert np.array_equal(mip_z, x.max(axis=0))
+    assert np.array_equal(renderer.mip_y, x.max(axis=1))
+    assert np.array_equal(renderer.mip_x, x.max(axis=2))
+    renderer.close()
+
+
+@pytest.mark.parametrize("display_shape", [(44, 54), (22, 27), (100, 150)])
+def test_canvas_matches_resized_composite(display_shape):
+    x = volume()
+    renderer = MIPRenderer(SHAPE, np.uint16, display_shape, lookup_table=(200, 3000))
+    canvas = renderer.render(x)
+
+    assert canvas.shape == display_shape
+    assert np.array_equal(canvas, reference(x, display_shape, 200, 3000))
+
+
+def test_new_shape_and_lookup_table():
+    renderer = MIPRenderer(SHAPE, np.uint16, (44, 54))
+    renderer.render(volume())
+
+    shape = (3, 10, 12)
+    x = np.random.default_rng(1).integers(0, 4096, shape, dtype=np.uint16)
+    renderer.set_shape(shape)
+    renderer.set_lookup_table(0, 4095)
+    assert np.array_equal(renderer.render(x), reference(x, (44, 54), 0, 4095))
+
+
+def test_auto_contrast_bounds_follow_the_percentiles():
+    image = np.random.default_rng(0).integers(1000, 3000, (64, 64), dtype=np.uint16)
+    contrast = AutoContrast(np.uint16, 1, 99, stride=1)
+    (lut_low, lut_high) = contrast.update(image)
+
+    bin_width = 1 << contrast.shift
+    (low, high) = np.percentile(image, [1, 99])
+    assert low - bin_width <= lut_low <= low
+    assert high <= lut_high <= high + bin_width
+
+
+def test_auto_contrast_small_moves_are_ignored():
+    rng = np.random.default_rng(0)
+    contrast = AutoContrast(np.uint16, threshold=0.05)
+    first = contrast.update(rng.integers(1000, 3000, (64, 64), dtype=np.uint16))
+
+    assert contrast.update(rng.integers(1000, 3000, (64, 64), dtype=np.uint16)) is None
+    assert contrast.lookup_table == first
+
+    bounds = contrast.update(rng.integers(20000, 40000, (64, 64), dtype=np.uint16))
+    assert bounds[1] > 39000
+    for _ in range(50):
+        contrast.update(rng.integers(20000, 40000, (64, 64), dtype=np.uint16))
+    assert contrast.lookup_table[0] > 19000
+
+
+def test_auto_contrast_decays_and_resets():
+    contrast = AutoContrast(np.uint16, decay=0.5, stride=1)
+    contrast.update(np.full((8, 8), 1000, np.uint16))
+    contrast.update(np.full((8, 8), 5000, np.uint16))
+    assert contrast.histogram.sum() == pytest.approx(0.75)
+    assert contrast.histogram[5000 >> contrast.shift] == pytest.approx(0.5)
+
+    contrast.reset()
+    assert contrast.histogram.sum() == 0
+    assert contrast.lookup_table is None
+
+
+def test_auto_contrast_new_percentiles_apply_at_once():
+    image = np.random.default_rng(0).integers(0, 4096, (64, 64), dtype=np.uint16)
+    contrast = AutoContrast(np.uint16, 1, 99.9)
+    contrast.update(image)
+    contrast.set_percentiles(40, 60)
+
+    (lut_low, lut_high) = contrast.update(image)
+    assert 1400 < lut_low < lut_high < 2700
+
+
+def test_auto_contrast_of_uint8():
+    contrast = AutoContrast(np.uint8, bins=1024)
+    assert (contrast.shift, contrast.bins) == (0, 256)
+    assert contrast.update(np.full((4, 4), 7, np.uint8)) == (7, 8)
+
+
+def mean_z(x):
+    n = x.shape[0]
+    return ((x.sum(axis=0, dtype=np.uint64) + n // 2) // n).astype(x.dtype)
+
+
+@pytest.mark.parametrize("projection", [
+    ("plane", 2),
+    ("mean", ),
+    ("slab", 1, 4),
+    ("slab", 3, 4),
+])
+def test_single_projections_match_numpy(projection):
+    x = volume()
+    renderer = MIPRenderer(SHAPE, np.uint16, (44, 54), lookup_table=(200, 3000))
+    renderer.set_projection(*projection)
+    (rows, cols) = (renderer.y_rows, renderer.x_cols)
+
+    if projection[0] == "plane":
+        image = x[projection[1]]
+    elif projection[0] == "mean":
+        image = mean_z(x)
+    else:
+        image = x[projection[1]:projection[2]].max(axis=0)
+
+    view = renderer.project(x)
+    assert np.array_equal(view, image[np.ix_(rows, cols)])
+
+    canvas = renderer.draw()
+    expected = np.zeros_like(canvas)
+    expected[:len(rows), :len(cols)] = lookup_table(200, 3000, np.uint16)[view]
+    assert np.array_equal(canvas, expected)
+
+
+def test_roi_is_zoomed_keeping_its_aspect_ratio():
+    x = volume()
+    renderer = MIPRenderer(SHAPE, np.uint16, (88, 108))
+    renderer.set_projection("roi", 4, 8, 10, 22)
+
+    view = renderer.project(x)
+    (height, width) = view.shape
+    assert height <= renderer.n_top and width <= renderer.n_left
+    assert height == renderer.n_top or width == renderer.n_left
+    assert abs(height / width - 4 / 12) < 0.1
+
+    rows = 4 + nearest_indices(height, 4)
+    cols = 10 + nearest_indices(width, 12)
+    assert np.array_equal(view, x.max(axis=0)[np.ix_(rows, cols)])
+
+
+@pytest.mark.parametrize(("projection", "clipped"), [
+    (("plane", 99), ("plane", 5)),
+    (("plane", -3), ("plane", 0)),
+    (("slab", 4, 2), ("slab", 4, 5)),
+    (("slab", -1, 99), ("slab", 0, 6)),
+    (("roi", 30, 10, -5, 99), ("roi", 19, 20, 0, 30)),
+    (("plane", "3"), ("plane", 3)),
+])
+def test_projection_ranges_are_clipped(projection, clipped):
+    renderer = MIPRenderer(SHAPE, np.uint16, (44, 54))
+    renderer.set_projection(*projection)
+    assert renderer.projection == clipped
+    assert renderer.project(volume()).size > 0
+
+
+@pytest.mark.parametrize("projection", [("max", ), ("plane", ), ("slab", 1), ("mip", 1)])
+def test_unknown_projections(projection):
+    renderer = MIPRenderer(SHAPE, np.uint16, (44, 54))
+    with pytest.raises(ValueError):
+        renderer.set_projection(*projection)
+    assert renderer.projection == ("mip", )
+
+
+def test_projection_survives_a_new_shape():
+    renderer = MIPRenderer(SHAPE, np.uint16, (44, 54))
+    renderer.set_projection("slab", 2, 6)
+    renderer.set_shape((3, 10, 12))
+
+    x = np.random.default_rng(1).integers(0, 4096, (3, 10, 12), dtype=np.uint16)
+    assert renderer.projection == ("slab", 2, 3)
+    assert np.array_equal(renderer.project(x),
+                          x[2][np.ix_(renderer.y_rows, renderer.x_cols)])
@@ -0,0 +1,43 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from lambda_scope.writers.segmented_writer import SegmentedArrayWriter
+
+
+def write(writer, n):
+    for i in range(n):
+        writer.append_data((float(i), np.full((2, 3, 4), i, np.uint16)))
+
+
+def test_master_stitches_segments(tmp_path):
+    filename = str(tmp_path / "data.h5")
+    writer = SegmentedArrayWriter(None, filename, (2, 3, 4), np.uint16, max_frames=3)
+    write(writer, 7)
+    writer.close()
+
+    assert len(writer.segments) == 3
+    with h5py.File(filename, "r") as file:
+        assert file["data"].shape == (7, 2, 3, 4)
+        assert list(file["times"][:]) == list(range(7))
+        assert (file["data"][5] == 5).all()
+
+
+def test_master_replace_failure_is_reported(tmp_path, monkeypatch):
+    filename = str(tmp_path / "data.h5")
+    writer = SegmentedArrayWriter(None, filename, (2, 3, 4), np.uint16, max_frames=2)
+
+    def busy(src, dst):
+        raise PermissionError("master file is open")
+
+    monkeypatch.setattr(os, "replace", busy)
+    write(writer, 3)
+    assert "master file is open" in writer.error
+
+    with pytest.raises(PermissionError):
+        writer.close()
+
+    monkeypatch.undo()
+    assert "master file is open" in writer.error
@@ -0,0 +1,108 @@
+import time
+
+import numpy as np
+import pytest
+
+from lambda_scope.zmq.shared_memory import SharedMemoryPublisher, SharedMemorySubscriber
+
+from conftest import settle
+
+
+def make_pair(port, slots=4, **options):
+    publisher = SharedMemoryPublisher("*", port, (2, 3, 4), np.uint16, bound=True,
+                                      slots=slots)
+    subscriber = SharedMemorySubscriber("localhost", port, (2, 3, 4), np.uint16,
+                                        **options)
+    settle()
+    return (publisher, subscriber)
+
+
+def volume(i):
+    return np.full((2, 3, 4), i, np.uint16)
+
+
+def test_round_trip(port):
+    (publisher, subscriber) = make_pair(port)
+    try:
+        publisher.send(volume(7), timestamp=12.5)
+        (timestamp, data) = subscriber.recv()
+        assert timestamp == 12.5
+        assert (data == 7).all()
+        assert subscriber.valid()
+    finally:
+        subscriber.detach()
+        publisher.close()
+
+
+def test_wrapped_slot_is_dropped(port):
+    (publisher, subscriber) = make_pair(port, slots=2)
+    try:
+        for i in range(3):
+            publisher.send(volume(i))
+        time.sleep(0.1)
+
+        # The first slot was reused by the third volume.
+        (_, data) = subscriber.recv()
+        assert (data == 1).all()
+        assert subscriber.dropped == 1
+
+        (_, data) = subscriber.recv()
+        assert (data == 2).all()
+        assert subscriber.dropped == 1
+    finally:
+        subscriber.detach()
+        publisher.close()
+
+
+def test_view_is_invalid_after_wrap(port):
+    (publisher, subscriber) = make_pair(port, slots=2)
+    try:
+        publisher.send(volume(1))
+        (_, data) = subscriber.recv()
+        assert subscriber.valid()
+
+        publisher.send(volume(2))
+        publisher.send(volume(3))
+        assert not subscriber.valid()
+        assert (data == 3).all()
+    finally:
+        subscriber.detach()
+        publisher.close()
+
+
+def test_copy_outlives_slot(port):
+    (publisher, subscriber) = make_pair(port, slots=2, copy=True)
+    try:
+        publisher.send(volume(1))
+        (_, data) = subscriber.recv()
+        publisher.send(volume(2))
+        publisher.send(volume(3))
+        assert (data == 1).all()
+    finally:
+        subscriber.detach()
+        publisher.close()
+
+
+def test_skipped_volumes_are_not_dropped(port):
+    (publisher, subscriber) = make_pair(port, slots=8)
+    try:
+        for i in range(5):
+            publisher.send(volume(i))
+        time.sleep(0.1)
+
+        (_, data) = subscriber.get_last()
+        assert (data == 4).all()
+        assert subscriber.skipped == 4
+        assert subscriber.dropped == 0
+    finally:
+        subscriber.detach()
+        publisher.close()
+
+
+def test_block_is_rejected(port):
+    with pytest.raises(ValueError):
+        SharedMemoryPublisher("*", port, (2, 3, 4), np.uint16, bound=True,
+                              policy="block")
+    with pytest.raises(ValueError):
+        SharedMemorySubscriber("localhost", port, (2, 3, 4), np.uint16,
+                               policy="block")
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from lambda_scope.devices.sim_camera import BlobVolumes
+
+SHAPE = (10, 40, 60)
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.float32])
+def test_shape_dtype_and_range(dtype):
+    volumes = BlobVolumes(SHAPE, dtype)
+    x = volumes.next()
+
+    assert x.shape == SHAPE
+    assert x.dtype == dtype
+    assert x.min() >= 0
+    assert x.max() <= volumes.max_value
+
+
+def test_blobs_are_drawn_at_their_positions():
+    volumes = BlobVolumes(SHAPE, np.uint16, n_blobs=1, background=1.0)
+    center = np.rint(volumes.position[0]).astype(int)
+    x = volumes.next().astype(np.float64)
+
+    assert x[tuple(center)] > 0.3 * volumes.max_value
+    assert np.median(x) < 10
+
+
+def test_blobs_move_and_stay_inside():
+    volumes = BlobVolumes(SHAPE, np.uint16)
+    first = volumes.position.copy()
+    upper = np.array(SHAPE) - 1
+
+    for _ in range(500):
+        volumes.next()
+        assert (volumes.position >= 0).all()
+        assert (volumes.position <= upper).all()
+
+    assert not np.allclose(volumes.position, first)
+
+
+def test_volumes_repeat_for_a_seed():
+    a = BlobVolumes(SHAPE, np.uint16, seed=3)
+    b = BlobVolumes(SHAPE, np.uint16, seed=3)
+    for _ in range(3):
+        assert np.array_equal(a.next(), b.next())
+
+
+def test_set_shape():
+    volumes = BlobVolumes(SHAPE, np.uint16)
+    volumes.next()
+    volumes.set_shape((4, 16, 8))
+
+    assert volumes.next().shape == (4, 16, 8)
+    assert volumes.count == 1
@@ -0,0 +1,51 @@
+import numpy as np
+
+from lambda_scope.devices.ul_helpers.sim_daq import (
+    SimulatedDAQDevice,
+    counts_to_volts,
+    rising_edges,
+    volts_to_counts)
+
+
+def test_counts_round_trip():
+    volts = np.array([-10.0, -2.5, 0.0, 3.3, 10.0])
+    assert np.allclose(counts_to_volts(volts_to_counts(volts)), volts, atol=1e-3)
+
+
+def test_rising_edges():
+    x = np.array([5, 0, 0, 5, 5, 0, 5])
+    assert list(rising_edges(x, 2.0)) == [0, 3, 6]
+
+
+def test_scan_is_recorded_and_played(port):
+    daq = SimulatedDAQDevice("sim", 0, triggers=("localhost", port, False))
+    try:
+        waveform = np.zeros((8, 2))
+        waveform[::4, 1] = 5.0
+        waveform[:, 0] = np.arange(8)
+        daq.allocate_buffer(waveform.size)
+        daq.fill_ctypes_buffer(volts_to_counts(waveform.ravel()))
+
+        rate = daq.a_out_scan(0, 1, waveform.size, 1000)
+        assert rate == 1000
+        scan = daq.scans[-1]
+        assert np.allclose(scan["waveform"], waveform, atol=1e-3)
+        assert daq.n_triggers == 2
+        assert abs(daq.v_in(0) - 7) < 1e-3
+    finally:
+        daq.release()
+
+
+def test_history_and_scans_are_bounded():
+    daq = SimulatedDAQDevice("sim", 0, history_size=10, scans_size=3)
+    daq.allocate_buffer(4)
+    for i in range(100):
+        daq.v_out(0, i)
+    for _ in range(5):
+        daq.a_out_scan(0, 0, 4, 10000)
+
+    assert len(daq.history) == 10
+    assert daq.history[-1][3] == 99
+    assert len(daq.scans) == 3
+    assert daq.samples_out() == 4
+    daq.release()
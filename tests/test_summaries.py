@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from lambda_scope.writers.array_reader import ArrayReader
+from lambda_scope.writers.array_writer import TimestampedArrayWriter
+from lambda_scope.writers.segmented_writer import SegmentedArrayWriter
+from lambda_scope.writers.summaries import summarize, summary_shape
+
+SHAPE = (3, 9, 13)
+NAMES = ["mip_z", "mip_y", "mip_x", "down_2", "down_4"]
+
+
+def volume(seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 4096, SHAPE, dtype=np.uint16)
+
+
+def block_mean(x, factor):
+    (z, y, x_) = x.shape
+    x = x[:, :y // factor * factor, :x_ // factor * factor].astype(np.float64)
+    return x.reshape(z, y // factor, factor, x_ // factor, factor).mean(axis=(2, 4))
+
+
+def references(x):
+    return {
+        "mip_z": x.max(axis=0),
+        "mip_y": x.max(axis=1),
+        "mip_x": x.max(axis=2),
+        "down_2": np.rint(block_mean(x, 2)).astype(x.dtype),
+        "down_4": np.rint(block_mean(x, 4)).astype(x.dtype),
+    }
+
+
+def test_summaries_match_numpy():
+    x = volume()
+    expected = references(x)
+    for (name, out) in zip(NAMES, summarize(x, NAMES)):
+        assert out.shape == summary_shape(name, SHAPE)
+        assert out.dtype == x.dtype
+        assert np.array_equal(out, expected[name]), name
+
+
+def test_order_of_names_is_kept():
+    x = volume()
+    (down, mip) = summarize(x, ["down_2", "mip_x"])
+    assert np.array_equal(mip, x.max(axis=2))
+    assert down.shape == (3, 4, 6)
+
+
+@pytest.mark.parametrize("name", ["down_3", "down_1", "mean_z", "down_"])
+def test_unknown_summaries(name):
+    with pytest.raises(ValueError):
+        summary_shape(name, SHAPE)
+
+
+def test_summaries_need_volumes():
+    with pytest.raises(ValueError):
+        summary_shape("mip_z", (9, 13))
+
+
+@pytest.mark.parametrize("segmented", [False, True])
+def test_saved_summaries(tmp_path, segmented):
+    filename = str(tmp_path / "data.h5")
+    if segmented:
+        writer = SegmentedArrayWriter(None, filename, SHAPE, np.uint16,
+                                      max_frames=2, summaries=NAMES)
+    else:
+        writer = TimestampedArrayWriter(None, filename, SHAPE, np.uint16,
+                                        summaries=NAMES, summary_workers=2)
+    data = [volume(i) for i in range(5)]
+    for (i, x) in enumerate(data):
+        writer.append_data((float(i), x))
+    writer.close()
+
+    with ArrayReader(filename) as reader:
+        assert sorted(reader.summaries) == sorted(NAMES)
+        for (i, x) in enumerate(data):
+            expected = references(x)
+            for name in NAMES:
+                assert np.array_equal(reader.summaries[name][i], expected[name])
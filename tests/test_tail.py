@@ -0,0 +1,76 @@
+import h5py
+import numpy as np
+
+from lambda_scope.writers.array_reader import tail
+from lambda_scope.writers.array_writer import TimestampedArrayWriter
+from lambda_scope.writers.directory_writer import DirectoryArrayWriter
+
+SHAPE = (2, 3, 4)
+
+
+def append(writer, start, stop):
+    for i in range(start, stop):
+        writer.append_data((float(i), np.full(SHAPE, i, np.uint16)))
+
+
+def take(frames, n):
+    return [next(frames) for _ in range(n)]
+
+
+def check(items, start):
+    for (i, (t, x)) in enumerate(items, start):
+        assert t == i
+        assert (x == i).all()
+
+
+def test_swmr_file_is_tailed_while_written(tmp_path):
+    filename = str(tmp_path / "data.h5")
+    writer = TimestampedArrayWriter(None, filename, SHAPE, np.uint16,
+                                    swmr=True, flush_interval=0)
+    append(writer, 0, 3)
+
+    frames = tail(filename, timeout=1)
+    check(take(frames, 3), 0)
+
+    append(writer, 3, 5)
+    check(take(frames, 2), 3)
+    frames.close()
+    writer.close()
+
+
+def test_swmr_datasets_grow_to_the_frames_written(tmp_path):
+    filename = str(tmp_path / "data.h5")
+    writer = TimestampedArrayWriter(None, filename, SHAPE, np.uint16,
+                                    swmr=True, batch_size=2)
+    append(writer, 0, 5)
+
+    assert writer.data.shape[0] == 4
+    assert writer.times.shape[0] == 4
+    writer.close()
+
+    with h5py.File(filename, "r") as file:
+        assert file["data"].shape == (5, *SHAPE)
+
+
+def test_directory_store_is_tailed_while_written(tmp_path):
+    filename = str(tmp_path / "data.zarr")
+    writer = DirectoryArrayWriter(None, filename, SHAPE, np.uint16, metadata_interval=0)
+    append(writer, 0, 2)
+
+    frames = tail(filename, start=1, timeout=1)
+    check(take(frames, 1), 1)
+
+    append(writer, 2, 4)
+    check(take(frames, 2), 2)
+    frames.close()
+    writer.close()
+
+
+def test_tail_stops_after_timeout(tmp_path):
+    filename = str(tmp_path / "data.h5")
+    writer = TimestampedArrayWriter(None, filename, SHAPE, np.uint16,
+                                    swmr=True, flush_interval=0)
+    append(writer, 0, 2)
+
+    assert len(list(tail(filename, timeout=0.2, poll_interval=0.05))) == 2
+    writer.close()
@@ -0,0 +1,116 @@
+import time
+import threading
+
+import numpy as np
+import pytest
+
+from lambda_scope.devices.writer import WriteSession
+from lambda_scope.zmq.array import TimestampedPublisher
+
+from conftest import free_ports, settle
+
+
+class BrokenWriter():
+
+    def __init__(self):
+        self.appended = 0
+        self.closed = 0
+
+    def append_data(self, msg):
+        self.appended += 1
+        raise OSError("No space left on device")
+
+    def close(self):
+        self.closed += 1
+
+
+@pytest.fixture
+def session(tmp_path):
+    (data_port, commands_port, status_port) = free_ports(3)
+    session = WriteSession(data_in=("localhost", data_port, False),
+                           commands_in=("localhost", commands_port, False),
+                           status_out=("localhost", status_port, False),
+                           fmt="UINT16_ZYX_2_4_4",
+                           saving_mode="0",
+                           directory=str(tmp_path),
+                           queue_size=2)
+    session.persist_thread.start()
+    yield session
+    session.queue.put((None, None))
+    session.persist_thread.join(5)
+
+
+def test_write_error_is_reported_and_stops_queueing(session):
+    writer = BrokenWriter()
+    session.writer = writer
+    session.subscription_status = 1
+
+    volume = (0.0, np.zeros((2, 4, 4), np.uint16))
+    for _ in range(2):
+        session.queue_slots.acquire()
+        session.queue.put((writer, volume))
+    time.sleep(0.2)
+
+    assert writer.appended == 1
+    assert writer.closed == 1
+    assert "No space left on device" in session.write_error
+    session.update_status()
+    assert "No space left on device" in session.status["error"]
+
+    session.receive()
+    assert session.subscription_status == 0
+    time.sleep(0.1)
+    assert writer.closed == 1
+
+
+def test_stop_does_not_wait_for_a_full_queue(session):
+    release = threading.Event()
+
+    class SlowWriter():
+        def append_data(self, msg):
+            release.wait(5)
+
+        def close(self):
+            pass
+
+    writer = SlowWriter()
+    session.writer = writer
+    session.subscription_status = 1
+    volume = (0.0, np.zeros((2, 4, 4), np.uint16))
+    for _ in range(3):
+        session.queue_slots.acquire()
+        session.queue.put((writer, volume))
+    time.sleep(0.1)
+    assert not session.queue_slots.acquire(blocking=False)
+
+    start = time.time()
+    session.stop()
+    assert time.time() - start < 0.5
+    release.set()
+
+
+def test_drop_oldest_queues_the_newest_volume(tmp_path):
+    (data_port, commands_port, status_port) = free_ports(3)
+    publisher = TimestampedPublisher("*", data_port, (2, 4, 4), np.uint16,
+                                     bound=True, header=True)
+    session = WriteSession(data_in=("localhost", data_port, False),
+                           commands_in=("localhost", commands_port, False),
+                           status_out=("localhost", status_port, False),
+                           fmt="UINT16_ZYX_2_4_4",
+                           saving_mode="0",
+                           directory=str(tmp_path),
+                           policy="drop-oldest")
+    settle()
+
+    session.writer = object()
+    for i in range(5):
+        publisher.send(np.full((2, 4, 4), i, np.uint16))
+    time.sleep(0.2)
+    session.receive()
+    session.receive()
+
+    (_, (_, data)) = session.queue.get_nowait()
+    assert (data == 4).all()
+    assert session.queue.empty()
+    assert session.data_subscriber.skipped == 4
+    publisher.socket.close()